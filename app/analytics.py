@@ -0,0 +1,285 @@
+import math
+import os
+import re
+import time
+from array import array
+
+import numpy as np
+
+from .config import ANALYTICS_MAX_KEYWORDS
+
+# С каким числом каналов из снимков сравнивать аудиторию (самые свежие снимки)
+OVERLAP_CHANNELS = int(os.getenv('ANALYTICS_OVERLAP_CHANNELS', '20'))
+# Сколько каналов пакетного запроса помещается в битовую маску uint64
+MAX_MASK_CHANNELS = 64
+# Статусы профиля (как в profile_fields) и их коды в колонке статусов; 0 — скрыт или неизвестен
+STATUS_CODES = {'online': 1, 'offline': 2, 'recently': 3, 'last_week': 4, 'last_month': 5}
+# Корзины активности: точное время «был в сети» делится по давности в днях,
+# для скрытого времени используются приблизительные статусы Telegram
+ACTIVITY_BUCKETS = ('online', 'day', 'week', 'month', 'older', 'recently', 'last_week', 'last_month', 'hidden')
+ACTIVITY_DAYS = (1, 7, 30)
+# Корзина для каждого кода статуса; для offline (-1) выбирается по давности
+_STATUS_BUCKETS = np.array([8, 0, -1, 5, 6, 7])
+# Язык bio по преобладающей письменности; other — в bio нет букв этих алфавитов
+LANGUAGES = ('ru', 'uk', 'latin', 'arabic', 'cjk', 'other')
+# Флаги пользователя в колонке флагов
+BOT, DELETED, PREMIUM, HAS_USERNAME, PROFILE_KNOWN = 1, 2, 4, 8, 16
+# Разделитель bio в общем буфере: ключевые слова не содержат перевода строки,
+# поэтому совпадение не может захватить соседние bio
+BIO_SEPARATOR = b'\n'
+
+
+def normalize_keywords(keywords):
+    """Ключевые слова в нижнем регистре, без повторов и лишних пробелов"""
+    normalized = []
+    for keyword in keywords or ():
+        keyword = ' '.join(str(keyword).lower().split())
+        if keyword and keyword not in normalized:
+            normalized.append(keyword)
+    if len(normalized) > ANALYTICS_MAX_KEYWORDS:
+        raise ValueError(f"Не более {ANALYTICS_MAX_KEYWORDS} ключевых слов для аналитики")
+    return normalized
+
+
+class AudienceAnalytics:
+    """Аналитика аудитории по строкам парсинга: доли ботов, удалённых и премиум-аккаунтов,
+    активность, язык и ключевые слова bio, пересечения с другими каналами.
+
+    Строки добавляются по одной (``add``) по мере обогащения и сразу
+    раскладываются по компактным колонкам: user_id, флаги, статус, время
+    «был в сети» и bio в нижнем регистре одним буфером UTF-8 со смещениями.
+    ``summary`` считает всё векторно в numpy над этими колонками, без
+    проходов Python по строкам, — миллион участников обрабатывается за секунды.
+    """
+
+    def __init__(self, keywords=(), with_bio=True, clock=time.time):
+        self.keywords = normalize_keywords(keywords)
+        self.with_bio = with_bio
+        self._clock = clock
+        self._ids = array('q')
+        self._flags = array('B')
+        self._status = array('B')
+        self._was_online = array('d')
+        self._bio_starts = array('q')
+        self._bio = bytearray()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, row, profile=None, was_online=None):
+        """Добавляет строку выгрузки.
+
+        ``profile`` — поля profile_fields пользователя, ``was_online`` —
+        unix-время последнего визита для статуса offline. Для строк,
+        восстановленных с контрольной точки, профиля нет: их флаги и статус
+        считаются неизвестными.
+        """
+        self._ids.append(row['user_id'])
+        if profile is None:
+            flags = HAS_USERNAME if row.get('username') else 0
+            status = 0
+        else:
+            flags = PROFILE_KNOWN
+            if profile['bot']:
+                flags |= BOT
+            if profile['deleted']:
+                flags |= DELETED
+            if profile['premium']:
+                flags |= PREMIUM
+            if profile['username']:
+                flags |= HAS_USERNAME
+            status = STATUS_CODES.get(profile['status'], 0)
+        self._flags.append(flags)
+        self._status.append(status)
+        self._was_online.append(math.nan if was_online is None else was_online)
+        self._bio_starts.append(len(self._bio))
+        bio = row.get('bio')
+        if bio:
+            self._bio += bio.lower().encode('utf-8')
+        self._bio += BIO_SEPARATOR
+
+    def user_ids(self):
+        """Отсортированные уникальные user_id аудитории"""
+        return np.unique(np.array(self._ids, dtype=np.int64))
+
+    def summary(self, snapshots=()):
+        """Сводка по всем добавленным строкам.
+
+        ``snapshots`` — пары (channel_id, user_id участников) каналов,
+        с которыми считается пересечение аудитории.
+        """
+        total = len(self._ids)
+        summary = {'users': total}
+        if not total:
+            return summary
+        flags = np.array(self._flags, dtype=np.uint8)
+        known = flags & PROFILE_KNOWN != 0
+        profiles = int(np.count_nonzero(known))
+        summary['profiles'] = profiles
+        summary['ratios'] = {
+            'bot': _share(np.count_nonzero(flags & BOT), profiles),
+            'deleted': _share(np.count_nonzero(flags & DELETED), profiles),
+            'premium': _share(np.count_nonzero(flags & PREMIUM), profiles),
+            'no_username': _share(total - np.count_nonzero(flags & HAS_USERNAME), total),
+        }
+        summary['activity'] = self._activity()
+        if self.with_bio:
+            summary['bio'] = self._bio_summary(total)
+        if snapshots:
+            summary['overlap'] = self._overlap(snapshots)
+        return summary
+
+    def _activity(self):
+        status = np.array(self._status, dtype=np.uint8)
+        buckets = _STATUS_BUCKETS[status]
+        offline = buckets < 0
+        age_days = (self._clock() - np.array(self._was_online, dtype=np.float64)[offline]) / 86400
+        # Без времени визита (nan) пользователь попадает в самую давнюю корзину
+        buckets[offline] = 1 + np.digitize(np.nan_to_num(age_days, nan=np.inf), ACTIVITY_DAYS)
+        counts = np.bincount(buckets, minlength=len(ACTIVITY_BUCKETS))
+        return dict(zip(ACTIVITY_BUCKETS, counts.tolist()))
+
+    def _bio_summary(self, total):
+        data = np.frombuffer(self._bio, dtype=np.uint8)
+        starts = np.array(self._bio_starts, dtype=np.int64)
+        # У каждого bio есть хотя бы разделитель, поэтому отрезки непустые
+        lengths = np.diff(np.append(starts, len(data)))
+        has_bio = lengths > 1
+        languages = _languages(data, starts)[has_bio]
+        counts = np.bincount(languages, minlength=len(LANGUAGES))
+        result = {
+            'with_bio': int(np.count_nonzero(has_bio)),
+            'no_bio_ratio': _share(total - np.count_nonzero(has_bio), total),
+            'languages': dict(zip(LANGUAGES, counts.tolist())),
+        }
+        if self.keywords:
+            matched = np.zeros(total, dtype=bool)
+            keywords = {}
+            for keyword in self.keywords:
+                rows = _matching_rows(self._bio, starts, keyword)
+                matched[rows] = True
+                keywords[keyword] = int(rows.size)
+            result['keywords'] = keywords
+            result['any_keyword'] = int(np.count_nonzero(matched))
+        return result
+
+    def _overlap(self, snapshots):
+        ids = self.user_ids()
+        overlap = {}
+        for channel_id, members in snapshots:
+            members = np.fromiter(members, dtype=np.int64)
+            shared = _count_in(ids, members)
+            overlap[str(channel_id)] = {
+                'members': int(members.size),
+                'shared': shared,
+                'share': _share(shared, ids.size),
+            }
+        return overlap
+
+
+def _share(count, total):
+    return round(int(count) / total, 4) if total else 0.0
+
+
+def _count_in(sorted_ids, values):
+    """Сколько ``values`` есть в отсортированном массиве ``sorted_ids``"""
+    if not sorted_ids.size or not values.size:
+        return 0
+    positions = np.searchsorted(sorted_ids, values).clip(max=sorted_ids.size - 1)
+    return int(np.count_nonzero(sorted_ids[positions] == values))
+
+
+def _matching_rows(buffer, starts, keyword):
+    """Номера строк, в bio которых есть ``keyword`` (подстрока, без учёта регистра)"""
+    pattern = re.compile(re.escape(keyword.encode('utf-8')))
+    positions = np.fromiter((match.start() for match in pattern.finditer(buffer)), dtype=np.int64)
+    return np.unique(np.searchsorted(starts, positions, side='right') - 1)
+
+
+def _languages(data, starts):
+    """Код языка (индекс в LANGUAGES) для каждого bio по байтам UTF-8.
+
+    Буквы считаются по ведущим байтам: кириллица U+0400–U+04FF начинается
+    с 0xD0–0xD3, арабский — с 0xD8–0xDB, иероглифы CJK — с 0xE4–0xE9,
+    латиница — строчные ASCII. Украинский отличается от русского буквами
+    є, і, ї, ґ.
+    """
+    cyrillic = (data >= 0xD0) & (data <= 0xD3)
+    latin = (data >= 0x61) & (data <= 0x7A)
+    arabic = (data >= 0xD8) & (data <= 0xDB)
+    cjk = (data >= 0xE4) & (data <= 0xE9)
+    ukrainian = np.zeros(len(data), dtype=bool)
+    lead, follow = data[:-1], data[1:]
+    ukrainian[:-1] = ((lead == 0xD1) & ((follow == 0x94) | (follow == 0x96) | (follow == 0x97))
+                      | (lead == 0xD2) & (follow == 0x91))
+    scripts = np.stack([
+        np.add.reduceat(mask.view(np.uint8), starts, dtype=np.int64)
+        for mask in (cyrillic, latin, arabic, cjk)
+    ], axis=1)
+    has_ukrainian = np.add.reduceat(ukrainian.view(np.uint8), starts, dtype=np.int64) > 0
+    best = scripts.argmax(axis=1)
+    return np.select(
+        [scripts.max(axis=1) == 0, (best == 0) & has_ukrainian, best == 0, best == 1, best == 2],
+        [5, 1, 0, 2, 3],
+        default=4
+    )
+
+
+def membership_columns(member_lists):
+    """Столбцы принадлежности каналам над объединением их участников"""
+    arrays = [np.fromiter(members, dtype=np.int64) for members in member_lists]
+    if not arrays:
+        return []
+    union, inverse = np.unique(np.concatenate(arrays), return_inverse=True)
+    columns = []
+    offset = 0
+    for members in arrays:
+        column = np.zeros(union.size, dtype=bool)
+        column[inverse[offset:offset + members.size]] = True
+        offset += members.size
+        columns.append(column)
+    return columns
+
+
+def overlap_by_masks(masks, labels, parsed=None):
+    """Матрица пересечений каналов пакетного запроса по битовым маскам пользователей.
+
+    Бит i маски — канал ``labels[i]``; в матрицу попадают только каналы из
+    ``parsed``. Маски дольше 64 бит numpy не вмещает — тогда None.
+    """
+    if len(labels) > MAX_MASK_CHANNELS:
+        return None
+    masks = np.fromiter(masks, dtype=np.uint64)
+    keep = [i for i, label in enumerate(labels) if parsed is None or label in parsed]
+    columns = [(masks >> np.uint64(i)) & np.uint64(1) == 1 for i in keep]
+    return overlap_matrix([labels[i] for i in keep], columns)
+
+
+def overlap_matrix(labels, columns):
+    """Матрица пересечений {канал: {канал: общих участников}}; на диагонали — размер канала"""
+    matrix = {label: {} for label in labels}
+    for i, first in enumerate(labels):
+        for j in range(i, len(labels)):
+            shared = int(np.count_nonzero(columns[i] & columns[j]))
+            matrix[first][labels[j]] = shared
+            matrix[labels[j]][first] = shared
+    return matrix
+
+
+def snapshot_overlap(store, channel_ids=None, limit=OVERLAP_CHANNELS):
+    """Матрица пересечений каналов по их последним снимкам (по умолчанию — самые свежие)"""
+    if not channel_ids:
+        channel_ids = [channel_id for channel_id, _, _ in store.channels(limit)]
+    channel_ids = [channel_id for channel_id in channel_ids if store.info(channel_id)]
+    columns = membership_columns([store.user_ids(channel_id) for channel_id in channel_ids])
+    return overlap_matrix([str(channel_id) for channel_id in channel_ids], columns)
+
+
+def summary_rows(summary, prefix=''):
+    """Сводка в виде строк (показатель, значение) для листа выгрузки"""
+    for key, value in summary.items():
+        name = f'{prefix}.{key}' if prefix else str(key)
+        if isinstance(value, dict):
+            yield from summary_rows(value, name)
+        else:
+            yield name, value
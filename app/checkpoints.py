@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка контрольных точек недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в строках) сохранять состояние контрольной точки
+DEFAULT_CHECKPOINT_INTERVAL = int(os.getenv('CHECKPOINT_INTERVAL', '500'))
+# Сколько секунд с последнего сохранения контрольная точка пригодна для продолжения
+DEFAULT_CHECKPOINT_MAX_AGE = int(os.getenv('CHECKPOINT_MAX_AGE', str(24 * 3600)))
+
+
+class Checkpoint:
+    """Контрольная точка парсинга канала на диске.
+
+    ``rows.ndjson`` — уже обогащённые строки (дописываются по мере готовности),
+    ``state.json`` — смещение страницы участников, с которой надо продолжить.
+    Строки сбрасываются на диск раньше состояния, поэтому смещение никогда не
+    опережает сохранённые строки; дубли при повторном чтении страницы
+    отсекаются по user_id.
+
+    Одну точку одновременно ведёт только один парсинг: ``acquire`` берёт
+    эксклюзивную блокировку файла ``<directory>.lock`` (вне каталога, который
+    удаляется по завершении). Точка старше ``max_age`` секунд не продолжается,
+    а начинается заново.
+    """
+
+    def __init__(self, directory, interval=DEFAULT_CHECKPOINT_INTERVAL, max_age=DEFAULT_CHECKPOINT_MAX_AGE,
+                 clock=time.time):
+        self.directory = directory
+        self.interval = max(1, interval)
+        self.max_age = max_age
+        self._clock = clock
+        self.state_path = os.path.join(directory, 'state.json')
+        self.rows_path = os.path.join(directory, 'rows.ndjson')
+        self.lock_path = directory.rstrip(os.sep) + '.lock'
+        self._load()
+        self._rows_file = None
+        self._lock = None
+        self._pending = 0
+
+    def _load(self):
+        self.state = {'offset': 0, 'rows': 0}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def acquire(self):
+        """Захватывает точку; False, если её уже ведёт другой парсинг (в этом или другом процессе)"""
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+            handle = open(self.lock_path, 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+            self._lock = handle
+        # Пока точка была свободна, её мог дописать или завершить другой парсинг
+        self._load()
+        if self.exists and self.age() > self.max_age:
+            logger.info(f"Контрольная точка {self.directory} устарела, парсинг начнётся заново")
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._load()
+        return True
+
+    def release(self):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def age(self):
+        """Секунды с последнего сохранения (для несохранённого состояния — с записи строк)"""
+        updated_at = self.state.get('updated_at')
+        if updated_at is None:
+            try:
+                updated_at = os.path.getmtime(self.rows_path)
+            except OSError:
+                return 0
+        return self._clock() - updated_at
+
+    @property
+    def exists(self):
+        return os.path.exists(self.rows_path)
+
+    @property
+    def offset(self):
+        return self.state['offset']
+
+    def rows(self):
+        """Строки, сохранённые прошлым запуском, без повторов по user_id;
+        оборванная последняя строка пропускается"""
+        if not self.exists:
+            return
+        seen = set()
+        with open(self.rows_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Пропущена повреждённая строка контрольной точки {self.rows_path}")
+                    continue
+                if row['user_id'] not in seen:
+                    seen.add(row['user_id'])
+                    yield row
+
+    def add_row(self, row, offset):
+        if self._rows_file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._rows_file = open(self.rows_path, 'a', encoding='utf-8')
+        self._rows_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self.state['offset'] = offset
+        self.state['rows'] += 1
+        self._pending += 1
+        if self._pending >= self.interval:
+            self.save()
+
+    def save(self):
+        if self._rows_file is None:
+            return
+        self._rows_file.flush()
+        os.fsync(self._rows_file.fileno())
+        self.state['updated_at'] = self._clock()
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+        self._pending = 0
+
+    def close(self):
+        """Сохраняет состояние и закрывает файл строк (парсинг прерван)"""
+        try:
+            self.save()
+        finally:
+            if self._rows_file is not None:
+                self._rows_file.close()
+                self._rows_file = None
+            self.release()
+
+    def remove(self):
+        """Удаляет контрольную точку после успешного завершения"""
+        if self._rows_file is not None:
+            self._rows_file.close()
+            self._rows_file = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+        # Файл блокировки остаётся: его удаление позволило бы двум парсингам
+        # держать блокировки разных файлов с одним именем
+        self.release()
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from telethon import TelegramClient
+from telethon.errors import (
+    FloodWaitError, UserDeactivatedBanError, UserDeactivatedError, AuthKeyUnregisteredError,
+    PhoneNumberBannedError, SessionRevokedError
+)
+
+from .membership import MembershipManager
+from .rate_limiter import AdaptiveRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Имена файлов сессий (через запятую) в директории sessions
+DEFAULT_SESSION_NAMES = [
+    name.strip() for name in os.getenv('TELEGRAM_SESSIONS', 'user_session').split(',') if name.strip()
+]
+# Сколько задач может одновременно работать через один клиент
+DEFAULT_JOBS_PER_SESSION = int(os.getenv('JOBS_PER_SESSION', '4'))
+# Интервал проверки соединений (секунды)
+DEFAULT_HEALTH_CHECK_INTERVAL = int(os.getenv('CLIENT_HEALTH_CHECK_INTERVAL', '60'))
+
+# Ошибки, после которых аккаунт больше не может выполнять запросы
+BAN_ERRORS = (UserDeactivatedBanError, UserDeactivatedError, AuthKeyUnregisteredError,
+              PhoneNumberBannedError, SessionRevokedError)
+# Ошибки, из-за которых работу нужно передать другому аккаунту
+ACCOUNT_ERRORS = (FloodWaitError,) + BAN_ERRORS
+
+
+class PooledSession:
+    """Авторизованная сессия пула: клиент, его ограничитель скорости, реестр членства и счётчики.
+
+    Сессия следит за здоровьем аккаунта: долгий FloodWait, который ограничитель
+    не стал пережидать, выводит её из работы до его окончания, а ошибки
+    блокировки аккаунта (``BAN_ERRORS``) — насовсем.
+    """
+
+    def __init__(self, name, client, rate_limiter, clock=time.monotonic):
+        self.name = name
+        self.client = client
+        self.rate_limiter = rate_limiter
+        # Членство в каналах общее для всех задач аккаунта: вступления делятся, выходы откладываются
+        self.membership = MembershipManager(self.call)
+        self.authorized = False
+        self.banned = False
+        self.flood_until = 0.0
+        self.long_flood_waits = 0
+        self.active_leases = 0
+        self.reconnects = 0
+        self.last_error = None
+        self._clock = clock
+
+    @property
+    def available(self):
+        return self.authorized and not self.banned and self._clock() >= self.flood_until
+
+    def health(self):
+        if self.banned:
+            return 'banned'
+        if not self.authorized:
+            return 'down'
+        if self._clock() < self.flood_until:
+            return 'flood_wait'
+        return 'ok'
+
+    async def call(self, request):
+        """Запрос от имени аккаунта; отмечает долгий FloodWait и блокировку"""
+        try:
+            return await self.rate_limiter.call(self.client, request)
+        except FloodWaitError as e:
+            self.flood_until = max(self.flood_until, self._clock() + e.seconds)
+            self.long_flood_waits += 1
+            logger.warning(f"Сессия {self.name} выведена из работы на {e.seconds} с из-за FloodWait")
+            raise
+        except BAN_ERRORS as e:
+            self.banned = True
+            self.authorized = False
+            self.last_error = str(e)
+            logger.error(f"Сессия {self.name} заблокирована: {str(e)}")
+            raise
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'health': self.health(),
+            'authorized': self.authorized,
+            'connected': self.client.is_connected(),
+            'active_leases': self.active_leases,
+            'reconnects': self.reconnects,
+            'long_flood_waits': self.long_flood_waits,
+            'flood_wait_remaining': round(max(0.0, self.flood_until - self._clock()), 1),
+            'last_error': self.last_error,
+            'rate_limiter': self.rate_limiter.stats(),
+            'membership': self.membership.stats(),
+        }
+
+
+class ClientPool:
+    """Долгоживущие клиенты Telegram на всё время работы приложения.
+
+    Каждая сессия подключается один раз при старте и раздаётся задачам через
+    ``lease()``: задача получает наименее загруженную сессию, на одну сессию
+    приходится не больше ``jobs_per_session`` задач. ``lease_many()`` выдаёт
+    задаче несколько аккаунтов, между которыми она распределяет запросы. Один клиент на файл сессии
+    исключает конкуренцию за SQLite-файл между одновременными запросами.
+    """
+
+    def __init__(self, api_id, api_hash, session_dir, session_names=None,
+                 jobs_per_session=DEFAULT_JOBS_PER_SESSION,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL, client_factory=None,
+                 rate_limiter_factory=AdaptiveRateLimiter):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.session_dir = session_dir
+        self.session_names = session_names or DEFAULT_SESSION_NAMES
+        self.jobs_per_session = max(1, jobs_per_session)
+        self.health_check_interval = health_check_interval
+        self._client_factory = client_factory or self._create_client
+        # У каждого аккаунта свой ограничитель: лимиты Telegram действуют на аккаунт
+        self._rate_limiter_factory = rate_limiter_factory
+        self.sessions = []
+        self.started = False
+        self._condition = asyncio.Condition()
+        self._start_lock = asyncio.Lock()
+        self._health_task = None
+
+    def _create_client(self, name):
+        client = TelegramClient(os.path.join(self.session_dir, name), self.api_id, self.api_hash)
+        # FloodWait обрабатывает rate_limiter, а не встроенный сон Telethon
+        client.flood_sleep_threshold = 0
+        return client
+
+    async def start(self):
+        """Подключает все сессии; неавторизованные пропускаются с предупреждением"""
+        for name in self.session_names:
+            session = PooledSession(name, self._client_factory(name), self._rate_limiter_factory())
+            self.sessions.append(session)
+            await self._check(session)
+        self.started = True
+        healthy = sum(1 for session in self.sessions if session.authorized)
+        logger.info(f"Пул клиентов запущен: {healthy} из {len(self.sessions)} сессий авторизованы")
+        if self.health_check_interval:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        for session in self.sessions:
+            try:
+                # Выходим из каналов, ожидающих отложенного выхода, пока клиент ещё подключён
+                if session.authorized:
+                    await session.membership.close()
+                if session.client.is_connected():
+                    await session.client.disconnect()
+            except Exception as e:
+                logger.error(f"Ошибка при отключении сессии {session.name}: {str(e)}")
+        self.sessions = []
+        self.started = False
+
+    async def _check(self, session):
+        """Проверяет соединение и авторизацию сессии, переподключая при необходимости"""
+        if session.banned:
+            return False
+        try:
+            if not session.client.is_connected():
+                if session.authorized:
+                    session.reconnects += 1
+                await session.client.connect()
+            session.authorized = await session.client.is_user_authorized()
+            session.last_error = None
+            if not session.authorized:
+                logger.warning(f"Сессия {session.name} не авторизована и не будет использоваться")
+        except Exception as e:
+            session.authorized = False
+            session.last_error = str(e)
+            logger.error(f"Не удалось подключить сессию {session.name}: {str(e)}")
+        return session.authorized
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for session in self.sessions:
+                await self._check(session)
+            # Сессии могли вернуться после FloodWait или переподключения
+            async with self._condition:
+                self._condition.notify_all()
+
+    def _pick(self, count=1):
+        candidates = [
+            session for session in self.sessions
+            if session.available and session.active_leases < self.jobs_per_session
+        ]
+        return sorted(candidates, key=lambda session: session.active_leases)[:count]
+
+    @asynccontextmanager
+    async def lease(self):
+        """Выдаёт наименее загруженную авторизованную сессию на время задачи"""
+        async with self.lease_many(1) as sessions:
+            yield sessions[0]
+
+    @asynccontextmanager
+    async def lease_many(self, count):
+        """Выдаёт до ``count`` разных сессий, начиная с наименее загруженной.
+
+        Ждёт, пока освободится хотя бы одна; остальные берутся из доступных
+        прямо сейчас, так что задача не простаивает ради лишних аккаунтов.
+        Если пул ещё не запущен (быстрый старт), сессии подключаются здесь.
+        """
+        if not self.started:
+            async with self._start_lock:
+                if not self.started:
+                    await self.start()
+        if not any(session.authorized and not session.banned for session in self.sessions):
+            raise RuntimeError("Нет авторизованных сессий Telegram")
+        async with self._condition:
+            await self._condition.wait_for(lambda: bool(self._pick()))
+            sessions = self._pick(max(1, count))
+            for session in sessions:
+                session.active_leases += 1
+        try:
+            for session in sessions:
+                if not session.client.is_connected():
+                    await self._check(session)
+            yield sessions
+        finally:
+            async with self._condition:
+                for session in sessions:
+                    session.active_leases -= 1
+                self._condition.notify_all()
+
+    def stats(self):
+        return {
+            'sessions': [session.stats() for session in self.sessions],
+            'jobs_per_session': self.jobs_per_session,
+        }
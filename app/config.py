@@ -0,0 +1,40 @@
+import os
+
+from dotenv import load_dotenv
+
+# Переменные из .env читаются один раз, до констант остальных модулей
+load_dotenv()
+
+# Сколько запросов GetFullUserRequest может выполняться одновременно
+DEFAULT_ENRICH_CONCURRENCY = int(os.getenv('ENRICH_CONCURRENCY', '8'))
+# Быстрый старт (serverless): клиенты Telegram подключаются при первом парсинге,
+# а не при старте приложения. По умолчанию включён на Vercel
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', '1' if os.getenv('VERCEL') else '0') == '1'
+# Сессии Telegram и служебные базы процесса (кэши, снимки, очередь задач)
+SESSIONS_DIR = os.getenv('SESSIONS_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sessions'))
+# Предельное число ключевых слов для поиска в bio при аналитике аудитории
+ANALYTICS_MAX_KEYWORDS = 50
+
+
+class Settings:
+    """Учётные данные Telegram API"""
+
+    def __init__(self, api_id, api_hash):
+        if not api_id or not api_hash:
+            raise ValueError("API_ID and API_HASH must be set in environment variables")
+        try:
+            self.api_id = int(api_id)
+        except ValueError:
+            raise ValueError("API_ID must be a number")
+        self.api_hash = api_hash
+
+
+_settings = None
+
+
+def get_settings():
+    """Настройки из окружения; проверяются при первом обращении и дальше не перечитываются"""
+    global _settings
+    if _settings is None:
+        _settings = Settings(os.getenv('API_ID'), os.getenv('API_HASH'))
+    return _settings
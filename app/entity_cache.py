@@ -0,0 +1,193 @@
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from .metrics import ENTITY_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Сколько хранить найденный канал и сколько — ошибку «не найден / приватный»
+DEFAULT_TTL = int(os.getenv('ENTITY_CACHE_TTL', str(30 * 24 * 3600)))
+DEFAULT_NEGATIVE_TTL = int(os.getenv('ENTITY_NEGATIVE_TTL', '600'))
+
+# Ссылки-приглашения: t.me/+HASH, t.me/joinchat/HASH, tg://join?invite=HASH
+INVITE_RE = re.compile(r'(?:(?:t|telegram)\.me/(?:\+|joinchat/)|tg://join\?invite=)([\w-]+)', re.IGNORECASE)
+# Юзернеймы: @name, t.me/name, telegram.me/name, tg://resolve?domain=name
+USERNAME_RES = (
+    re.compile(r'@(\w+)'),
+    re.compile(r't\.me/(\w+)', re.IGNORECASE),
+    re.compile(r'telegram\.me/(\w+)', re.IGNORECASE),
+    re.compile(r'tg://resolve\?domain=(\w+)', re.IGNORECASE),
+)
+CHANNEL_ID_RE = re.compile(r'^-100(\d+)$')
+# Сдвиг «маркированного» id канала в Telethon: -100XXXXXXXXXX
+MARKED_CHANNEL_OFFSET = 1000000000000
+
+
+def normalize_link(channel_link):
+    """Приводит ссылку на канал к ключу кэша: ('invite', hash), ('id', channel_id) или ('username', name)"""
+    channel_link = channel_link.strip()
+    match = INVITE_RE.search(channel_link)
+    if match:
+        return 'invite', match.group(1)
+    match = CHANNEL_ID_RE.match(channel_link)
+    if match:
+        return 'id', int(match.group(1))
+    for pattern in USERNAME_RES:
+        match = pattern.search(channel_link)
+        if match:
+            return 'username', match.group(1).lower()
+    return 'username', channel_link.lstrip('@').lower()
+
+
+def cache_key(kind, value):
+    return f'{kind}:{value}'
+
+
+class EntityCache:
+    """Кэш разрешения ссылок на каналы (SQLite): ключ ссылки -> id и access_hash.
+
+    access_hash действует только для аккаунта, который его получил, поэтому
+    записи хранятся отдельно для каждой сессии. Неудачи (канал не найден или
+    приватный) запоминаются на короткий ``negative_ttl``, чтобы повторные
+    задачи не тратили ResolveUsername на заведомо неверные ссылки.
+    Вместе с каналом хранятся его флаги (megagroup, broadcast, left): по ним
+    MembershipManager и обход истории решают, нужны ли проверочные запросы.
+    Для каналов из файла сессии флаги неизвестны и восстанавливаются как None.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._warmed = set()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entities ('
+            'session TEXT NOT NULL, key TEXT NOT NULL, channel_id INTEGER, access_hash INTEGER, '
+            'title TEXT, username TEXT, megagroup INTEGER, error TEXT, resolved_at REAL NOT NULL, '
+            'PRIMARY KEY (session, key))'
+        )
+        # Флаги канала, добавленные позже: старые базы дополняются столбцами
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(entities)')}
+        for column in ('broadcast', 'is_left'):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE entities ADD COLUMN {column} INTEGER')
+        self._conn.commit()
+
+    def get(self, session, key):
+        """Канал из кэша или None при промахе; запомненная ошибка пробрасывается как ValueError"""
+        row = self._conn.execute(
+            'SELECT channel_id, access_hash, title, username, megagroup, broadcast, is_left, error, resolved_at '
+            'FROM entities WHERE session = ? AND key = ?',
+            (session, key)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            ENTITY_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        channel_id, access_hash, title, username, megagroup, broadcast, left, error, resolved_at = row
+        if self._clock() - resolved_at > (self.negative_ttl if error else self.ttl):
+            self.misses += 1
+            ENTITY_CACHE_LOOKUPS.inc(result='expired')
+            return None
+        if error:
+            self.negative_hits += 1
+            ENTITY_CACHE_LOOKUPS.inc(result='negative')
+            raise ValueError(error)
+        self.hits += 1
+        ENTITY_CACHE_LOOKUPS.inc(result='hit')
+        # Telethon нужен только для сущностей: normalize_link доступна API без схемы TL
+        from telethon.tl.types import Channel, ChatPhotoEmpty
+        return Channel(id=channel_id, title=title or '', photo=ChatPhotoEmpty(), date=None,
+                       access_hash=access_hash, username=username, megagroup=_flag(megagroup),
+                       broadcast=_flag(broadcast), left=_flag(left))
+
+    def put(self, session, channel, keys):
+        """Запоминает канал под всеми ключами: исходной ссылкой, юзернеймом и id"""
+        keys = set(keys) | {cache_key('id', channel.id)}
+        if channel.username:
+            keys.add(cache_key('username', channel.username.lower()))
+        now = self._clock()
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO entities '
+            '(session, key, channel_id, access_hash, title, username, megagroup, broadcast, is_left, '
+            'error, resolved_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)',
+            [(session, key, channel.id, channel.access_hash, channel.title, channel.username,
+              _column(channel.megagroup), _column(channel.broadcast), _column(getattr(channel, 'left', None)), now)
+             for key in keys]
+        )
+        self._conn.commit()
+
+    def put_error(self, session, key, error):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO entities (session, key, error, resolved_at) VALUES (?, ?, ?, ?)',
+            (session, key, str(error), self._clock())
+        )
+        self._conn.commit()
+
+    def warm_from_session(self, session, session_file):
+        """Загружает каналы из таблицы entities файла сессии Telethon (один раз на сессию).
+
+        Telethon хранит там id и access_hash всех встреченных сущностей; каналы
+        записаны маркированным id (-100...), без флагов канала. Существующие
+        записи не заменяются.
+        """
+        if session in self._warmed or not os.path.exists(session_file):
+            return 0
+        self._warmed.add(session)
+        try:
+            source = sqlite3.connect(f'file:{session_file}?mode=ro', uri=True)
+            try:
+                rows = source.execute(
+                    'SELECT id, hash, username, name, date FROM entities WHERE id < ?',
+                    (-MARKED_CHANNEL_OFFSET,)
+                ).fetchall()
+            finally:
+                source.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось прочитать сущности сессии {session_file}: {str(e)}")
+            return 0
+
+        records = []
+        for marked_id, access_hash, username, name, date in rows:
+            channel_id = -marked_id - MARKED_CHANNEL_OFFSET
+            resolved_at = date or self._clock()
+            records.append((session, cache_key('id', channel_id), channel_id, access_hash, name, username, resolved_at))
+            if username:
+                records.append((session, cache_key('username', username.lower()), channel_id, access_hash,
+                                name, username, resolved_at))
+        self._conn.executemany(
+            'INSERT OR IGNORE INTO entities '
+            '(session, key, channel_id, access_hash, title, username, error, resolved_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, NULL, ?)',
+            records
+        )
+        self._conn.commit()
+        return len(rows)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'negative_hits': self.negative_hits}
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии кэша сущностей: {str(e)}")
+
+
+def _column(flag):
+    """Флаг канала для столбца: None (неизвестен) сохраняется как NULL"""
+    return None if flag is None else int(bool(flag))
+
+
+def _flag(value):
+    return None if value is None else bool(value)
@@ -0,0 +1,199 @@
+import csv
+import io
+import json
+
+# Колонки выходного файла по умолчанию
+COLUMNS = ['user_id', 'first_name', 'last_name', 'username', 'bio']
+# Дополнительные колонки выгрузки обновлённых профилей
+PROFILE_COLUMNS = ['status', 'premium', 'bot', 'deleted']
+# Колонки с логическими значениями (в Parquet — тип bool)
+BOOL_COLUMNS = {'premium', 'bot', 'deleted'}
+# Ограничение формата XLSX (включая строку заголовка)
+XLSX_MAX_ROWS = 1048576
+# Размер куска при потоковой отдаче
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Exporter:
+    """Базовый экспортёр: построчно пишет записи-словари в бинарный поток.
+
+    Потоковые форматы (``streamable = True``) пишут данные сразу в ``fileobj``
+    и могут отдаваться клиенту по мере парсинга; остальным нужен файл целиком.
+    Форматы с ``multi_sheet = True`` принимают дополнительные листы (``add_sheet``).
+    """
+
+    extension = None
+    media_type = 'application/octet-stream'
+    streamable = False
+    multi_sheet = False
+
+    def __init__(self, fileobj, columns=COLUMNS):
+        self.fileobj = fileobj
+        self.columns = list(columns)
+        self.rows = 0
+
+    def write_row(self, row):
+        self.rows += 1
+        self._write(row)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def _write(self, row):
+        raise NotImplementedError
+
+    def add_sheet(self, title, columns, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CsvExporter(Exporter):
+    extension = 'csv'
+    media_type = 'text/csv; charset=utf-8'
+    streamable = True
+
+    def __init__(self, fileobj, columns=COLUMNS):
+        super().__init__(fileobj, columns)
+        # BOM нужен Excel, чтобы правильно открыть кириллицу
+        self._text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='', write_through=True)
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(self.columns)
+
+    def _write(self, row):
+        self._writer.writerow([row.get(column, '') for column in self.columns])
+
+    def close(self):
+        self._text.flush()
+        self._text.detach()
+
+
+class NdjsonExporter(Exporter):
+    extension = 'ndjson'
+    media_type = 'application/x-ndjson'
+    streamable = True
+
+    def _write(self, row):
+        record = {column: row.get(column, '') for column in self.columns}
+        self.fileobj.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class XlsxExporter(Exporter):
+    """XLSX через openpyxl в режиме write_only: память не растёт с числом строк"""
+
+    extension = 'xlsx'
+    media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    multi_sheet = True
+
+    def __init__(self, fileobj, columns=COLUMNS):
+        from openpyxl import Workbook
+
+        super().__init__(fileobj, columns)
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet()
+        self._sheet.append(self.columns)
+
+    def _write(self, row):
+        if self.rows >= XLSX_MAX_ROWS:
+            raise ValueError(f"XLSX вмещает не более {XLSX_MAX_ROWS - 1} строк, используйте csv, ndjson или parquet")
+        self._sheet.append([row.get(column, '') for column in self.columns])
+
+    def add_sheet(self, title, columns, rows):
+        """Дополнительный лист (например, сводка аналитики) из строк-списков"""
+        sheet = self._workbook.create_sheet(title)
+        sheet.append(list(columns))
+        for row in rows:
+            sheet.append(list(row))
+
+    def close(self):
+        self._workbook.save(self.fileobj)
+
+
+class ParquetExporter(Exporter):
+    """Колоночный Parquet через pyarrow; строки копятся пачками по ``batch_size``"""
+
+    extension = 'parquet'
+    media_type = 'application/vnd.apache.parquet'
+
+    def __init__(self, fileobj, columns=COLUMNS, batch_size=50000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Для формата parquet установите пакет pyarrow")
+
+        super().__init__(fileobj, columns)
+        self._pa = pa
+        self.batch_size = batch_size
+        self._schema = pa.schema([
+            (column, pa.int64() if column == 'user_id' else pa.bool_() if column in BOOL_COLUMNS else pa.string())
+            for column in self.columns
+        ])
+        self._writer = pq.ParquetWriter(fileobj, self._schema, compression='snappy')
+        self._batch = {column: [] for column in self.columns}
+        self._batch_rows = 0
+
+    def _write(self, row):
+        for column in self.columns:
+            self._batch[column].append(row.get(column))
+        self._batch_rows += 1
+        if self._batch_rows >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._batch_rows:
+            self._writer.write_table(self._pa.Table.from_pydict(self._batch, schema=self._schema))
+            self._batch = {column: [] for column in self.columns}
+            self._batch_rows = 0
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+EXPORTERS = {
+    'xlsx': XlsxExporter,
+    'csv': CsvExporter,
+    'ndjson': NdjsonExporter,
+    'parquet': ParquetExporter,
+}
+
+
+def get_exporter_class(output_format):
+    try:
+        return EXPORTERS[output_format]
+    except KeyError:
+        raise ValueError(f"Неизвестный формат {output_format}, доступны: {', '.join(EXPORTERS)}")
+
+
+async def stream_rows(exporter_class, rows, columns=COLUMNS, chunk_size=STREAM_CHUNK_SIZE):
+    """Кодирует асинхронный поток строк потоковым экспортёром и отдаёт куски байтов"""
+    buffer = io.BytesIO()
+    exporter = exporter_class(buffer, columns)
+    async for row in rows:
+        exporter.write_row(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    exporter.close()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def iter_file(path, chunk_size=STREAM_CHUNK_SIZE):
+    """Читает файл кусками для потоковой отдачи"""
+    async for chunk in iter_open_file(open(path, 'rb'), chunk_size):
+        yield chunk
+
+
+async def iter_open_file(f, chunk_size=STREAM_CHUNK_SIZE):
+    """Как iter_file, но для уже открытого файла; закрывает его в конце"""
+    with f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,103 @@
+import zlib
+
+from telethon.tl.types import (
+    ChannelParticipantsSearch, ChannelParticipantsRecent, ChannelParticipantsAdmins,
+    ChannelParticipantsBots, ChannelParticipantsKicked, ChannelParticipantsBanned,
+    ChannelParticipantsContacts
+)
+
+# Типы участников, которые Telegram фильтрует на сервере.
+# Для типов с поисковой строкой (q) поиск тоже выполняется сервером
+PARTICIPANT_TYPES = {
+    'all': ChannelParticipantsSearch,
+    'recent': ChannelParticipantsRecent,
+    'admins': ChannelParticipantsAdmins,
+    'bots': ChannelParticipantsBots,
+    'kicked': ChannelParticipantsKicked,
+    'banned': ChannelParticipantsBanned,
+    'contacts': ChannelParticipantsContacts,
+}
+SEARCHABLE_TYPES = {'all', 'kicked', 'banned', 'contacts'}
+
+
+class ParticipantFilter:
+    """Отбор участников канала.
+
+    ``participant_type`` и ``search`` передаются в GetParticipantsRequest, так что
+    Telegram сам возвращает только подходящих участников. Остальные условия
+    (``keywords``, ``has_username``, ``exclude_bots``, ``exclude_deleted``,
+    ``premium``) проверяются на клиенте по данным из списка участников — до
+    дорогого обогащения bio.
+    """
+
+    def __init__(self, search='', participant_type='all', keywords=(), has_username=None,
+                 exclude_bots=False, exclude_deleted=False, premium=None):
+        if participant_type not in PARTICIPANT_TYPES:
+            raise ValueError(
+                f"Неизвестный тип участников {participant_type}, доступны: {', '.join(PARTICIPANT_TYPES)}"
+            )
+        self.search = (search or '').strip()
+        self.participant_type = participant_type
+        self.keywords = [keyword.strip().lower() for keyword in keywords if keyword.strip()]
+        self.has_username = has_username
+        self.exclude_bots = exclude_bots
+        self.exclude_deleted = exclude_deleted
+        self.premium = premium
+        # Типы без поисковой строки ищут по имени на клиенте
+        self._local_search = self.search.lower() if participant_type not in SEARCHABLE_TYPES else ''
+        self._client_side = bool(self.keywords or self._local_search or has_username is not None
+                                 or exclude_bots or exclude_deleted or premium is not None)
+
+    @classmethod
+    def from_dict(cls, spec):
+        """Фильтр из словаря запроса API; None или пустой словарь — без фильтра"""
+        spec = dict(spec or {})
+        if 'type' in spec:
+            spec['participant_type'] = spec.pop('type')
+        return cls(**spec)
+
+    def to_dict(self):
+        return {
+            'search': self.search,
+            'type': self.participant_type,
+            'keywords': self.keywords,
+            'has_username': self.has_username,
+            'exclude_bots': self.exclude_bots,
+            'exclude_deleted': self.exclude_deleted,
+            'premium': self.premium,
+        }
+
+    @property
+    def active(self):
+        return self.to_dict() != ParticipantFilter().to_dict()
+
+    def key(self):
+        """Короткий идентификатор фильтра для имён контрольных точек"""
+        return format(zlib.crc32(repr(sorted(self.to_dict().items())).encode('utf-8')), '08x')
+
+    def request_filter(self):
+        """Фильтр для GetParticipantsRequest"""
+        filter_class = PARTICIPANT_TYPES[self.participant_type]
+        if self.participant_type in SEARCHABLE_TYPES:
+            return filter_class(q=self.search)
+        return filter_class()
+
+    def matches(self, user):
+        """Клиентская часть фильтра: только поля, уже полученные со страницей участников"""
+        if not self._client_side:
+            return True
+        if self.exclude_deleted and user.deleted:
+            return False
+        if self.exclude_bots and user.bot:
+            return False
+        if self.has_username is not None and bool(user.username) != self.has_username:
+            return False
+        if self.premium is not None and bool(user.premium) != self.premium:
+            return False
+        if self.keywords or self._local_search:
+            text = ' '.join((user.first_name or '', user.last_name or '', user.username or '')).lower()
+            if self._local_search and self._local_search not in text:
+                return False
+            if self.keywords and not any(keyword in text for keyword in self.keywords):
+                return False
+        return True
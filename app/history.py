@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+from collections import Counter, deque
+
+from .sharding import CompactIdSet
+
+logger = logging.getLogger(__name__)
+
+# Откуда берётся аудитория канала: список участников или история сообщений
+AUDIENCE_SOURCES = ('participants', 'messages')
+# Максимальный размер страницы GetHistoryRequest
+HISTORY_PAGE_SIZE = 100
+# Сколько id сообщений в одном срезе истории
+HISTORY_SLICE_SIZE = int(os.getenv('HISTORY_SLICE_SIZE', '2000'))
+DEFAULT_HISTORY_CONCURRENCY = int(os.getenv('HISTORY_CONCURRENCY', '4'))
+# Сколько найденных пользователей может ждать обогащения, прежде чем срезы приостановятся
+HISTORY_BUFFER_SIZE = 1000
+
+
+def id_slices(min_id, top_id, slice_size=HISTORY_SLICE_SIZE):
+    """Срезы (low, high) id сообщений: low < id < high, от новых к старым"""
+    high = top_id + 1
+    while high - 1 > min_id:
+        low = max(min_id, high - 1 - slice_size)
+        yield low, high
+        high = low + 1
+
+
+class HistoryScan:
+    """Аудитория по истории сообщений: история делится на срезы по id и читается параллельно.
+
+    ``peers`` — список (peer, top_id, min_id): канал и, например, его группа
+    обсуждения; каждый диапазон id делится на срезы по ``slice_size``.
+    Срезы обходятся ``concurrency`` воркерами от новых сообщений к старым.
+    ``fetch_page(peer, offset_id, min_id, limit)`` возвращает id сообщений
+    страницы (id < offset_id и > min_id) и список (User, источник) —
+    авторов, найденных на ней. Пользователи дедуплицируются в CompactIdSet
+    по мере обхода и отдаются асинхронным генератором ``users()``;
+    ``on_page(new_users)`` вызывается после каждой страницы.
+    """
+
+    def __init__(self, fetch_page, peers, slice_size=HISTORY_SLICE_SIZE, concurrency=DEFAULT_HISTORY_CONCURRENCY,
+                 page_size=HISTORY_PAGE_SIZE, skip=(), on_page=None):
+        self.fetch_page = fetch_page
+        self.peers = list(peers)
+        self.slice_size = max(1, slice_size)
+        self.concurrency = max(1, concurrency)
+        self.page_size = page_size
+        self.on_page = on_page
+        self.ids = CompactIdSet(skip)
+        self.sources = Counter()
+        self.slices = 0
+        self.messages = 0
+        self.requests = 0
+        self._error = None
+
+    async def users(self):
+        out = asyncio.Queue(maxsize=HISTORY_BUFFER_SIZE)
+        runner = asyncio.ensure_future(self._run(out))
+        try:
+            while True:
+                user = await out.get()
+                if user is None:
+                    break
+                yield user
+            if self._error is not None:
+                raise self._error
+        finally:
+            if not runner.done():
+                runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    async def _run(self, out):
+        slices = deque(
+            (peer, low, high) for peer, top_id, min_id in self.peers
+            for low, high in id_slices(min_id, top_id, self.slice_size)
+        )
+
+        async def worker():
+            while slices:
+                await self._slice(*slices.popleft(), out)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.concurrency, len(slices)))]
+        try:
+            await asyncio.gather(*workers)
+        except Exception as e:
+            self._error = e
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        await out.put(None)
+
+    async def _slice(self, peer, low, high, out):
+        self.slices += 1
+        offset_id = high
+        while offset_id - 1 > low:
+            self.requests += 1
+            message_ids, authors = await self.fetch_page(peer, offset_id, low, self.page_size)
+            if not message_ids:
+                break
+            self.messages += len(message_ids)
+            await self._emit(authors, out)
+            # Неполная страница: в срезе больше нет сообщений
+            if len(message_ids) < self.page_size:
+                break
+            offset_id = min(message_ids)
+
+    async def _emit(self, authors, out):
+        new_users = []
+        for user, source in authors:
+            if self.ids.add(user.id):
+                self.sources[source] += 1
+                new_users.append(user)
+        if self.on_page:
+            self.on_page(len(new_users))
+        for user in new_users:
+            await out.put(user)
+
+    def report(self):
+        """Отчёт об обходе истории: сколько сообщений прочитано и откуда взялись пользователи"""
+        return {
+            'source': 'messages',
+            'unique_users': len(self.ids),
+            'messages': self.messages,
+            'slices': self.slices,
+            'requests': self.requests,
+            'sources': dict(self.sources),
+        }
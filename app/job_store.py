@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+from .config import SESSIONS_DIR
+from .jobs import (
+    QueueFullError, JOB_STATUSES, FINISHED_STATUSES, DEFAULT_MAX_QUEUED_JOBS, DEFAULT_RESULT_TTL,
+    DEFAULT_EXPIRE_INTERVAL, EVENTS_INTERVAL, EVENTS_HEARTBEAT
+)
+
+logger = logging.getLogger(__name__)
+
+# Общая очередь задач и директория результатов для API-процессов и воркеров
+DEFAULT_JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', os.path.join(SESSIONS_DIR, 'jobs.sqlite'))
+DEFAULT_RESULTS_DIR = os.getenv('JOB_RESULTS_DIR', os.path.join(SESSIONS_DIR, 'results'))
+# Задача, воркер которой не отмечался дольше этого (секунды), возвращается в очередь
+DEFAULT_STALE_TIMEOUT = int(os.getenv('JOB_STALE_TIMEOUT', '60'))
+# Ответ heartbeat: продолжать, отменить по запросу, задача отобрана у воркера
+HEARTBEAT_OK, HEARTBEAT_CANCEL, HEARTBEAT_LOST = 'ok', 'cancel', 'lost'
+
+
+class JobStore:
+    """Очередь задач в SQLite, общая для нескольких процессов на одной машине.
+
+    API-процессы добавляют задачи (``enqueue``), воркеры забирают их
+    (``claim``) в транзакции BEGIN IMMEDIATE, так что одну задачу получает
+    ровно один воркер. Во время работы воркер периодически записывает прогресс
+    (``heartbeat``) и узнаёт из ответа, не запрошена ли отмена; задача воркера,
+    который перестал отмечаться, возвращается в очередь (``requeue_stale``).
+    Файлы результата лежат в ``results_dir/<job_id>``. Задача с ключом
+    результата, совпадающим с ждущей или выполняющейся, не добавляется:
+    ``enqueue`` возвращает id уже существующей.
+    """
+
+    def __init__(self, path=DEFAULT_JOB_STORE_PATH, results_dir=DEFAULT_RESULTS_DIR,
+                 stale_timeout=DEFAULT_STALE_TIMEOUT, clock=time.time):
+        self.path = path
+        self.results_dir = results_dir
+        self.stale_timeout = stale_timeout
+        self._clock = clock
+        os.makedirs(results_dir, exist_ok=True)
+        # Транзакции открываются явно, поэтому автокоммит
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, params TEXT NOT NULL, status TEXT NOT NULL, '
+            "progress TEXT NOT NULL DEFAULT '{}', event TEXT, result TEXT, error TEXT, "
+            'created_at REAL NOT NULL, started_at REAL, finished_at REAL, '
+            'worker TEXT, heartbeat_at REAL, cancel_requested INTEGER NOT NULL DEFAULT 0)'
+        )
+        # Ключ результата появился позже: старые базы дополняются столбцом
+        columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        if 'key' not in columns:
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN key TEXT')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)')
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def job_dir(self, job_id):
+        return os.path.join(self.results_dir, job_id)
+
+    def enqueue(self, params, max_queued=DEFAULT_MAX_QUEUED_JOBS, key=None):
+        with self._transaction():
+            if key is not None:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE key = ? AND status IN ('queued', 'running') "
+                    'AND cancel_requested = 0 LIMIT 1', (key,)
+                ).fetchone()
+                if row is not None:
+                    return row['id']
+            queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= max_queued:
+                raise QueueFullError("Очередь задач заполнена, попробуйте позже")
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, params, status, created_at, key) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, json.dumps(params, ensure_ascii=False), self._clock(), key)
+            )
+        return job_id
+
+    def claim(self, worker):
+        """Забирает самую старую задачу из очереди; (job_id, params) или None"""
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            now = self._clock()
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (worker, now, now, row['id'])
+            )
+        return row['id'], json.loads(row['params'])
+
+    def heartbeat(self, job_id, worker, progress, event):
+        """Записывает прогресс задачи.
+
+        Возвращает HEARTBEAT_CANCEL, если задачу попросили отменить, и
+        HEARTBEAT_LOST, если она больше не принадлежит воркеру (возвращена
+        в очередь как зависшая и, возможно, уже выполняется другим).
+        """
+        cursor = self._conn.execute(
+            "UPDATE jobs SET progress = ?, event = ?, heartbeat_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(progress, ensure_ascii=False), json.dumps(event, ensure_ascii=False),
+             self._clock(), job_id, worker)
+        )
+        if not cursor.rowcount:
+            return HEARTBEAT_LOST
+        row = self._conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return HEARTBEAT_CANCEL if row['cancel_requested'] else HEARTBEAT_OK
+
+    def finish(self, job_id, worker, status, result=None, error=None, progress=None, event=None):
+        """Записывает итог задачи; False, если задача уже не принадлежит воркеру"""
+        cursor = self._conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, '
+            "progress = COALESCE(?, progress), event = COALESCE(?, event) "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+             self._clock(), json.dumps(progress, ensure_ascii=False) if progress is not None else None,
+             json.dumps(event, ensure_ascii=False) if event is not None else None, job_id, worker)
+        )
+        if not cursor.rowcount:
+            logger.warning(f"Итог задачи {job_id} не записан: она больше не принадлежит воркеру {worker}")
+            return False
+        return True
+
+    def release(self, job_id, worker):
+        """Возвращает незавершённую задачу в очередь (воркер останавливается)"""
+        self._conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, heartbeat_at = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (job_id, worker)
+        )
+
+    def request_cancel(self, job_id):
+        """Отменяет задачу в очереди сразу, выполняющуюся — через воркер; False, если уже завершена"""
+        with self._transaction():
+            row = self._conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None or row['status'] in FINISHED_STATUSES:
+                return False
+            if row['status'] == 'queued':
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (self._clock(), job_id)
+                )
+            else:
+                self._conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+        return True
+
+    def requeue_stale(self):
+        """Возвращает в очередь задачи воркеров, которые перестали отмечаться"""
+        cursor = self._conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, heartbeat_at = NULL "
+            "WHERE status = 'running' AND heartbeat_at < ?",
+            (self._clock() - self.stale_timeout,)
+        )
+        if cursor.rowcount:
+            logger.warning(f"Возвращено в очередь задач зависших воркеров: {cursor.rowcount}")
+        return cursor.rowcount
+
+    def get(self, job_id):
+        row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def counts(self):
+        rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def expire(self, ttl):
+        """Удаляет завершённые задачи старше ``ttl`` вместе с их файлами"""
+        placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+        with self._transaction():
+            ids = [row[0] for row in self._conn.execute(
+                f'SELECT id FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?',
+                (*FINISHED_STATUSES, self._clock() - ttl)
+            )]
+            self._conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in ids])
+        for job_id in ids:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return len(ids)
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии хранилища задач: {str(e)}")
+
+
+class StoredJob:
+    """Задача из JobStore с интерфейсом Job: состояние читается из базы при каждом обращении"""
+
+    def __init__(self, store, row):
+        self.store = store
+        self.id = row['id']
+        self._row = row
+
+    def refresh(self):
+        self._row = self.store.get(self.id) or self._row
+        return self
+
+    @property
+    def status(self):
+        return self._row['status']
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def error(self):
+        return self._row['error']
+
+    @property
+    def params(self):
+        return json.loads(self._row['params'])
+
+    @property
+    def progress(self):
+        return json.loads(self._row['progress'])
+
+    @property
+    def result(self):
+        return json.loads(self._row['result']) if self._row['result'] else None
+
+    def event(self):
+        """Последний снимок прогресса, записанный воркером"""
+        event = json.loads(self._row['event']) if self._row['event'] else {
+            'job_id': self.id, 'stage': None, 'total': None, 'fetched': 0, 'enriched': 0,
+            'users_per_sec': None, 'eta': None, 'rate': None, 'flood_wait': 0,
+        }
+        event.update(status=self.status, error=self.error)
+        if self.finished:
+            event['eta'] = None
+            event['flood_wait'] = 0
+        return event
+
+    async def watch(self, interval=EVENTS_INTERVAL, heartbeat=EVENTS_HEARTBEAT):
+        """Как Job.watch, но изменения узнаются опросом базы раз в ``interval`` секунд"""
+        last, last_sent = None, 0.0
+        while True:
+            event = self.refresh().event()
+            now = time.monotonic()
+            if event != last or now - last_sent >= heartbeat:
+                yield event
+                last, last_sent = event, now
+            if self.finished:
+                return
+            await asyncio.sleep(interval)
+
+    def to_dict(self):
+        result = self.result or {}
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'params': self.params,
+            'progress': self.progress,
+            'eta': self.event()['eta'] if self.status == 'running' else None,
+            'error': self.error,
+            'created_at': self._row['created_at'],
+            'started_at': self._row['started_at'],
+            'finished_at': self._row['finished_at'],
+            'total_users': result.get('total_users'),
+            'changes': {key: result[key] for key in ('joined', 'changed', 'left') if key in result} or None,
+            'analytics': result.get('analytics'),
+            # Пакет и обновление профилей: пользователи без bio из-за FloodWait
+            'not_enriched': result.get('not_enriched'),
+            'retry_after': result.get('retry_after'),
+        }
+
+
+class StoreJobManager:
+    """Замена JobManager для API-процессов: задачи уходят в JobStore и выполняются воркерами"""
+
+    def __init__(self, store, max_queued_jobs=DEFAULT_MAX_QUEUED_JOBS, result_ttl=DEFAULT_RESULT_TTL,
+                 expire_interval=DEFAULT_EXPIRE_INTERVAL):
+        self.store = store
+        self.max_queued_jobs = max_queued_jobs
+        self.result_ttl = result_ttl
+        self.expire_interval = expire_interval
+        self._expire_task = None
+
+    def start(self):
+        """Запускает периодическое удаление устаревших задач"""
+        if self.expire_interval and self._expire_task is None:
+            self._expire_task = asyncio.create_task(self._expire_loop())
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(self.expire_interval)
+            try:
+                self.store.expire(self.result_ttl)
+            except Exception as e:
+                logger.error(f"Ошибка при удалении устаревших задач: {str(e)}")
+
+    def submit(self, params, key=None):
+        self.store.expire(self.result_ttl)
+        return self.get(self.store.enqueue(params, self.max_queued_jobs, key))
+
+    def get(self, job_id):
+        row = self.store.get(job_id)
+        return StoredJob(self.store, row) if row is not None else None
+
+    def cancel(self, job_id):
+        return self.store.request_cancel(job_id)
+
+    def counts(self):
+        return self.store.counts()
+
+    async def shutdown(self):
+        if self._expire_task:
+            self._expire_task.cancel()
+            self._expire_task = None
+        self.store.close()
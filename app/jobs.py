@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Сколько задач парсинга выполняется одновременно и сколько может ждать в очереди
+DEFAULT_MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '2'))
+DEFAULT_MAX_QUEUED_JOBS = int(os.getenv('MAX_QUEUED_JOBS', '100'))
+# Верхняя граница параллельности обогащения внутри одной задачи
+MAX_JOB_ENRICH_CONCURRENCY = int(os.getenv('MAX_JOB_ENRICH_CONCURRENCY', '16'))
+# Сколько аккаунтов пула может занять одна задача
+MAX_JOB_ACCOUNTS = int(os.getenv('MAX_JOB_ACCOUNTS', '8'))
+# Сколько секунд хранить завершённую задачу и её файл
+DEFAULT_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', '3600'))
+# Как часто (секунды) удалять устаревшие задачи, даже если новых не поступает
+DEFAULT_EXPIRE_INTERVAL = float(os.getenv('JOB_EXPIRE_INTERVAL', '60'))
+# Поток событий прогресса: не чаще одного события в EVENTS_INTERVAL секунд,
+# а без изменений (например, во время FloodWait) — раз в EVENTS_HEARTBEAT секунд
+EVENTS_INTERVAL = float(os.getenv('JOB_EVENTS_INTERVAL', '0.5'))
+EVENTS_HEARTBEAT = float(os.getenv('JOB_EVENTS_HEARTBEAT', '2'))
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+
+class QueueFullError(Exception):
+    """Очередь задач заполнена"""
+
+
+class Job:
+    """Задача парсинга: параметры, состояние, прогресс и результат"""
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Вызывается при удалении задачи, чтобы освободить файлы результата
+        self.cleanup = None
+        # Ограничитель сессии, на которой выполняется задача (скорость и паузы FloodWait)
+        self.rate_limiter = None
+        # Куда писать файлы результата (у воркеров — общая директория результатов)
+        self.output_dir = None
+        # Ключ результата (result_cache.request_key): одинаковые задачи объединяются
+        self.key = None
+        self._task = None
+        self._watchers = set()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def update_progress(self, progress):
+        self.progress = dict(progress)
+        self.notify()
+
+    def notify(self):
+        """Будит подписчиков потока событий"""
+        for changed in self._watchers:
+            changed.set()
+
+    def eta(self):
+        """Оценка оставшегося времени (секунды) по текущей скорости обогащения"""
+        total = self.progress.get('total')
+        enriched = self.progress.get('enriched', 0)
+        if self.status != 'running' or not total or not enriched:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(max(0, total - enriched) * elapsed / enriched, 1)
+
+    def event(self):
+        """Снимок прогресса для потока событий"""
+        enriched = self.progress.get('enriched', 0)
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0
+        event = {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.progress.get('stage'),
+            'total': self.progress.get('total'),
+            'fetched': self.progress.get('fetched', 0),
+            'enriched': enriched,
+            'users_per_sec': round(enriched / elapsed, 1) if elapsed else None,
+            'eta': self.eta(),
+            'rate': None,
+            'flood_wait': 0,
+            'error': self.error,
+        }
+        if self.rate_limiter is not None:
+            event['rate'] = round(self.rate_limiter.rate, 3)
+            event['flood_wait'] = round(self.rate_limiter.blocked_for(), 1)
+        return event
+
+    async def watch(self, interval=EVENTS_INTERVAL, heartbeat=EVENTS_HEARTBEAT):
+        """Отдаёт снимки прогресса по мере изменений до завершения задачи"""
+        changed = asyncio.Event()
+        self._watchers.add(changed)
+        try:
+            while True:
+                yield self.event()
+                if self.finished:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+                # Прогресс меняется на каждом пользователе: события прореживаются
+                if not self.finished:
+                    await asyncio.sleep(interval)
+                changed.clear()
+        finally:
+            self._watchers.discard(changed)
+
+    def to_dict(self):
+        result = self.result or {}
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'params': self.params,
+            'progress': self.progress,
+            'eta': self.eta(),
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'total_users': result.get('total_users'),
+            # Только для инкрементальных задач
+            'changes': {key: result[key] for key in ('joined', 'changed', 'left') if key in result} or None,
+            'analytics': result.get('analytics'),
+            # Пакет и обновление профилей: пользователи без bio из-за FloodWait
+            'not_enriched': result.get('not_enriched'),
+            'retry_after': result.get('retry_after'),
+        }
+
+
+class JobManager:
+    """Ограниченный планировщик фоновых задач парсинга.
+
+    ``runner`` — корутина ``runner(job)``, выполняющая задачу и возвращающая
+    словарь результата с ключом ``filename``. Одновременно выполняется не более
+    ``max_concurrent_jobs`` задач, остальные ждут в очереди. Задача с тем же
+    ключом результата, что у ждущей или выполняющейся, не ставится заново —
+    возвращается уже существующая. Завершённые задачи
+    старше ``result_ttl`` удаляются при постановке новых и фоновой задачей,
+    запущенной ``start``.
+    """
+
+    def __init__(self, runner, max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS,
+                 max_queued_jobs=DEFAULT_MAX_QUEUED_JOBS, result_ttl=DEFAULT_RESULT_TTL,
+                 expire_interval=DEFAULT_EXPIRE_INTERVAL):
+        self.runner = runner
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_queued_jobs = max_queued_jobs
+        self.result_ttl = result_ttl
+        self.expire_interval = expire_interval
+        self._semaphore = asyncio.Semaphore(max_concurrent_jobs)
+        self._expire_task = None
+        self._active = {}
+        self.jobs = {}
+        self.coalesced = 0
+
+    def start(self):
+        """Запускает периодическое удаление устаревших задач"""
+        if self.expire_interval and self._expire_task is None:
+            self._expire_task = asyncio.create_task(self._expire_loop())
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(self.expire_interval)
+            try:
+                self._expire()
+            except Exception as e:
+                logger.error(f"Ошибка при удалении устаревших задач: {str(e)}")
+
+    def submit(self, params, key=None):
+        self._expire()
+        job = self._active.get(key) if key is not None else None
+        if job is not None and not job.finished:
+            self.coalesced += 1
+            return job
+        queued = sum(1 for job in self.jobs.values() if job.status == 'queued')
+        if queued >= self.max_queued_jobs:
+            raise QueueFullError("Очередь задач заполнена, попробуйте позже")
+        job = Job(params)
+        job.key = key
+        self.jobs[job.id] = job
+        if key is not None:
+            self._active[key] = job
+        job._task = asyncio.create_task(self._execute(job))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def counts(self):
+        """Число задач по статусам"""
+        statuses = [job.status for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in JOB_STATUSES}
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._task.cancel()
+        return True
+
+    async def _execute(self, job):
+        try:
+            async with self._semaphore:
+                job.status = 'running'
+                job.started_at = time.time()
+                job.notify()
+                job.result = await self.runner(job)
+                job.status = 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"Задача {job.id} завершилась с ошибкой: {str(e)}")
+        finally:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+            job.finished_at = time.time()
+            job.notify()
+
+    def _expire(self):
+        """Удаляет завершённые задачи старше result_ttl вместе с их файлами"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.finished_at > self.result_ttl:
+                if job.cleanup:
+                    job.cleanup()
+                del self.jobs[job_id]
+
+    async def shutdown(self):
+        if self._expire_task:
+            self._expire_task.cancel()
+            self._expire_task = None
+        for job in self.jobs.values():
+            if not job.finished:
+                job._task.cancel()
+        await asyncio.gather(*(job._task for job in self.jobs.values()), return_exceptions=True)
+        for job in self.jobs.values():
+            if job.cleanup:
+                job.cleanup()
+        self.jobs = {}
+        self._active = {}
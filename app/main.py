@@ -1,14 +1,22 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
+from importlib.util import find_spec
+import json
 import os
-from .telegram_parser import TelegramParser
-import asyncio
+from .config import get_settings, DEFAULT_ENRICH_CONCURRENCY, LAZY_STARTUP, ANALYTICS_MAX_KEYWORDS
+from .jobs import JobManager, QueueFullError, MAX_JOB_ENRICH_CONCURRENCY, MAX_JOB_ACCOUNTS
+from .history import AUDIENCE_SOURCES
+from .job_store import JobStore, StoreJobManager
+from .exporters import get_exporter_class, stream_rows, iter_file, iter_open_file
+from .result_cache import request_key
+from .metrics import REGISTRY, JOBS, SESSION_RATE
+from contextlib import AsyncExitStack
 import logging
-import tempfile
 
 app = FastAPI()
 
@@ -32,58 +40,397 @@ if os.path.exists(static_path):
 # Настраиваем шаблоны
 templates = Jinja2Templates(directory=templates_path)
 
-# Модель для запроса парсинга
-class ParseRequest(BaseModel):
-    channel_link: str
+# Где выполняются задачи: local — в этом процессе, store — воркерами (python -m app.worker),
+# которые забирают их из общей очереди в SQLite; API-процесс тогда не открывает сессии
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'local')
+
+# Пул клиентов, кэши и парсер (вместе с Telethon) загружаются при первом обращении
+_services = None
+
+def get_services():
+    global _services
+    if _services is None:
+        from . import services
+        _services = services
+    return _services
+
+@app.on_event("startup")
+async def startup():
+    # Настройки проверяются один раз при старте, а не при импорте модулей
+    get_settings()
+    job_manager.start()
+    if JOB_BACKEND != 'store' and not LAZY_STARTUP:
+        await get_services().client_pool.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_manager.shutdown()
+    if _services is not None:
+        await _services.close()
+
+# Фильтр участников: search и type применяются на сервере Telegram,
+# остальные условия — на клиенте до запроса bio
+class FilterSpec(BaseModel):
+    search: str = ''
+    type: str = 'all'
+    keywords: List[str] = []
+    has_username: Optional[bool] = None
+    exclude_bots: bool = False
+    exclude_deleted: bool = False
+    premium: Optional[bool] = None
+
+# Общие параметры парсинга
+class ParseOptions(BaseModel):
     parse_bio: bool = False
     parse_username: bool = False
+    enrich_concurrency: int = DEFAULT_ENRICH_CONCURRENCY
+    format: str = 'xlsx'
+    incremental: bool = False
+    filter: Optional[FilterSpec] = None
+    # Обход поиском по префиксам имени для каналов больше ~10 тысяч участников
+    sharded: bool = False
+    # Сколько аккаунтов пула делят запросы задачи
+    accounts: int = 1
+    # Аудитория из списка участников или из истории сообщений (комментаторы,
+    # пересылки, реакции) — для каналов, где участников видят только админы
+    source: str = 'participants'
+    # Сколько последних сообщений просматривать в режиме messages (None — всю историю)
+    history_limit: Optional[int] = None
+    # Сводка по аудитории (доли ботов и удалённых, активность, язык и ключевые слова bio,
+    # пересечения с другими каналами): в статусе задачи и листом analytics в XLSX.
+    # Пересечения считаются только с каналами, у которых есть снимок инкрементального
+    # режима; без снимков overlap = null, а причина — в overlap_unavailable
+    analytics: bool = False
+    analytics_keywords: List[str] = []
+
+# Модель для запроса парсинга
+class ParseRequest(ParseOptions):
+    channel_link: str
+
+# Модель для пакетного парсинга нескольких каналов
+class BatchParseRequest(ParseOptions):
+    channel_links: List[str]
+
+# Модель для обновления профилей уже встречавшихся пользователей
+class RefreshRequest(ParseOptions):
+    user_ids: List[int]
+
+def validate_options(request, sync=False):
+    """Проверка параметров запроса; ``sync`` — синхронный эндпоинт, отдающий файл сразу"""
+    try:
+        exporter_class = get_exporter_class(request.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.format == 'parquet' and not find_spec('pyarrow'):
+        # pyarrow — необязательная зависимость (см. requirements.txt)
+        raise HTTPException(status_code=501, detail="Формат parquet недоступен: не установлен пакет pyarrow")
+    if request.accounts < 1:
+        raise HTTPException(status_code=400, detail="Число аккаунтов должно быть не меньше 1")
+    if request.enrich_concurrency < 1:
+        raise HTTPException(status_code=400, detail="enrich_concurrency должен быть не меньше 1")
+    # Единственное место, где ограничиваются ресурсы запроса: и синхронного, и задачи
+    request.enrich_concurrency = min(request.enrich_concurrency, MAX_JOB_ENRICH_CONCURRENCY)
+    request.accounts = min(request.accounts, MAX_JOB_ACCOUNTS)
+    if request.source not in AUDIENCE_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный источник аудитории {request.source}, доступны: {', '.join(AUDIENCE_SOURCES)}")
+    if request.source == 'messages':
+        if request.incremental or request.sharded:
+            raise HTTPException(status_code=400, detail="Аудитория из сообщений несовместима с инкрементальным режимом и шардированным обходом")
+        if request.filter and (request.filter.search or request.filter.type != 'all'):
+            raise HTTPException(status_code=400, detail="Аудитория из сообщений несовместима с серверным фильтром (search, type)")
+    if request.history_limit is not None and request.history_limit < 1:
+        raise HTTPException(status_code=400, detail="history_limit должен быть не меньше 1")
+    if request.analytics_keywords and not request.analytics:
+        raise HTTPException(status_code=400, detail="Ключевые слова задаются только вместе с analytics")
+    if len(request.analytics_keywords) > ANALYTICS_MAX_KEYWORDS:
+        raise HTTPException(status_code=400, detail=f"Не более {ANALYTICS_MAX_KEYWORDS} ключевых слов для аналитики")
+    if request.analytics and sync and not exporter_class.multi_sheet:
+        # Синхронный ответ — только файл: сводку некуда положить, кроме листа XLSX
+        raise HTTPException(status_code=400, detail="Аналитика в синхронном ответе доступна только для xlsx (лист analytics); для других форматов используйте /api/jobs и /api/jobs/{job_id}/analytics")
+    if request.analytics and not find_spec('numpy'):
+        raise HTTPException(status_code=501, detail="Аналитика аудитории недоступна: не установлен пакет numpy")
+    if request.incremental and isinstance(request, (BatchParseRequest, RefreshRequest)):
+        raise HTTPException(status_code=400, detail="Инкрементальный режим доступен только для парсинга одного канала")
+    if request.incremental and request.sharded:
+        # Шард, обрезанный на насыщении, теряет участников, а снимок записал бы их вышедшими
+        raise HTTPException(status_code=400, detail="Инкрементальный режим несовместим с шардированным обходом")
+    if request.incremental and sync:
+        # Синхронный ответ не содержит дельты, а снимок при этом обновился бы
+        raise HTTPException(status_code=400, detail="Инкрементальный режим доступен только для задач: используйте /api/jobs и /api/jobs/{job_id}/result?delta=true")
+    if isinstance(request, BatchParseRequest) and not request.channel_links:
+        raise HTTPException(status_code=400, detail="Не указано ни одного канала")
+    if isinstance(request, RefreshRequest) and not request.user_ids:
+        raise HTTPException(status_code=400, detail="Не указано ни одного пользователя")
+    if request.filter:
+        from .filters import ParticipantFilter
+        try:
+            participant_filter = ParticipantFilter.from_dict(request.filter.dict())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if request.incremental and participant_filter.active:
+            raise HTTPException(status_code=400, detail="Инкрементальный режим несовместим с фильтром участников")
+        if request.sharded and (participant_filter.search or participant_filter.participant_type != 'all'):
+            raise HTTPException(status_code=400, detail="Шардированный обход несовместим с серверным фильтром (search, type)")
+
+def require_local_sessions():
+    """Синхронный парсинг идёт в процессе API, а в режиме воркеров сессий у него нет"""
+    if JOB_BACKEND == 'store':
+        raise HTTPException(status_code=503, detail="Синхронный парсинг отключён: задачи выполняют воркеры, используйте /api/jobs")
+
+async def run_job(job):
+    return await get_services().runner(job)
+
+# Задачи из очереди выполняются на сессиях пула этого процесса или воркерами
+if JOB_BACKEND == 'store':
+    job_manager = StoreJobManager(JobStore())
+else:
+    job_manager = JobManager(run_job)
 
 # Главная страница
 @app.get("/")
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-# API эндпоинт для парсинга
+# Состояние пула клиентов
+@app.get("/api/health")
+async def health():
+    return get_services().client_pool.stats()
+
+# Метрики в текстовом формате Prometheus
+@app.get("/metrics")
+async def metrics():
+    # Состояние задач и сессий снимается в момент запроса
+    for status, count in job_manager.counts().items():
+        JOBS.set(count, status=status)
+    if _services is not None:
+        for session in _services.client_pool.sessions:
+            SESSION_RATE.set(session.rate_limiter.rate, session=session.name)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def submit(request):
+    validate_options(request)
+    params = request.dict()
+    try:
+        # Одинаковый запрос, который уже ждёт или выполняется, не запускает второй парсинг
+        job = job_manager.submit(params, key=request_key(params))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.to_dict()
+
+# Постановка задачи парсинга в очередь
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: ParseRequest):
+    return submit(request)
+
+# Постановка в очередь пакетного парсинга нескольких каналов
+@app.post("/api/jobs/batch", status_code=202)
+async def submit_batch_job(request: BatchParseRequest):
+    return submit(request)
+
+# Постановка в очередь обновления профилей известных пользователей
+@app.post("/api/jobs/refresh", status_code=202)
+async def submit_refresh_job(request: RefreshRequest):
+    return submit(request)
+
+def get_job_or_404(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+# Статус и прогресс задачи
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    return get_job_or_404(job_id).to_dict()
+
+# Поток прогресса задачи (server-sent events): событие progress при изменениях,
+# flood_wait во время паузы FloodWait и финальное done / failed / cancelled
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = get_job_or_404(job_id)
+
+    async def events():
+        async for event in job.watch():
+            if event['status'] in ('done', 'failed', 'cancelled'):
+                name = event['status']
+            else:
+                name = 'flood_wait' if event['flood_wait'] else 'progress'
+            yield f"event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Сводка аналитики аудитории завершённой задачи (analytics=true)
+@app.get("/api/jobs/{job_id}/analytics")
+async def job_analytics(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status != 'done':
+        raise HTTPException(status_code=409, detail=f"Задача в состоянии {job.status}")
+    if not job.result.get('analytics'):
+        raise HTTPException(status_code=400, detail="Задача выполнялась без аналитики")
+    return job.result['analytics']
+
+# Матрица пересечений аудиторий каналов по их последним снимкам
+# (без channel_ids — самые свежие снимки)
+@app.get("/api/analytics/overlap")
+async def analytics_overlap(channel_ids: List[int] = Query(default=[])):
+    try:
+        from .analytics import snapshot_overlap
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Аналитика аудитории недоступна: не установлен пакет numpy")
+    return {'overlap': snapshot_overlap(get_services().snapshot_store, channel_ids)}
+
+# Скачивание результата завершённой задачи
+# (delta=true — только изменения с прошлого снимка для инкрементальных задач)
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str, delta: bool = False):
+    job = get_job_or_404(job_id)
+    if job.status != 'done':
+        raise HTTPException(status_code=409, detail=f"Задача в состоянии {job.status}")
+    file_path = job.result['filename']
+    if delta:
+        if not job.result.get('delta_filename'):
+            raise HTTPException(status_code=400, detail="Задача выполнялась не в инкрементальном режиме")
+        file_path = job.result['delta_filename']
+    return file_stream_response(
+        iter_file(file_path), os.path.basename(file_path), get_exporter_class(job.result['format'])
+    )
+
+def file_stream_response(body, filename, exporter_class):
+    """Ответ с chunked-передачей файла результата"""
+    return StreamingResponse(
+        body,
+        media_type=exporter_class.media_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+# Отмена задачи
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = get_job_or_404(job_id)
+    success = job_manager.cancel(job_id)
+    return {"success": success, "status": job_manager.get(job_id).status}
+
+async def cached_response(request, channel_links, exporter_class):
+    """Ответ из кэша результатов; X-Cache показывает, был ли парсинг ради этого запроса"""
+    try:
+        entry, cache_status = await get_services().cached_result(request, channel_links)
+        body = iter_open_file(entry.open())
+    except Exception as e:
+        logging.error(f"Error during parsing: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    response = file_stream_response(body, entry.filename, exporter_class)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+# API эндпоинт для парсинга. Если включён кэш результатов (RESULT_CACHE_TTL),
+# файл берётся из него, а одинаковые одновременные запросы ждут один парсинг.
+# Без кэша результат отдаётся потоком: CSV и NDJSON кодируются прямо из
+# конвейера парсинга, XLSX и Parquet сначала пишутся во временный файл,
+# который удаляется после отправки
 @app.post("/api/parse")
 async def parse_channel(request: ParseRequest):
-    parser = None
+    validate_options(request, sync=True)
+    require_local_sessions()
+    exporter_class = get_exporter_class(request.format)
+    if get_services().cacheable(request):
+        return await cached_response(request, [request.channel_link], exporter_class)
+
+    resources = AsyncExitStack()
     try:
-        parser = TelegramParser(
-            parse_bio=request.parse_bio,
-            parse_username=request.parse_username
-        )
-        
-        result = await parser.parse_channel(request.channel_link)
-        
-        if result['success']:
-            # Отправляем файл пользователю
-            file_path = result['filename']
-            
-            # Создаем функцию для очистки после отправки файла
-            async def cleanup_after_response():
-                await asyncio.sleep(60)  # Ждем минуту после отправки
-                if parser:
-                    parser.cleanup()
-                    
-            # Запускаем очистку в фоновом режиме
-            asyncio.create_task(cleanup_after_response())
-            
-            return FileResponse(
-                path=file_path,
-                filename=os.path.basename(file_path),
-                media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+        services = get_services()
+        sessions = await resources.enter_async_context(services.client_pool.lease_many(request.accounts))
+        parser = services.create_parser(request, sessions)
+        resources.callback(parser.cleanup)
+
+        if exporter_class.streamable:
+            channel = await parser.open_channel(request.channel_link)
+            resources.push_async_callback(parser.close_channel, channel)
+            filename = parser.export_filename(channel, request.channel_link)
+            body = stream_rows(exporter_class, parser.iter_rows(channel))
         else:
-            if parser:
-                parser.cleanup()
-            raise HTTPException(status_code=400, detail=result.get('error', 'Unknown error'))
-            
+            result = await parser.parse_channel(request.channel_link)
+            filename = os.path.basename(result['filename'])
+            body = iter_file(result['filename'])
     except Exception as e:
-        if parser:
-            parser.cleanup()
+        await resources.aclose()
         logging.error(f"Error during parsing: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def stream():
+        try:
+            async for chunk in body:
+                yield chunk
+        except Exception as e:
+            logging.error(f"Error during streaming: {str(e)}")
+            raise
+        finally:
+            await resources.aclose()
+
+    return file_stream_response(stream(), filename, exporter_class)
+
+# Пакетный парсинг: несколько каналов, один файл с дедупликацией пользователей
+@app.post("/api/parse/batch")
+async def parse_channels(request: BatchParseRequest):
+    validate_options(request, sync=True)
+    require_local_sessions()
+    exporter_class = get_exporter_class(request.format)
+    if get_services().cacheable(request):
+        return await cached_response(request, request.channel_links, exporter_class)
+
+    resources = AsyncExitStack()
+    try:
+        services = get_services()
+        sessions = await resources.enter_async_context(services.client_pool.lease_many(request.accounts))
+        parser = services.create_parser(request, sessions)
+        resources.callback(parser.cleanup)
+        result = await parser.parse_channels(request.channel_links)
+    except Exception as e:
+        await resources.aclose()
+        logging.error(f"Error during batch parsing: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def stream():
+        try:
+            async for chunk in iter_file(result['filename']):
+                yield chunk
+        finally:
+            await resources.aclose()
+
+    return file_stream_response(stream(), os.path.basename(result['filename']), exporter_class)
+
+# Обновление профилей известных пользователей (имена, статус, флаги) пачками
+# GetUsersRequest, без обхода каналов; bio — только при parse_bio
+@app.post("/api/refresh")
+async def refresh_profiles(request: RefreshRequest):
+    validate_options(request, sync=True)
+    require_local_sessions()
+    exporter_class = get_exporter_class(request.format)
+
+    resources = AsyncExitStack()
+    try:
+        services = get_services()
+        sessions = await resources.enter_async_context(services.client_pool.lease_many(request.accounts))
+        parser = services.create_parser(request, sessions)
+        resources.callback(parser.cleanup)
+        result = await parser.refresh_profiles(request.user_ids)
+    except Exception as e:
+        await resources.aclose()
+        logging.error(f"Error during profile refresh: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def stream():
+        try:
+            async for chunk in iter_file(result['filename']):
+                yield chunk
+        finally:
+            await resources.aclose()
+
+    return file_stream_response(stream(), os.path.basename(result['filename']), exporter_class)
+
 # Обработка ошибок
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -0,0 +1,63 @@
+from array import array
+
+from .exporters import COLUMNS
+
+
+class MemberStore:
+    """Компактное хранилище обогащённых строк по колонкам.
+
+    ``user_id`` лежит в array('q'), каждая текстовая колонка — в одном
+    bytearray UTF-8 с массивом смещений, так что строка стоит несколько байт
+    служебных данных вместо словаря и пяти объектов str. Строки-словари
+    создаются только при чтении (``store[i]``, итерация), поэтому экспортёры
+    читают хранилище напрямую, по одной строке.
+    """
+
+    def __init__(self, columns=COLUMNS):
+        self.columns = list(columns)
+        self._ids = array('q')
+        self._text = {
+            column: (bytearray(), array('Q', [0])) for column in self.columns if column != 'user_id'
+        }
+
+    def append(self, row):
+        self._ids.append(row['user_id'])
+        for column, (data, offsets) in self._text.items():
+            value = row.get(column)
+            if value:
+                data += str(value).encode('utf-8')
+            offsets.append(len(data))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def value(self, index, column):
+        if column == 'user_id':
+            return self._ids[index]
+        data, offsets = self._text[column]
+        return data[offsets[index]:offsets[index + 1]].decode('utf-8')
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return {column: self.value(index, column) for column in self.columns}
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def user_ids(self):
+        return self._ids
+
+    def nbytes(self):
+        """Объём данных в буферах (без накладных расходов самих объектов)"""
+        size = self._ids.itemsize * len(self._ids)
+        for data, offsets in self._text.values():
+            size += len(data) + offsets.itemsize * len(offsets)
+        return size
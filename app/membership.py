@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+from collections import Counter, defaultdict
+
+from telethon.errors import ChatAdminRequiredError, ChannelPrivateError, UserNotParticipantError
+from telethon.tl.functions.channels import JoinChannelRequest, LeaveChannelRequest, GetParticipantsRequest
+from telethon.tl.types import ChannelParticipantsSearch
+
+from .metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд после последней задачи выходить из канала, в который вступили сами
+DEFAULT_LEAVE_DELAY = float(os.getenv('MEMBERSHIP_LEAVE_DELAY', '300'))
+# Ошибки запроса к каналу, означающие, что аккаунт в нём больше не состоит
+ACCESS_LOST_ERRORS = (ChannelPrivateError, UserNotParticipantError)
+
+
+class MembershipManager:
+    """Членство одного аккаунта в каналах, общее для всех его задач.
+
+    Реестр помнит, к каким каналам у аккаунта уже есть доступ и в какие он
+    вступил сам, поэтому проверка доступа делается один раз на канал, а не на
+    каждую задачу. Задачи берут канал через ``acquire`` и отдают через
+    ``release``; одновременные задачи на одном канале делят одно вступление.
+    Выход откладывается на ``leave_delay`` секунд и выполняется пачкой для всех
+    освободившихся каналов; если за это время канал снова понадобился, выхода
+    не будет. Из каналов, где аккаунт состоял и раньше, выхода не бывает вовсе.
+    Запомненный доступ сбрасывается при выходе и через ``forget``, когда запрос
+    к каналу показал, что аккаунт из него исключён.
+    ``call(request)`` выполняет запрос к API (обычно через ограничитель скорости).
+    """
+
+    def __init__(self, call, leave_delay=DEFAULT_LEAVE_DELAY):
+        self._call = call
+        self.leave_delay = leave_delay
+        self._access = {}
+        self._joined = {}
+        self._refs = Counter()
+        self._pending = {}
+        self._locks = defaultdict(asyncio.Lock)
+        self._flusher = None
+        self.probes = 0
+        self.joins = 0
+        self.leaves = 0
+        self.shared = 0
+
+    async def acquire(self, channel, auto_join=True):
+        """Обеспечивает доступ к каналу на время задачи; False, если доступа нет"""
+        async with self._locks[channel.id]:
+            if self._refs[channel.id]:
+                self.shared += 1
+            self._refs[channel.id] += 1
+            # Канал снова нужен — отложенный выход отменяется
+            self._pending.pop(channel.id, None)
+            try:
+                if await self._has_access(channel):
+                    return True
+                if not auto_join:
+                    logger.error("Нет доступа к каналу и автоматическое вступление отключено")
+                elif await self._join(channel):
+                    return True
+            except BaseException:
+                self._refs[channel.id] -= 1
+                raise
+            self._refs[channel.id] -= 1
+            return False
+
+    async def _has_access(self, channel):
+        if self._access.get(channel.id):
+            return True
+        # Сущность из API сама сообщает о членстве — проверочный запрос не нужен
+        if getattr(channel, 'left', None) is False:
+            self._access[channel.id] = True
+            return True
+        self.probes += 1
+        try:
+            await self._call(GetParticipantsRequest(channel, ChannelParticipantsSearch(''), 0, 1, hash=0))
+        except ChatAdminRequiredError:
+            # Список участников канала-трансляции закрыт для не-админов, но канал виден
+            pass
+        except Exception:
+            self._access[channel.id] = False
+            return False
+        logger.info("Уже являемся участником канала")
+        self._access[channel.id] = True
+        return True
+
+    async def _join(self, channel):
+        try:
+            with span('join', channel=channel.id):
+                await self._call(JoinChannelRequest(channel))
+        except Exception as e:
+            logger.error(f"Не удалось вступить в канал: {str(e)}")
+            return False
+        logger.info("Успешно вступили в канал")
+        self.joins += 1
+        self._access[channel.id] = True
+        self._joined[channel.id] = channel
+        return True
+
+    def forget(self, channel_id):
+        """Доступа к каналу больше нет (исключили, канал закрыт): следующий ``acquire`` проверит его заново"""
+        self._access.pop(channel_id, None)
+        # Выходить уже не из чего
+        self._joined.pop(channel_id, None)
+        self._pending.pop(channel_id, None)
+
+    async def release(self, channel):
+        """Задача закончила работу с каналом; выход — только когда канал больше никому не нужен"""
+        self._refs[channel.id] -= 1
+        if self._refs[channel.id] > 0 or channel.id not in self._joined:
+            return
+        if self.leave_delay <= 0:
+            await self._leave(channel.id)
+            return
+        self._pending[channel.id] = asyncio.get_running_loop().time() + self.leave_delay
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            await asyncio.sleep(max(0.0, min(self._pending.values()) - loop.time()))
+            now = loop.time()
+            due = [channel_id for channel_id, deadline in self._pending.items() if deadline <= now]
+            await self._leave_many(due)
+
+    async def _leave_many(self, channel_ids):
+        for channel_id in channel_ids:
+            self._pending.pop(channel_id, None)
+        await asyncio.gather(*(self._leave(channel_id) for channel_id in channel_ids))
+
+    async def _leave(self, channel_id):
+        async with self._locks[channel_id]:
+            # Пока выход ждал очереди, канал мог снова понадобиться
+            if self._refs[channel_id] > 0 or channel_id not in self._joined:
+                return
+            channel = self._joined.pop(channel_id)
+            self._access.pop(channel_id, None)
+            try:
+                with span('leave', channel=channel_id):
+                    await self._call(LeaveChannelRequest(channel))
+                self.leaves += 1
+                logger.info("Успешно вышли из канала")
+            except Exception as e:
+                logger.error(f"Ошибка при выходе из канала: {str(e)}")
+
+    async def flush(self):
+        """Немедленно выходит из всех каналов, ожидающих отложенного выхода"""
+        await self._leave_many(list(self._pending))
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            'member_of': sum(1 for access in self._access.values() if access),
+            'joined_by_us': len(self._joined),
+            'in_use': sum(1 for refs in self._refs.values() if refs > 0),
+            'pending_leaves': len(self._pending),
+            'probes': self.probes,
+            'joins': self.joins,
+            'leaves': self.leaves,
+            'shared': self.shared,
+        }
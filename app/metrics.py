@@ -0,0 +1,165 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм длительности (секунды): от быстрых запросов до долгих стадий
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """Метрика с метками: значения хранятся по кортежу значений меток"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value:g}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Счётчики по корзинам (последняя — +Inf), сумма и количество
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def value(self, **labels):
+        state = self._values.get(self._key(labels))
+        return {'count': state[2], 'sum': state[1]} if state else {'count': 0, 'sum': 0.0}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", le)])} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {total:g}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+API_CALLS = REGISTRY.counter(
+    'telegram_api_calls_total', 'Запросы к Telegram API по методу и исходу', ('method', 'outcome'))
+API_CALL_SECONDS = REGISTRY.histogram(
+    'telegram_api_call_seconds', 'Длительность запроса к Telegram API без ожидания лимита', ('method',))
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.counter(
+    'telegram_rate_limit_wait_seconds_total', 'Время ожидания в ограничителе скорости')
+FLOOD_WAITS = REGISTRY.counter('telegram_flood_waits_total', 'Полученные FloodWaitError', ('method',))
+FLOOD_WAIT_SECONDS = REGISTRY.counter('telegram_flood_wait_seconds_total', 'Суммарная длительность FloodWait')
+STAGE_SECONDS = REGISTRY.histogram(
+    'parser_stage_seconds', 'Длительность стадий парсинга', ('stage',))
+STAGE_FAILURES = REGISTRY.counter('parser_stage_failures_total', 'Ошибки стадий парсинга', ('stage',))
+USERS = REGISTRY.counter('parser_users_total', 'Пользователи, прошедшие стадию', ('stage',))
+PROFILE_CACHE_LOOKUPS = REGISTRY.counter(
+    'profile_cache_lookups_total', 'Обращения к кэшу профилей', ('result',))
+ENTITY_CACHE_LOOKUPS = REGISTRY.counter(
+    'entity_cache_lookups_total', 'Обращения к кэшу разрешения ссылок на каналы', ('result',))
+RESULT_CACHE_LOOKUPS = REGISTRY.counter(
+    'result_cache_lookups_total', 'Обращения к кэшу готовых результатов', ('result',))
+JOBS = REGISTRY.gauge('parser_jobs', 'Задачи парсинга по состоянию', ('status',))
+SESSION_RATE = REGISTRY.gauge(
+    'telegram_session_rate', 'Текущая скорость ограничителя сессии, запр./с', ('session',))
+
+
+@contextmanager
+def span(stage, **fields):
+    """Замеряет длительность стадии: гистограмма parser_stage_seconds и debug-лог.
+
+    Исключение внутри блока учитывается в parser_stage_failures_total и
+    пробрасывается дальше.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('span stage=%s duration=%.4f %s', stage, elapsed,
+                         ' '.join(f'{key}={value}' for key, value in fields.items()))
@@ -0,0 +1,199 @@
+import logging
+import os
+import sqlite3
+import time
+
+from .metrics import PROFILE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Время жизни записи (секунды) и максимальное число профилей в кэше
+DEFAULT_TTL = int(os.getenv('PROFILE_CACHE_TTL', str(7 * 24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', '1000000'))
+# Сколько обращений копить в памяти перед записью времени доступа в базу
+TOUCH_BATCH_SIZE = 500
+# Через сколько записанных пользователей проверять размер таблицы users
+USERS_EVICT_CHECK = 10000
+# Сколько user_id передавать в одном SQL-запросе (ограничение числа параметров)
+SQL_CHUNK_SIZE = 500
+# Поля профиля из списка участников, которые обновляются пачкой GetUsersRequest
+USER_FIELDS = ('username', 'first_name', 'last_name', 'status', 'premium', 'bot', 'deleted')
+
+
+class ProfileCache:
+    """Постоянный кэш профилей пользователей (SQLite) с TTL и LRU-вытеснением.
+
+    Ключ — user_id, значение — bio, username и имена. Время последнего
+    обращения копится в памяти и записывается пачками, чтобы попадание в кэш
+    не стоило отдельной транзакции.
+
+    Отдельная таблица ``users`` хранит всех встреченных пользователей: поля
+    профиля из списка участников и access_hash вместе с сессией, которой он
+    выдан. По ней профили известной аудитории обновляются пачками
+    GetUsersRequest без повторного обхода каналов.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._touched = {}
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS profiles ('
+            'user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, last_name TEXT, '
+            'bio TEXT, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS profiles_accessed_at ON profiles (accessed_at)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS users ('
+            'user_id INTEGER PRIMARY KEY, session TEXT NOT NULL, access_hash INTEGER NOT NULL, '
+            'username TEXT, first_name TEXT, last_name TEXT, status TEXT, premium INTEGER, bot INTEGER, '
+            'deleted INTEGER, refreshed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS users_refreshed_at ON users (refreshed_at)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COUNT(*) FROM profiles').fetchone()[0]
+        self._users_written = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Возвращает профиль из кэша или None, если записи нет или она устарела"""
+        row = self._conn.execute(
+            'SELECT username, first_name, last_name, bio, fetched_at FROM profiles WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        now = self._clock()
+        if row is None:
+            self.misses += 1
+            PROFILE_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        if now - row[4] > self.ttl:
+            self.expired += 1
+            self.misses += 1
+            PROFILE_CACHE_LOOKUPS.inc(result='expired')
+            return None
+
+        self.hits += 1
+        PROFILE_CACHE_LOOKUPS.inc(result='hit')
+        self._touched[user_id] = now
+        if len(self._touched) >= TOUCH_BATCH_SIZE:
+            self.flush()
+        return {
+            'user_id': user_id,
+            'username': row[0] or '',
+            'first_name': row[1] or '',
+            'last_name': row[2] or '',
+            'bio': row[3] or '',
+        }
+
+    def put(self, user_id, bio='', username='', first_name='', last_name=''):
+        now = self._clock()
+        self._touched.pop(user_id, None)
+        values = (username or '', first_name or '', last_name or '', bio or '', now, now, user_id)
+        cursor = self._conn.execute(
+            'UPDATE profiles SET username = ?, first_name = ?, last_name = ?, bio = ?, '
+            'fetched_at = ?, accessed_at = ? WHERE user_id = ?',
+            values
+        )
+        if cursor.rowcount == 0:
+            self._conn.execute(
+                'INSERT INTO profiles (username, first_name, last_name, bio, fetched_at, accessed_at, user_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                values
+            )
+            self._size += 1
+            if self._size > self.max_entries:
+                self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        """Удаляет давно не использованные записи сверх max_entries"""
+        # Файл могут делить несколько процессов, поэтому размер уточняем по базе
+        self._size = self._conn.execute('SELECT COUNT(*) FROM profiles').fetchone()[0]
+        excess = self._size - self.max_entries
+        if excess <= 0:
+            return
+        self._flush_touched()
+        self._conn.execute(
+            'DELETE FROM profiles WHERE user_id IN '
+            '(SELECT user_id FROM profiles ORDER BY accessed_at LIMIT ?)',
+            (excess,)
+        )
+        self._size -= excess
+        self.evictions += excess
+
+    def put_users(self, session, users):
+        """Запоминает пользователей, увиденных сессией: словари с user_id, access_hash и USER_FIELDS"""
+        now = self._clock()
+        rows = [
+            (user['user_id'], session, user['access_hash'], *(user.get(field) for field in USER_FIELDS), now)
+            for user in users if user.get('access_hash') is not None
+        ]
+        if not rows:
+            return
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO users (user_id, session, access_hash, '
+            + ', '.join(USER_FIELDS) + ', refreshed_at) VALUES (' + ', '.join('?' * (len(USER_FIELDS) + 4)) + ')',
+            rows
+        )
+        self._users_written += len(rows)
+        if self._users_written >= USERS_EVICT_CHECK:
+            self._users_written = 0
+            self._conn.execute(
+                'DELETE FROM users WHERE user_id IN (SELECT user_id FROM users ORDER BY refreshed_at '
+                'LIMIT MAX(0, (SELECT COUNT(*) FROM users) - ?))',
+                (self.max_entries,)
+            )
+        self._conn.commit()
+
+    def user_refs(self, user_ids):
+        """{user_id: (session, access_hash)} для известных пользователей"""
+        user_ids = list(user_ids)
+        refs = {}
+        for start in range(0, len(user_ids), SQL_CHUNK_SIZE):
+            chunk = user_ids[start:start + SQL_CHUNK_SIZE]
+            refs.update(
+                (user_id, (session, access_hash)) for user_id, session, access_hash in self._conn.execute(
+                    f'SELECT user_id, session, access_hash FROM users WHERE user_id IN ({", ".join("?" * len(chunk))})',
+                    chunk
+                )
+            )
+        return refs
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                'UPDATE profiles SET accessed_at = ? WHERE user_id = ?',
+                [(accessed_at, user_id) for user_id, accessed_at in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def flush(self):
+        """Записывает накопленные времена обращений"""
+        self._flush_touched()
+        self._conn.commit()
+
+    def close(self):
+        try:
+            self.flush()
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии кэша профилей: {str(e)}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
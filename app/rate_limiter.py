@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import time
+
+from telethon.errors import FloodWaitError, ServerError
+
+from .metrics import API_CALLS, API_CALL_SECONDS, RATE_LIMIT_WAIT_SECONDS, FLOOD_WAITS, FLOOD_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Начальная, минимальная и максимальная скорость запросов (запросов в секунду)
+DEFAULT_RATE = float(os.getenv('API_RATE', '10'))
+DEFAULT_MIN_RATE = float(os.getenv('API_MIN_RATE', '0.5'))
+DEFAULT_MAX_RATE = float(os.getenv('API_MAX_RATE', '50'))
+# FloodWait длиннее этого порога не пережидаем, а пробрасываем вызывающему
+DEFAULT_MAX_FLOOD_WAIT = int(os.getenv('API_MAX_FLOOD_WAIT', '300'))
+
+# Ошибки, которые означают перегрузку и должны снижать скорость
+OVERLOAD_ERRORS = (ServerError, asyncio.TimeoutError, ConnectionError)
+
+
+class AdaptiveRateLimiter:
+    """Token bucket с AIMD-подстройкой скорости и учётом FloodWaitError.
+
+    Скорость растёт аддитивно (примерно на ``increase`` запросов/с за каждую
+    секунду без ошибок) и делится на ``1 / decrease`` при FloodWait и ошибках
+    перегрузки. FloodWait дополнительно блокирует все запросы на ``seconds``.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE,
+                 increase=1.0, decrease=0.5, burst=None, max_retries=3,
+                 max_flood_wait=DEFAULT_MAX_FLOOD_WAIT, clock=time.monotonic, sleep=asyncio.sleep):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst or max(1.0, self.rate)
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = asyncio.Lock()
+        self._tokens = 1.0
+        self._updated = clock()
+        self._blocked_until = 0.0
+
+        self.requests = 0
+        self.errors = 0
+        self.waits = 0
+        self.flood_waits = 0
+        self.wait_time = 0.0
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Ждёт, пока можно будет отправить следующий запрос"""
+        async with self._lock:
+            # Пока действует FloodWait, ждём его окончания (он может продлиться)
+            while self._clock() < self._blocked_until:
+                await self._wait(self._blocked_until - self._clock())
+            self._refill(self._clock())
+            if self._tokens < 1.0:
+                await self._wait((1.0 - self._tokens) / self.rate)
+                # Ждали ровно столько, сколько нужно для одного токена
+                self._refill(self._clock())
+                self._tokens = max(self._tokens, 1.0)
+            self._tokens -= 1.0
+            self.requests += 1
+
+    async def _wait(self, delay):
+        self.waits += 1
+        self.wait_time += delay
+        RATE_LIMIT_WAIT_SECONDS.inc(delay)
+        await self._sleep(delay)
+
+    def blocked_for(self):
+        """Сколько секунд ещё продлится пауза после FloodWait"""
+        return max(0.0, self._blocked_until - self._clock())
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_error(self):
+        self.errors += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def on_flood_wait(self, seconds):
+        now = self._clock()
+        self.flood_waits += 1
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = max(now, self._blocked_until)
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    async def call(self, func, *args, **kwargs):
+        """Выполняет ``await func(*args, **kwargs)`` с учётом лимита.
+
+        FloodWaitError короче ``max_flood_wait`` пережидается и запрос
+        повторяется (не более ``max_retries`` раз), более длинный пробрасывается.
+        """
+        # Для запросов Telethon метод — тип запроса, для методов клиента — имя метода
+        method = getattr(func, '__name__', None) or type(args[0]).__name__
+        attempt = 0
+        while True:
+            await self.acquire()
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                API_CALLS.inc(method=method, outcome='flood_wait')
+                FLOOD_WAITS.inc(method=method)
+                FLOOD_WAIT_SECONDS.inc(e.seconds)
+                # Ожидание дольше max_flood_wait решает вызывающий: остальные запросы
+                # (FloodWait в Telegram действует на метод) ждут не больше max_flood_wait
+                self.on_flood_wait(min(e.seconds, self.max_flood_wait))
+                logger.warning(f"FloodWait на {e.seconds} с, скорость снижена до {self.rate:.2f} запр./с")
+                if e.seconds > self.max_flood_wait or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                continue
+            except OVERLOAD_ERRORS:
+                API_CALLS.inc(method=method, outcome='overload')
+                self.on_error()
+                raise
+            except Exception:
+                API_CALLS.inc(method=method, outcome='error')
+                raise
+            finally:
+                API_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
+            API_CALLS.inc(method=method, outcome='ok')
+            self.on_success()
+            return result
+
+    def stats(self):
+        return {
+            'rate': round(self.rate, 3),
+            'requests': self.requests,
+            'errors': self.errors,
+            'waits': self.waits,
+            'flood_waits': self.flood_waits,
+            'wait_time': round(self.wait_time, 3),
+        }
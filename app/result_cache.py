@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+from .entity_cache import normalize_link, cache_key
+from .metrics import RESULT_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд готовый файл считается свежим (0 — кэш отключён, по умолчанию:
+# синхронный /api/parse тогда отдаёт CSV и NDJSON потоком прямо из парсинга)
+DEFAULT_TTL = int(os.getenv('RESULT_CACHE_TTL', '0'))
+# Предельный объём файлов кэша на диске
+DEFAULT_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(2 * 2**30)))
+# Параметры запроса, от которых зависит содержимое файла результата
+RESULT_OPTIONS = ('parse_bio', 'parse_username', 'format', 'filter', 'sharded', 'source', 'history_limit',
+                  'analytics', 'analytics_keywords')
+
+
+def result_key(channel_keys, options):
+    """Ключ результата: хэш нормализованных каналов и влияющих на файл параметров"""
+    payload = json.dumps(
+        {'channels': list(channel_keys), **{name: options.get(name) for name in RESULT_OPTIONS}},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def request_key(params):
+    """Ключ результата по параметрам запроса (ParseOptions.dict()).
+
+    None — результат нельзя переиспользовать: инкрементальный зависит от
+    прошлого снимка, обновление профилей — от кэша профилей. Разные формы
+    ссылки на канал (@name, t.me/name) дают один ключ.
+    """
+    if params.get('incremental') or 'user_ids' in params:
+        return None
+    links = params['channel_links'] if 'channel_links' in params else [params['channel_link']]
+    return result_key([cache_key(*normalize_link(link)) for link in links], params)
+
+
+class CachedResult:
+    """Готовый файл результата в кэше"""
+
+    def __init__(self, key, path, filename, size, created_at, meta):
+        self.key = key
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.created_at = created_at
+        self.meta = meta
+
+    def open(self):
+        """Открывает файл на чтение; вытеснение после этого отдачу не прервёт"""
+        return open(self.path, 'rb')
+
+
+class ResultCache:
+    """Кэш готовых файлов результата на диске с индексом в SQLite.
+
+    Файл хранится под ключом запроса (``result_key``), свежим считается
+    ``ttl`` секунд. Суммарный размер файлов ограничен ``max_bytes``: при
+    превышении удаляются давно не запрашивавшиеся. Уже открытый на чтение
+    файл (``CachedResult.open``) вытеснение не прерывает.
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, path TEXT NOT NULL, filename TEXT NOT NULL, size INTEGER NOT NULL, '
+            'meta TEXT, created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key):
+        """Свежий результат или None"""
+        row = self._conn.execute(
+            'SELECT path, filename, size, meta, created_at FROM results WHERE key = ?', (key,)
+        ).fetchone()
+        now = self._clock()
+        if row is None or now - row[4] > self.ttl:
+            self.misses += 1
+            RESULT_CACHE_LOOKUPS.inc(result='miss' if row is None else 'expired')
+            return None
+        path, filename, size, meta, created_at = row
+        if not os.path.exists(path):
+            self._delete(key, path)
+            self.misses += 1
+            RESULT_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        self._conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+        self._conn.commit()
+        self.hits += 1
+        RESULT_CACHE_LOOKUPS.inc(result='hit')
+        return CachedResult(key, path, filename, size, created_at, json.loads(meta) if meta else {})
+
+    def put(self, key, source_path, filename, meta=None):
+        """Переносит файл результата в кэш и вытесняет лишнее сверх ``max_bytes``"""
+        _, extension = os.path.splitext(filename)
+        path = os.path.join(self.directory, key + extension)
+        shutil.move(source_path, path)
+        size = os.path.getsize(path)
+        now = self._clock()
+        self._conn.execute(
+            'INSERT OR REPLACE INTO results (key, path, filename, size, meta, created_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, path, filename, size, json.dumps(meta, ensure_ascii=False) if meta else None, now, now)
+        )
+        self._conn.commit()
+        self.evict(keep=key)
+        return CachedResult(key, path, filename, size, now, meta or {})
+
+    def evict(self, keep=None):
+        """Удаляет устаревшие файлы, затем самые давно запрошенные, пока объём больше ``max_bytes``.
+
+        Только что добавленный ``keep`` не удаляется, даже если один превышает предел.
+        """
+        now = self._clock()
+        rows = self._conn.execute(
+            'SELECT key, path, size, created_at FROM results ORDER BY accessed_at'
+        ).fetchall()
+        total = sum(row[2] for row in rows)
+        for key, path, size, created_at in rows:
+            if key == keep or (now - created_at <= self.ttl and total <= self.max_bytes):
+                continue
+            self._delete(key, path)
+            self.evictions += 1
+            total -= size
+        return total
+
+    def _delete(self, key, path):
+        self._conn.execute('DELETE FROM results WHERE key = ?', (key,))
+        self._conn.commit()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {
+            'entries': total[0], 'bytes': total[1],
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+        }
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии кэша результатов: {str(e)}")
+
+
+class SingleFlight:
+    """Объединяет одновременные одинаковые вызовы: работа выполняется один раз на ключ.
+
+    Первый вызов ``run(key, make)`` запускает ``make()`` отдельной задачей,
+    остальные с тем же ключом ждут её результата (или ошибки). Отмена одного
+    из ожидающих (например, клиент закрыл соединение) не прерывает работу
+    для других.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.coalesced = 0
+
+    async def run(self, key, make):
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.create_task(make())
+            self._flights[key] = task
+            task.add_done_callback(lambda task: self._landed(key, task))
+        else:
+            self.coalesced += 1
+            RESULT_CACHE_LOOKUPS.inc(result='coalesced')
+        return await asyncio.shield(task)
+
+    def _landed(self, key, task):
+        self._flights.pop(key, None)
+        # Ошибка считается полученной, даже если все ожидавшие уже ушли
+        if not task.cancelled():
+            task.exception()
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    def __len__(self):
+        return len(self._flights)
@@ -0,0 +1,84 @@
+"""Долгоживущие объекты API-процесса для работы с Telegram: пул клиентов и кэши.
+
+Модуль тянет за собой Telethon, поэтому main импортирует его только при
+первом обращении к Telegram (см. ``main.get_services``): страницы и статус
+задач обслуживаются без загрузки схемы TL.
+"""
+import os
+
+from .client_pool import ClientPool
+from .config import get_settings, SESSIONS_DIR
+from .entity_cache import EntityCache
+from .profile_cache import ProfileCache
+from .result_cache import ResultCache, SingleFlight, request_key
+from .snapshots import SnapshotStore
+from .worker import JobRunner
+
+# Каталог переопределяется переменной SESSIONS_DIR (см. config)
+sessions_path = SESSIONS_DIR
+os.makedirs(sessions_path, exist_ok=True)
+# Общий кэш профилей для всех запросов процесса
+profile_cache = ProfileCache(os.path.join(sessions_path, "profile_cache.sqlite"))
+# Снимки состава каналов для инкрементального режима
+snapshot_store = SnapshotStore(os.path.join(sessions_path, "snapshots.sqlite"))
+# Разрешённые ссылки на каналы (id и access_hash) — отдельно для каждой сессии
+entity_cache = EntityCache(os.path.join(sessions_path, "entities.sqlite"))
+# Готовые файлы одинаковых запросов и объединение одновременных парсингов
+result_cache = ResultCache(os.path.join(sessions_path, "results_cache"))
+flights = SingleFlight()
+
+# Пул долгоживущих клиентов: подключаются при старте приложения (или при первом
+# парсинге в режиме быстрого старта), а не на каждый запрос.
+# У каждой сессии свой ограничитель скорости, так как лимиты Telegram действуют на аккаунт
+_settings = get_settings()
+client_pool = ClientPool(_settings.api_id, _settings.api_hash, sessions_path)
+
+# Выполнение задач из очереди на сессиях пула этого процесса
+runner = JobRunner(client_pool, profile_cache, entity_cache, snapshot_store, result_cache)
+
+
+def create_parser(request, sessions):
+    """Парсер для синхронного запроса API на выданных пулом сессиях (тот же, что у задач)"""
+    return runner.create_parser(request.dict(), sessions)
+
+
+def cacheable(request):
+    """Инкрементальный результат зависит от предыдущего снимка, его не кэшируем"""
+    return result_cache.enabled and not request.incremental
+
+
+async def cached_result(request, channel_links):
+    """Файл результата из кэша; при промахе одинаковые одновременные запросы ждут один парсинг.
+
+    Возвращает CachedResult и откуда он взят: 'hit', 'miss' или 'coalesced'.
+    Разные формы ссылки на канал (@name, t.me/name) дают один ключ.
+    """
+    key = request_key(request.dict())
+    entry = result_cache.get(key)
+    if entry is not None:
+        return entry, 'hit'
+    status = 'coalesced' if key in flights else 'miss'
+    entry = await flights.run(key, lambda: _parse_into_cache(key, request, channel_links))
+    return entry, status
+
+
+async def _parse_into_cache(key, request, channel_links):
+    async with client_pool.lease_many(request.accounts) as sessions:
+        parser = create_parser(request, sessions)
+        try:
+            if hasattr(request, 'channel_links'):
+                result = await parser.parse_channels(channel_links)
+            else:
+                result = await parser.parse_channel(channel_links[0])
+            return result_cache.put(key, result['filename'], os.path.basename(result['filename']),
+                                    {'total_users': result['total_users']})
+        finally:
+            parser.cleanup()
+
+
+async def close():
+    await client_pool.stop()
+    profile_cache.close()
+    snapshot_store.close()
+    entity_cache.close()
+    result_cache.close()
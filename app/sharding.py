@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import logging
+import os
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Символы, которыми продолжается префикс поиска при дроблении шарда
+SHARD_ALPHABET = 'abcdefghijklmnopqrstuvwxyz' 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя' '0123456789'
+# Сколько участников Telegram отдаёт по одному запросу поиска; шард с большим
+# числом совпадений не дочитать до конца, и он делится на более длинные префиксы
+SHARD_SATURATION = int(os.getenv('SHARD_SATURATION', '10000'))
+SHARD_MAX_DEPTH = int(os.getenv('SHARD_MAX_DEPTH', '4'))
+DEFAULT_SHARD_CONCURRENCY = int(os.getenv('SHARD_CONCURRENCY', '4'))
+# Сколько найденных пользователей может ждать обогащения, прежде чем шарды приостановятся
+SHARD_BUFFER_SIZE = 1000
+
+
+class CompactIdSet:
+    """Множество user_id: отсортированный array('q') (8 байт на id) и небольшой буфер.
+
+    Новые id копятся в обычном set и сливаются в массив, когда буфер
+    достигает ``buffer_size``; на миллионе id это в несколько раз меньше set.
+    """
+
+    def __init__(self, ids=(), buffer_size=65536):
+        self.buffer_size = buffer_size
+        self._sorted = array('q')
+        self._buffer = set()
+        for user_id in ids:
+            self.add(user_id)
+
+    def __contains__(self, user_id):
+        if user_id in self._buffer:
+            return True
+        i = bisect_left(self._sorted, user_id)
+        return i < len(self._sorted) and self._sorted[i] == user_id
+
+    def __len__(self):
+        return len(self._sorted) + len(self._buffer)
+
+    def add(self, user_id):
+        """Добавляет id; возвращает False, если он уже был"""
+        if user_id in self:
+            return False
+        self._buffer.add(user_id)
+        if len(self._buffer) >= self.buffer_size:
+            self._merge()
+        return True
+
+    def _merge(self):
+        self._sorted = array('q', heapq.merge(self._sorted, sorted(self._buffer)))
+        self._buffer = set()
+
+
+class ShardedEnumeration:
+    """Перебор участников канала поисковыми запросами по префиксам имени.
+
+    Поиск начинается с пустого префикса; если совпадений не меньше
+    ``saturation``, префикс дробится на ``prefix + символ`` для каждого символа
+    алфавита (не глубже ``max_depth``). Шарды обходятся ``concurrency``
+    воркерами, пользователи дедуплицируются в CompactIdSet и отдаются
+    асинхронным генератором ``users()``. ``fetch_page(query, offset)``
+    возвращает страницу GetParticipantsRequest, ``on_page(new_users)`` вызывается
+    после каждой страницы с числом впервые найденных пользователей.
+    """
+
+    def __init__(self, fetch_page, alphabet=SHARD_ALPHABET, saturation=SHARD_SATURATION,
+                 max_depth=SHARD_MAX_DEPTH, concurrency=DEFAULT_SHARD_CONCURRENCY, skip=(), on_page=None):
+        self.fetch_page = fetch_page
+        self.alphabet = alphabet
+        self.saturation = saturation
+        self.max_depth = max_depth
+        self.concurrency = max(1, concurrency)
+        self.on_page = on_page
+        self.ids = CompactIdSet(skip)
+        self.total = None
+        self.shards = 0
+        self.split_shards = 0
+        self.truncated_shards = []
+        self.requests = 0
+        self._error = None
+
+    async def users(self):
+        out = asyncio.Queue(maxsize=SHARD_BUFFER_SIZE)
+        runner = asyncio.ensure_future(self._run(out))
+        try:
+            while True:
+                user = await out.get()
+                if user is None:
+                    break
+                yield user
+            if self._error is not None:
+                raise self._error
+        finally:
+            if not runner.done():
+                runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    async def _run(self, out):
+        prefixes = asyncio.Queue()
+        prefixes.put_nowait(('', 0))
+        workers = [asyncio.ensure_future(self._worker(prefixes, out)) for _ in range(self.concurrency)]
+        finished = asyncio.ensure_future(prefixes.join())
+        try:
+            # Воркеры работают бесконечно, поэтому завершившийся воркер означает ошибку
+            await asyncio.wait([finished, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for worker in workers:
+                if worker.done():
+                    self._error = worker.exception()
+                    break
+        finally:
+            for task in (finished, *workers):
+                task.cancel()
+            await asyncio.gather(finished, *workers, return_exceptions=True)
+        await out.put(None)
+
+    async def _worker(self, prefixes, out):
+        while True:
+            prefix, depth = await prefixes.get()
+            try:
+                await self._shard(prefix, depth, prefixes, out)
+            finally:
+                prefixes.task_done()
+
+    async def _fetch(self, prefix, offset):
+        self.requests += 1
+        result = await self.fetch_page(prefix, offset)
+        if prefix == '' and offset == 0:
+            self.total = result.count
+        return result
+
+    async def _shard(self, prefix, depth, prefixes, out):
+        self.shards += 1
+        result = await self._fetch(prefix, 0)
+        saturated = result.count >= self.saturation
+        if saturated and depth < self.max_depth:
+            # Первая страница уже получена — её пользователи не пропадают
+            self.split_shards += 1
+            await self._emit(result.users, out)
+            for char in self.alphabet:
+                prefixes.put_nowait((prefix + char, depth + 1))
+            return
+        if saturated:
+            self.truncated_shards.append(prefix)
+            logger.warning(f"Шард '{prefix}' достиг предела выдачи ({result.count} совпадений), часть участников пропущена")
+
+        offset = 0
+        while result.participants:
+            await self._emit(result.users, out)
+            offset += len(result.participants)
+            if offset >= result.count:
+                break
+            result = await self._fetch(prefix, offset)
+
+    async def _emit(self, users, out):
+        new_users = [user for user in users if self.ids.add(user.id)]
+        if self.on_page:
+            self.on_page(len(new_users))
+        for user in new_users:
+            await out.put(user)
+
+    def report(self):
+        """Отчёт о покрытии: сколько участников найдено относительно числа в канале"""
+        found = len(self.ids)
+        return {
+            'channel_total': self.total,
+            'unique_users': found,
+            'coverage': round(min(1.0, found / self.total), 4) if self.total else None,
+            'shards': self.shards,
+            'split_shards': self.split_shards,
+            'truncated_shards': self.truncated_shards,
+            'requests': self.requests,
+        }
@@ -0,0 +1,206 @@
+import logging
+import sqlite3
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Сколько участников нового снимка копить перед записью в базу
+WRITE_BATCH_SIZE = 1000
+
+
+def profile_hash(user):
+    """Хэш полей профиля, видимых в списке участников: по нему ищутся изменения"""
+    key = '\x1f'.join((user.first_name or '', user.last_name or '', user.username or ''))
+    return zlib.crc32(key.encode('utf-8'))
+
+
+class SnapshotStore:
+    """Снимки состава каналов (SQLite): user_id, хэш профиля и имена участников.
+
+    Новый снимок пишется отдельным поколением по мере обхода канала и
+    становится текущим только после ``commit``, поэтому прерванный парсинг
+    не портит предыдущий снимок. Номер поколения резервируется атомарно,
+    так что одновременные запуски по одному каналу (в разных процессах)
+    пишут каждый своё поколение.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS snapshots ('
+            'channel_id INTEGER PRIMARY KEY, generation INTEGER NOT NULL, '
+            'members INTEGER NOT NULL, taken_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS snapshot_members ('
+            'channel_id INTEGER NOT NULL, generation INTEGER NOT NULL, user_id INTEGER NOT NULL, '
+            'profile_hash INTEGER NOT NULL, first_name TEXT, last_name TEXT, username TEXT, '
+            'PRIMARY KEY (channel_id, generation, user_id)) WITHOUT ROWID'
+        )
+        # Последний выданный номер поколения канала (включая незавершённые)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS snapshot_generations ('
+            'channel_id INTEGER PRIMARY KEY, last INTEGER NOT NULL)'
+        )
+        self._conn.commit()
+
+    def info(self, channel_id):
+        row = self._conn.execute(
+            'SELECT generation, members, taken_at FROM snapshots WHERE channel_id = ?', (channel_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'generation': row[0], 'members': row[1], 'taken_at': row[2]}
+
+    def load(self, channel_id):
+        """Текущий снимок канала: {user_id: profile_hash}; пустой, если снимка нет"""
+        info = self.info(channel_id)
+        if info is None:
+            return {}
+        return dict(self._conn.execute(
+            'SELECT user_id, profile_hash FROM snapshot_members WHERE channel_id = ? AND generation = ?',
+            (channel_id, info['generation'])
+        ))
+
+    def channels(self, limit=None):
+        """Каналы со снимками, начиная с самых свежих: [(channel_id, members, taken_at)]"""
+        query = 'SELECT channel_id, members, taken_at FROM snapshots ORDER BY taken_at DESC'
+        if limit is not None:
+            return self._conn.execute(query + ' LIMIT ?', (limit,)).fetchall()
+        return self._conn.execute(query).fetchall()
+
+    def user_ids(self, channel_id):
+        """user_id участников текущего снимка канала"""
+        info = self.info(channel_id)
+        if info is None:
+            return
+        for (user_id,) in self._conn.execute(
+            'SELECT user_id FROM snapshot_members WHERE channel_id = ? AND generation = ?',
+            (channel_id, info['generation'])
+        ):
+            yield user_id
+
+    def members(self, channel_id, user_ids):
+        """Имена участников текущего снимка (для строк о вышедших пользователях)"""
+        info = self.info(channel_id)
+        if info is None:
+            return
+        for user_id in user_ids:
+            row = self._conn.execute(
+                'SELECT first_name, last_name, username FROM snapshot_members '
+                'WHERE channel_id = ? AND generation = ? AND user_id = ?',
+                (channel_id, info['generation'], user_id)
+            ).fetchone()
+            if row is not None:
+                yield {'user_id': user_id, 'first_name': row[0] or '', 'last_name': row[1] or '',
+                       'username': row[2] or ''}
+
+    def writer(self, channel_id):
+        return SnapshotWriter(self, channel_id)
+
+    def reserve_generation(self, channel_id):
+        """Новый номер поколения, больше всех выданных и записанных ранее"""
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            reserved = self._conn.execute(
+                'SELECT last FROM snapshot_generations WHERE channel_id = ?', (channel_id,)
+            ).fetchone()
+            # Поколения, записанные до появления резервирования
+            written = self._conn.execute(
+                'SELECT MAX(generation) FROM snapshot_members WHERE channel_id = ?', (channel_id,)
+            ).fetchone()
+            info = self.info(channel_id)
+            generation = max(reserved[0] if reserved else 0, written[0] or 0,
+                             info['generation'] if info else 0) + 1
+            self._conn.execute(
+                'INSERT OR REPLACE INTO snapshot_generations (channel_id, last) VALUES (?, ?)',
+                (channel_id, generation)
+            )
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+        return generation
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии хранилища снимков: {str(e)}")
+
+
+class SnapshotWriter:
+    """Пишет новое поколение снимка пачками; ``commit`` делает его текущим.
+
+    Если за время записи другой запуск опубликовал более новое поколение,
+    ``commit`` отбрасывает это и возвращает False.
+    """
+
+    def __init__(self, store, channel_id):
+        self._conn = store._conn
+        self.channel_id = channel_id
+        self.generation = store.reserve_generation(channel_id)
+        self.members = 0
+        self._batch = []
+
+    def add(self, user):
+        self._batch.append((
+            self.channel_id, self.generation, user.id, profile_hash(user),
+            user.first_name or '', user.last_name or '', user.username or ''
+        ))
+        self.members += 1
+        if len(self._batch) >= WRITE_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._batch:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO snapshot_members '
+                '(channel_id, generation, user_id, profile_hash, first_name, last_name, username) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                self._batch
+            )
+            self._conn.commit()
+            self._batch = []
+
+    def commit(self):
+        self._flush()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = self._conn.execute(
+                'SELECT generation FROM snapshots WHERE channel_id = ?', (self.channel_id,)
+            ).fetchone()
+            if current is not None and current[0] > self.generation:
+                self._conn.execute(
+                    'DELETE FROM snapshot_members WHERE channel_id = ? AND generation = ?',
+                    (self.channel_id, self.generation)
+                )
+                self._conn.commit()
+                logger.warning(f"Снимок канала {self.channel_id} уже обновлён другим запуском, этот отброшен")
+                return False
+            self._conn.execute(
+                'INSERT OR REPLACE INTO snapshots (channel_id, generation, members, taken_at) VALUES (?, ?, ?, ?)',
+                (self.channel_id, self.generation, self.members, time.time())
+            )
+            # Прошлое поколение, а также брошенные и отставшие незавершённые записи
+            self._conn.execute(
+                'DELETE FROM snapshot_members WHERE channel_id = ? AND generation < ?',
+                (self.channel_id, self.generation)
+            )
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+        return True
+
+    def abort(self):
+        self._batch = []
+        self._conn.execute(
+            'DELETE FROM snapshot_members WHERE channel_id = ? AND generation = ?',
+            (self.channel_id, self.generation)
+        )
+        self._conn.commit()
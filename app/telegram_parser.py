@@ -1,62 +1,242 @@
 import asyncio
 from telethon import TelegramClient
-from telethon.tl.functions.users import GetFullUserRequest
-from telethon.tl.types import User, Channel
-from telethon.tl.functions.channels import JoinChannelRequest, LeaveChannelRequest
-from telethon.errors import SessionPasswordNeededError, ChannelPrivateError
-import pandas as pd
+from telethon.tl.functions.users import GetFullUserRequest, GetUsersRequest
+from telethon.tl.types import (
+    User, Channel, PeerChannel, PeerUser, InputUser, UserStatusOnline, UserStatusOffline, UserStatusRecently,
+    UserStatusLastWeek, UserStatusLastMonth
+)
+from telethon.tl.functions.channels import GetParticipantsRequest, GetFullChannelRequest
+from telethon.tl.functions.messages import (
+    CheckChatInviteRequest, ImportChatInviteRequest, GetHistoryRequest, GetMessageReactionsListRequest
+)
+from telethon.tl.types import ChannelParticipantsSearch
+from telethon.errors import (
+    SessionPasswordNeededError, ChannelPrivateError, FloodWaitError, InviteHashExpiredError, InviteHashInvalidError
+)
+from collections import deque, defaultdict
 from datetime import datetime
 import logging
 import os
-from dotenv import load_dotenv
 import tempfile
-import re
+import time
+import zlib
+from .config import get_settings, DEFAULT_ENRICH_CONCURRENCY, SESSIONS_DIR
+from .rate_limiter import AdaptiveRateLimiter
+from .profile_cache import ProfileCache
+from .entity_cache import EntityCache, normalize_link, cache_key, USERNAME_RES
+from .membership import MembershipManager, ACCESS_LOST_ERRORS
+from .client_pool import ACCOUNT_ERRORS
+from .exporters import COLUMNS, PROFILE_COLUMNS, get_exporter_class
+from .snapshots import SnapshotStore, profile_hash
+from .checkpoints import Checkpoint
+from .filters import ParticipantFilter
+from .member_store import MemberStore
+from .sharding import ShardedEnumeration, DEFAULT_SHARD_CONCURRENCY, SHARD_SATURATION
+from .history import HistoryScan, AUDIENCE_SOURCES, DEFAULT_HISTORY_CONCURRENCY, HISTORY_PAGE_SIZE
+from .metrics import span, STAGE_SECONDS, STAGE_FAILURES, USERS
 
-# Load environment variables
-load_dotenv()
-
-# Telegram API credentials
-API_ID = os.getenv('API_ID')
-API_HASH = os.getenv('API_HASH')
-
-# Validate API credentials
-if not API_ID or not API_HASH:
-    raise ValueError("API_ID and API_HASH must be set in environment variables")
-
-try:
-    API_ID = int(API_ID)
-except ValueError:
-    raise ValueError("API_ID must be a number")
+# Максимальный размер страницы GetParticipantsRequest
+PARTICIPANTS_PAGE_SIZE = 200
+# Сколько каналов пакетного запроса обходится одновременно
+DEFAULT_CHANNEL_CONCURRENCY = int(os.getenv('BATCH_CHANNEL_CONCURRENCY', '4'))
+# Колонка со списком каналов-источников в пакетном режиме
+SOURCE_CHANNELS_COLUMN = 'source_channels'
+# Сколько новых пользователей пакетного режима может ждать обогащения
+BATCH_QUEUE_SIZE = 1000
+# Колонка с типом изменения (joined / changed / left) в дельта-выгрузке
+CHANGE_COLUMN = 'change'
+# Максимальный размер страницы GetMessageReactionsListRequest
+REACTIONS_PAGE_SIZE = 100
+# Сколько пользователей запрашивать одним GetUsersRequest (максимум API)
+USERS_BATCH_SIZE = 200
+# Почему в сводке аналитики нет пересечений со снимками других каналов
+OVERLAP_UNAVAILABLE = ("нет снимков других каналов: снимки сохраняет только инкрементальный режим "
+                       "(incremental=true), пересечения считаются с ними")
+# Статус «был в сети» в выгрузке обновлённых профилей
+USER_STATUSES = {
+    UserStatusOnline: 'online',
+    UserStatusOffline: 'offline',
+    UserStatusRecently: 'recently',
+    UserStatusLastWeek: 'last_week',
+    UserStatusLastMonth: 'last_month',
+}
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+async def _aiterate(items):
+    for item in items:
+        yield item
+
+
+def profile_fields(user):
+    """Поля профиля, которые приходят вместе с пользователем без GetFullUserRequest"""
+    return {
+        'user_id': user.id,
+        'access_hash': user.access_hash,
+        'first_name': user.first_name or '',
+        'last_name': user.last_name or '',
+        'username': user.username or '',
+        'status': USER_STATUSES.get(type(user.status), ''),
+        'premium': bool(user.premium),
+        'bot': bool(user.bot),
+        'deleted': bool(user.deleted),
+    }
+
+
+def create_client(session_file, api_id, api_hash):
+    """Фабрика клиента по умолчанию: настоящий TelegramClient"""
+    client = TelegramClient(session_file, api_id, api_hash)
+    # FloodWait обрабатывает rate_limiter, а не встроенный сон Telethon
+    client.flood_sleep_threshold = 0
+    return client
+
+
 class TelegramParser:
-    def __init__(self, parse_bio=False, parse_username=False, auto_join=True):
-        self.api_id = API_ID
-        self.api_hash = API_HASH
-        self.client = None
+    """Парсер участников каналов.
+
+    От клиента (транспорта) парсеру нужны только ``connect()``, ``disconnect()``,
+    ``is_connected()``, ``is_user_authorized()``, ``get_entity(link)`` и вызов
+    ``client(request)`` для запросов Telethon. Поэтому вместо TelegramClient
+    можно передать готовый ``client`` или ``client_factory`` с сигнатурой
+    ``(session_file, api_id, api_hash)`` — например, FakeTelegramClient
+    из tests.fake_client для офлайн-тестов и бенчмарков.
+
+    ``accounts`` — несколько сессий ClientPool (первая — основная). Страницы
+    участников и шарды распределяются между аккаунтами, а bio каждого
+    пользователя запрашивает аккаунт, который его увидел: access_hash
+    действителен только для него. Аккаунт с долгим FloodWait или блокировкой
+    выбывает, и его работа переходит к остальным.
+    """
+
+    def __init__(self, parse_bio=False, parse_username=False, auto_join=True,
+                 enrich_concurrency=DEFAULT_ENRICH_CONCURRENCY, rate_limiter=None,
+                 profile_cache=None, use_profile_cache=True, client=None, on_progress=None,
+                 output_format='xlsx', incremental=False, snapshot_store=None, use_checkpoints=True,
+                 client_factory=create_client, participant_filter=None, sharded=False,
+                 shard_concurrency=DEFAULT_SHARD_CONCURRENCY, entity_cache=None, use_entity_cache=True,
+                 session_name='user_session', membership=None, accounts=None, output_dir=None,
+                 source='participants', history_limit=None, history_concurrency=DEFAULT_HISTORY_CONCURRENCY,
+                 analytics=False, analytics_keywords=()):
+        # Несколько аккаунтов: клиент, ограничитель и реестр членства берутся у основного
+        self.accounts = list(accounts or [])
+        if self.accounts:
+            primary = self.accounts[0]
+            client = client or primary.client
+            rate_limiter = rate_limiter or primary.rate_limiter
+            membership = membership or primary.membership
+            session_name = primary.name
+        self._channel_routes = {}
+        self._seen_by = {}
+        # Внешний клиент (например, из ClientPool) парсер не отключает
+        self.client = client
+        self._owns_client = client is None
+        self.client_factory = client_factory
+        # Имя сессии: файл сессии и ключ кэша сущностей (access_hash свой у каждого аккаунта)
+        self.session_name = session_name
         self.parse_bio = parse_bio
         self.parse_username = parse_username
         self.auto_join = auto_join
-        # Используем постоянную директорию для сессии
-        self.session_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sessions')
+        self.enrich_concurrency = max(1, int(enrich_concurrency))
+        self.output_format = output_format
+        self.exporter_class = get_exporter_class(output_format)
+        # Отбор участников: серверная часть уходит в GetParticipantsRequest, клиентская — до обогащения
+        if not isinstance(participant_filter, ParticipantFilter):
+            participant_filter = ParticipantFilter.from_dict(participant_filter)
+        self.participant_filter = participant_filter
+        if incremental and participant_filter.active:
+            # Снимок отфильтрованного подмножества посчитал бы остальных вышедшими
+            raise ValueError("Инкрементальный режим несовместим с фильтром участников")
+        # Шардированный обход: поиск по префиксам имени вместо одного списка,
+        # который Telegram обрезает примерно на 10 тысячах участников
+        self.sharded = sharded
+        self.shard_concurrency = shard_concurrency
+        self.shard_saturation = SHARD_SATURATION
+        self.coverage = {}
+        if sharded and (participant_filter.search or participant_filter.participant_type != 'all'):
+            raise ValueError("Шардированный обход несовместим с серверным фильтром (search, type)")
+        if sharded and incremental:
+            # Шард, обрезанный на насыщении, теряет участников, а снимок записал бы их вышедшими
+            raise ValueError("Инкрементальный режим несовместим с шардированным обходом")
+        # Аудитория из истории сообщений: для каналов, где список участников видят только админы
+        if source not in AUDIENCE_SOURCES:
+            raise ValueError(f"Неизвестный источник аудитории {source}, доступны: {', '.join(AUDIENCE_SOURCES)}")
+        if source == 'messages' and (sharded or participant_filter.search
+                                     or participant_filter.participant_type != 'all'):
+            raise ValueError("Аудитория из сообщений несовместима с шардированным обходом и серверным фильтром")
+        if source == 'messages' and incremental:
+            # Снимок по сообщениям посчитал бы вышедшими всех, кто давно не писал
+            raise ValueError("Инкрементальный режим несовместим с аудиторией из сообщений")
+        self.source = source
+        self.history_limit = history_limit
+        self.history_concurrency = history_concurrency
+        # Общий ограничитель скорости для всех запросов к API
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        # Используем постоянную директорию для сессии (переменная SESSIONS_DIR)
+        self.session_dir = SESSIONS_DIR
         os.makedirs(self.session_dir, exist_ok=True)
-        # Временная директория для файлов
-        self.temp_dir = tempfile.mkdtemp()
+        # Кэш профилей: bio запрашивается у API только при промахе или устаревшей записи
+        self._owns_profile_cache = use_profile_cache and profile_cache is None
+        if self._owns_profile_cache:
+            profile_cache = ProfileCache(os.path.join(self.session_dir, 'profile_cache.sqlite'))
+        self.profile_cache = profile_cache if use_profile_cache else None
+        # Кэш разрешения ссылок: повторные задачи не тратят ResolveUsername
+        self._owns_entity_cache = use_entity_cache and entity_cache is None
+        if self._owns_entity_cache:
+            entity_cache = EntityCache(os.path.join(self.session_dir, 'entities.sqlite'))
+        self.entity_cache = entity_cache if use_entity_cache else None
+        # Реестр членства аккаунта; без общего (из ClientPool) выход происходит сразу после задачи
+        self.membership = membership or MembershipManager(self._call, leave_delay=0)
+        # Инкрементальный режим: состав канала сравнивается с прошлым снимком
+        self.incremental = incremental
+        self._owns_snapshot_store = incremental and snapshot_store is None
+        if self._owns_snapshot_store:
+            snapshot_store = SnapshotStore(os.path.join(self.session_dir, 'snapshots.sqlite'))
+        self.snapshot_store = snapshot_store if incremental else None
+        # Аналитика аудитории: колонки копятся по мере обогащения, сводка — в результате
+        # и отдельным листом XLSX; пересечения считаются с каналами из снимков
+        self.analytics = None
+        if analytics:
+            try:
+                from .analytics import AudienceAnalytics
+            except ImportError:
+                raise ValueError("Для аналитики аудитории установите пакет numpy")
+            self.analytics = AudienceAnalytics(analytics_keywords, with_bio=parse_bio)
+        self._overlap_store = snapshot_store if analytics else None
+        self._changes = {}
+        self._left = []
+        self._baseline = False
+        # Долгий FloodWait на bio: без контрольной точки (пакет, обновление профилей)
+        # парсинг не прерывается — до конца ожидания пользователи остаются без bio
+        self._abort_on_flood = True
+        self._bio_flood_until = 0.0
+        self.not_enriched = 0
+        # Контрольные точки позволяют продолжить прерванный парсинг канала
+        self.use_checkpoints = use_checkpoints
+        self.checkpoint_dir = os.path.join(self.session_dir, 'checkpoints')
+        self._page_offsets = {}
+        # Директория для файлов: временная или заданная (общая для API и воркеров), которую не удаляем
+        self._owns_temp_dir = output_dir is None
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        self.temp_dir = output_dir or tempfile.mkdtemp()
+        # Прогресс текущего парсинга; on_progress вызывается при каждом изменении
+        self.progress = {'stage': 'pending', 'total': None, 'fetched': 0, 'enriched': 0}
+        self._channel_totals = {}
+        self.on_progress = on_progress
+
+    def _report_progress(self, **changes):
+        self.progress.update(changes)
+        if self.on_progress:
+            self.on_progress(self.progress)
         
     def _extract_channel_username(self, channel_link):
         """Извлекает юзернейм канала из разных форматов ссылок"""
-        # Паттерны для разных форматов
-        patterns = [
-            r'@(\w+)',  # @username
-            r't\.me/(\w+)',  # t.me/username или https://t.me/username
-            r'telegram\.me/(\w+)',  # telegram.me/username
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, channel_link)
+        # Паттерны скомпилированы один раз в entity_cache
+        for pattern in USERNAME_RES:
+            match = pattern.search(channel_link)
             if match:
                 return '@' + match.group(1)
                 
@@ -69,12 +249,18 @@ class TelegramParser:
     async def _connect(self):
         """Устанавливает соединение с Telegram"""
         if not self.client:
-            session_file = os.path.join(self.session_dir, 'user_session')
-            self.client = TelegramClient(session_file, self.api_id, self.api_hash)
-        
+            session_file = os.path.join(self.session_dir, self.session_name)
+            # Учётные данные нужны только для собственного клиента
+            settings = get_settings()
+            self.client = self.client_factory(session_file, settings.api_id, settings.api_hash)
+
         if not self.client.is_connected():
-            await self.client.connect()
-            
+            with span('connect'):
+                await self.client.connect()
+
+        if not self._owns_client:
+            return
+
         if not await self.client.is_user_authorized():
             logger.info("Требуется авторизация. Сессия будет сохранена для последующих запусков.")
             phone = input("Введите ваш номер телефона (в формате +7XXXXXXXXXX): ")
@@ -87,132 +273,941 @@ class TelegramParser:
                 await self.client.sign_in(password=password)
             logger.info("Авторизация успешна!")
         
-    async def join_channel(self, channel_entity):
-        """Автоматически вступает в канал если нужно"""
+    async def _call(self, request):
+        """Выполняет запрос к API через общий ограничитель скорости"""
+        return await self.rate_limiter.call(self.client, request)
+
+    async def _channel_call(self, channel, make_request, key=0):
+        """Запрос по каналу от одного из аккаунтов с доступом к нему.
+
+        ``make_request(entity)`` строит запрос для сущности канала этого
+        аккаунта, ``key`` выбирает аккаунт среди доступных. Если аккаунт
+        выбыл (долгий FloodWait, блокировка), запрос уходит следующему.
+        Возвращает пару (аккаунт или None, результат).
+        """
+        routes = self._channel_routes.get(channel.id)
+        if not routes:
+            try:
+                return None, await self._call(make_request(channel))
+            except ACCESS_LOST_ERRORS:
+                self.membership.forget(channel.id)
+                raise
+        error = None
+        while True:
+            available = [route for route in routes if route[0].available]
+            if not available:
+                raise error or ValueError("Нет доступных аккаунтов для запросов к каналу")
+            account, entity = available[key % len(available)]
+            try:
+                return account, await account.call(make_request(entity))
+            except ACCESS_LOST_ERRORS:
+                # Следующая задача на этом аккаунте проверит доступ и вступит заново
+                account.membership.forget(entity.id)
+                raise
+            except ACCOUNT_ERRORS as e:
+                if account.available:
+                    raise
+                error = e
+                logger.warning(f"Запросы к каналу переданы от сессии {account.name} другим аккаунтам")
+
+    def _remember_accounts(self, account, users):
+        """Запоминает, какой аккаунт увидел пользователей — его access_hash нужен для bio"""
+        if account is not None and self.parse_bio:
+            for user in users:
+                self._seen_by.setdefault(user.id, account)
+
+    def _store_users(self, account, users):
+        """Сохраняет в кэш профилей access_hash увиденных пользователей для пакетного обновления"""
+        if self.profile_cache:
+            session_name = account.name if account is not None else self.session_name
+            self.profile_cache.put_users(session_name, [profile_fields(user) for user in users])
+
+    async def _user_call(self, user):
+        """GetFullUserRequest от аккаунта, увидевшего пользователя.
+
+        Если этот аккаунт выбыл, пользователь находится другим аккаунтом по
+        юзернейму; без юзернейма его bio в этом запуске получить нельзя.
+        """
+        account = self._seen_by.pop(user.id, None)
+        if account is None:
+            return await self._call(GetFullUserRequest(user))
+        if account.available:
+            try:
+                return await account.call(GetFullUserRequest(user))
+            except ACCOUNT_ERRORS:
+                if account.available:
+                    raise
+        if not user.username:
+            raise ValueError(f"сессия {account.name} недоступна, а юзернейма у пользователя нет")
+        error = None
+        for other in self.accounts:
+            if other is account or not other.available:
+                continue
+            try:
+                return await other.call(GetFullUserRequest(user.username))
+            except ACCOUNT_ERRORS as e:
+                if other.available:
+                    raise
+                error = e
+        raise error or ValueError("нет доступных аккаунтов")
+
+    async def _iter_participants(self, channel, offset=0, skip=()):
+        """Постранично получает участников канала через ограничитель скорости.
+
+        ``offset`` — смещение первой страницы, ``skip`` — уже обработанные user_id.
+        Для каждого пользователя запоминается начало его страницы, чтобы
+        контрольная точка могла продолжить с неё.
+        """
+        seen = set(skip)
+        request_filter = self.participant_filter.request_filter()
+        while True:
+            page_offset = offset
+            # Страницы по очереди запрашивают разные аккаунты
+            with span('participants_page', channel=channel.id, offset=offset):
+                account, result = await self._channel_call(channel, lambda entity: GetParticipantsRequest(
+                    entity, request_filter, offset, PARTICIPANTS_PAGE_SIZE, hash=0
+                ), key=offset // PARTICIPANTS_PAGE_SIZE)
+            if not result.participants:
+                break
+            self._remember_accounts(account, result.users)
+            self._store_users(account, result.users)
+            offset += len(result.participants)
+            USERS.inc(len(result.users), stage='fetched')
+            self._channel_totals[channel.id] = result.count
+            self._report_progress(total=sum(self._channel_totals.values()),
+                                  fetched=self.progress['fetched'] + len(result.users))
+            for user in result.users:
+                if user.id not in seen:
+                    seen.add(user.id)
+                    if not self.participant_filter.matches(user):
+                        continue
+                    self._page_offsets[user.id] = page_offset
+                    yield user
+
+    def _iter_members(self, channel, offset=0, skip=()):
+        """Участники канала: одним списком, шардами по префиксам имени или из истории сообщений"""
+        if self.source == 'messages':
+            return self._iter_history(channel, skip)
+        if self.sharded:
+            return self._iter_sharded(channel, skip)
+        return self._iter_participants(channel, offset, skip)
+
+    async def _iter_sharded(self, channel, skip=()):
+        """Перебирает участников поисковыми запросами по префиксам (см. ShardedEnumeration).
+
+        Смещения страниц у шардов разные, поэтому контрольная точка
+        продолжает обход сначала, пропуская уже обработанных пользователей.
+        """
+        async def fetch_page(query, offset):
+            # Все страницы шарда запрашивает один аккаунт, шарды распределяются по аккаунтам
+            with span('participants_page', channel=channel.id, query=query, offset=offset):
+                account, result = await self._channel_call(channel, lambda entity: GetParticipantsRequest(
+                    entity, ChannelParticipantsSearch(query), offset, PARTICIPANTS_PAGE_SIZE, hash=0
+                ), key=zlib.crc32(query.encode('utf-8')))
+            self._remember_accounts(account, result.users)
+            self._store_users(account, result.users)
+            return result
+
+        def on_page(new_users):
+            USERS.inc(new_users, stage='fetched')
+            if enumeration.total is not None:
+                self._channel_totals[channel.id] = enumeration.total
+            self._report_progress(total=sum(self._channel_totals.values()) or None,
+                                  fetched=self.progress['fetched'] + new_users)
+
+        enumeration = ShardedEnumeration(fetch_page, saturation=self.shard_saturation,
+                                         concurrency=self.shard_concurrency, skip=skip, on_page=on_page)
         try:
-            # Проверяем, являемся ли мы участником
-            participants = await self.client.get_participants(channel_entity, limit=1)
-            logger.info("Уже являемся участником канала")
-            return True
-        except Exception:
-            if self.auto_join:
-                try:
-                    await self.client(JoinChannelRequest(channel_entity))
-                    logger.info("Успешно вступили в канал")
-                    return True
-                except Exception as e:
-                    logger.error(f"Не удалось вступить в канал: {str(e)}")
-                    return False
-            else:
-                logger.error("Нет доступа к каналу и автоматическое вступление отключено")
-                return False
-        
-    async def leave_channel(self, channel_entity):
-        """Выходит из канала"""
+            async for user in enumeration.users():
+                if self.participant_filter.matches(user):
+                    self._page_offsets[user.id] = 0
+                    yield user
+        finally:
+            self.coverage[channel.id] = enumeration.report()
+
+    async def _iter_history(self, channel, skip=()):
+        """Аудитория канала по истории сообщений (см. HistoryScan).
+
+        Источники: авторы сообщений самого канала (для групп и подписанных
+        постов), авторы пересланных сообщений, поставившие реакции (если
+        Telegram показывает их список) и комментаторы — авторы сообщений
+        связанной группы обсуждения. ``history_limit`` ограничивает обход
+        последними N id сообщений каждого чата.
+        """
+        # Списки реакций запрашиваются параллельно, но не больше history_concurrency сразу
+        reactions_limit = asyncio.Semaphore(self.history_concurrency)
+
+        async def reactors(message_id):
+            async with reactions_limit:
+                return await self._reactors(channel, message_id)
+
+        async def fetch_page(peer, offset_id, min_id, limit):
+            with span('history_page', channel=peer.id, offset_id=offset_id):
+                account, result = await self._history_call(channel, peer, offset_id, min_id, limit)
+            users = {user.id: user for user in result.users if isinstance(user, User)}
+            self._remember_accounts(account, users.values())
+            self._store_users(account, users.values())
+            with_reactions = [
+                message.id for message in result.messages
+                if peer is channel and getattr(message, 'reactions', None) is not None
+                and message.reactions.can_see_list
+            ]
+            reacted = dict(zip(with_reactions, await asyncio.gather(*map(reactors, with_reactions))))
+            authors = []
+            for message in result.messages:
+                for user_id, source in self._message_authors(message, comments=peer is not channel):
+                    if user_id in users:
+                        authors.append((users[user_id], source))
+                authors.extend((user, 'reactions') for user in reacted.get(message.id, ()))
+            return [message.id for message in result.messages], authors
+
+        def on_page(new_users):
+            USERS.inc(new_users, stage='fetched')
+            self._report_progress(fetched=self.progress['fetched'] + new_users)
+
+        group = await self._discussion_group(channel)
+        # Группа обсуждения занята с этого момента: освобождается при любом исходе обхода
         try:
-            await self.client(LeaveChannelRequest(channel_entity))
-            logger.info("Успешно вышли из канала")
-        except Exception as e:
-            logger.error(f"Ошибка при выходе из канала: {str(e)}")
-            
+            peers = [channel] if group is None else [channel, group]
+            ranges = []
+            for peer in peers:
+                _, result = await self._history_call(channel, peer, 0, 0, 1)
+                top_id = result.messages[0].id if result.messages else 0
+                min_id = max(0, top_id - self.history_limit) if self.history_limit else 0
+                ranges.append((peer, top_id, min_id))
+
+            scan = HistoryScan(fetch_page, ranges, concurrency=self.history_concurrency, skip=skip, on_page=on_page)
+            try:
+                async for user in scan.users():
+                    if self.participant_filter.matches(user):
+                        self._page_offsets[user.id] = 0
+                        yield user
+            finally:
+                self.coverage[channel.id] = {**scan.report(), 'discussion_group': group.id if group else None}
+        finally:
+            if group is not None:
+                await self.membership.release(group)
+
+    async def _history_call(self, channel, peer, offset_id, min_id, limit):
+        """Страница истории канала (от одного из его аккаунтов) или группы обсуждения (от основного)"""
+        def make_request(entity):
+            return GetHistoryRequest(entity, offset_id, None, 0, limit, 0, min_id, 0)
+
+        if peer is channel:
+            # Срезы по очереди читают разные аккаунты
+            return await self._channel_call(channel, make_request, key=offset_id // HISTORY_PAGE_SIZE)
+        try:
+            return None, await self._call(make_request(peer))
+        except ACCESS_LOST_ERRORS:
+            self.membership.forget(peer.id)
+            raise
+
+    async def _discussion_group(self, channel):
+        """Связанная с каналом группа обсуждения, если она есть и к ней есть доступ"""
+        if channel.megagroup:
+            return None
+        full = await self._call(GetFullChannelRequest(channel))
+        # Тип канала из кэша сущностей может быть неизвестен: берём его из ответа.
+        # У супергруппы linked_chat_id указывает на канал, а не на группу обсуждения
+        actual = next((chat for chat in full.chats if chat.id == channel.id), channel)
+        if actual.megagroup:
+            return None
+        linked_id = getattr(full.full_chat, 'linked_chat_id', None)
+        group = next((chat for chat in full.chats if chat.id == linked_id), None)
+        if group is None:
+            return None
+        if not await self.membership.acquire(group, self.auto_join):
+            logger.warning(f"Нет доступа к группе обсуждения канала {channel.id}, комментаторы не войдут в выгрузку")
+            return None
+        return group
+
+    @staticmethod
+    def _message_authors(message, comments=False):
+        """(user_id, источник) пользователей, которых выдаёт само сообщение"""
+        from_id = getattr(message, 'from_id', None)
+        if isinstance(from_id, PeerUser):
+            yield from_id.user_id, 'comments' if comments else 'authors'
+        fwd_from = getattr(message, 'fwd_from', None)
+        if fwd_from is not None and isinstance(fwd_from.from_id, PeerUser):
+            yield fwd_from.from_id.user_id, 'forwards'
+
+    async def _reactors(self, channel, message_id):
+        """Пользователи, поставившие реакции на сообщение канала"""
+        users, offset = [], None
+        while True:
+            account, result = await self._channel_call(channel, lambda entity: GetMessageReactionsListRequest(
+                entity, message_id, REACTIONS_PAGE_SIZE, offset=offset
+            ), key=message_id)
+            page = [user for user in result.users if isinstance(user, User)]
+            self._remember_accounts(account, page)
+            self._store_users(account, page)
+            users.extend(page)
+            offset = result.next_offset
+            if not offset:
+                return users
+
     async def get_user_bio(self, user):
+        # Профиль изменился с прошлого снимка: bio в кэше тоже могло устареть
+        if self.profile_cache and self._changes.get(user.id) != 'changed':
+            cached = self.profile_cache.get(user.id)
+            if cached is not None:
+                return cached['bio']
+        if self._bio_flood_until > time.monotonic():
+            self.not_enriched += 1
+            return ''
         try:
-            full_user = await self.client(GetFullUserRequest(user))
-            return full_user.full_user.about or ''
+            with span('bio'):
+                full_user = await self._user_call(user)
+            bio = full_user.full_user.about or ''
+            if self.profile_cache:
+                self.profile_cache.put(user.id, bio=bio, username=user.username,
+                                       first_name=user.first_name, last_name=user.last_name)
+            return bio
+        except FloodWaitError as e:
+            if self._abort_on_flood:
+                # Долгий FloodWait заденет и всех следующих пользователей: прерываем
+                # парсинг, чтобы продолжить его позже с контрольной точки
+                logger.warning(f"Bio for user {user.id} not fetched: FloodWait of {e.seconds}s, aborting")
+                raise
+            # Точки возобновления нет: остальные bio пропускаются до конца ожидания,
+            # а результат сообщает, сколько пользователей осталось без bio (retry_after)
+            self._bio_flood_until = max(self._bio_flood_until, time.monotonic() + e.seconds)
+            self.not_enriched += 1
+            logger.warning(f"Bio for user {user.id} not fetched: FloodWait of {e.seconds}s, skipping bios until it ends")
+            return ''
         except Exception as e:
             logger.debug(f"Failed to get bio for user {user.id}: {str(e)}")
             return ''
 
+    async def _process_user(self, user, semaphore):
+        """Собирает данные одного пользователя; ошибка не влияет на остальных"""
+        try:
+            bio = ''
+            if self.parse_bio:
+                async with semaphore:
+                    bio = await self.get_user_bio(user)
+            user_data = {
+                'user_id': user.id,
+                'first_name': user.first_name or '',
+                'last_name': user.last_name or '',
+                'username': user.username or '' if self.parse_username else '',
+                'bio': bio
+            }
+            if self.analytics is not None:
+                was_online = getattr(user.status, 'was_online', None)
+                self.analytics.add(user_data, profile_fields(user), was_online.timestamp() if was_online else None)
+            return user_data
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            STAGE_FAILURES.inc(stage='user')
+            logger.error(f"Error processing user {user.id}: {str(e)}")
+            return None
+
+    async def enrich_users(self, users):
+        """Обогащает пользователей по мере их поступления из ``users``.
+
+        Принимает обычный или асинхронный итератор и сам является асинхронным
+        генератором: не более enrich_concurrency запросов выполняются одновременно,
+        в памяти держится окно из 2 * enrich_concurrency пользователей,
+        порядок результатов совпадает с порядком входа.
+        """
+        if not hasattr(users, '__aiter__'):
+            users = _aiterate(users)
+        # У каждого аккаунта свой лимит, поэтому параллельность растёт с их числом
+        concurrency = self.enrich_concurrency * max(1, len(self.accounts))
+        semaphore = asyncio.Semaphore(concurrency)
+        window = concurrency * 2
+        pending = deque()
+        try:
+            async for user in users:
+                if not isinstance(user, User):
+                    continue
+                pending.append(asyncio.ensure_future(self._process_user(user, semaphore)))
+                if len(pending) >= window:
+                    user_data = await pending.popleft()
+                    if user_data is not None:
+                        USERS.inc(stage='enriched')
+                        yield user_data
+            while pending:
+                user_data = await pending.popleft()
+                if user_data is not None:
+                    USERS.inc(stage='enriched')
+                    yield user_data
+        finally:
+            for task in pending:
+                task.cancel()
+
     async def process_users_batch(self, users_batch):
-        results = []
-        for user in users_batch:
-            if not isinstance(user, User):
-                continue
+        """Обогащает пачку пользователей, не более enrich_concurrency запросов одновременно.
+
+        Результат — MemberStore в порядке пользователей во входной пачке.
+        """
+        store = MemberStore()
+        async for user_data in self.enrich_users(users_batch):
+            store.append(user_data)
+        return store
 
+    def export_filename(self, channel, channel_link):
+        """Имя выходного файла для канала в выбранном формате"""
+        channel_link = self._extract_channel_username(channel_link)
+        channel_name = str(channel.id) if channel_link.startswith('-100') else channel_link.replace('@', '').replace('/', '_')
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+        return f'participants_{channel_name}_{timestamp}.{self.exporter_class.extension}'
+
+    async def open_channel(self, channel_link):
+        """Подключается к Telegram, находит канал и при необходимости вступает в него"""
+        await self._connect()
+
+        logger.info(f"Обрабатываем канал: {channel_link}")
+        channel = await self.resolve_channel(channel_link)
+
+        if not isinstance(channel, Channel):
+            raise ValueError(f"{channel_link} не является каналом")
+
+        # Вступаем в канал, только если доступа ещё нет
+        if not await self.membership.acquire(channel, self.auto_join):
+            raise ValueError("Не удалось получить доступ к каналу")
+        if len(self.accounts) > 1:
+            await self._open_on_accounts(channel_link, channel)
+        return channel
+
+    async def _open_on_accounts(self, channel_link, channel):
+        """Находит канал и получает к нему доступ на дополнительных аккаунтах.
+
+        У каждого аккаунта своя сущность канала (свой access_hash); аккаунты,
+        которым канал недоступен, в запросах к нему не участвуют.
+        """
+        async def open_on(account):
+            if not account.available:
+                return None
             try:
-                user_data = {
-                    'user_id': user.id,
-                    'first_name': user.first_name or '',
-                    'last_name': user.last_name or '',
-                    'username': user.username or '' if self.parse_username else '',
-                    'bio': await self.get_user_bio(user) if self.parse_bio else ''
-                }
-                results.append(user_data)
+                entity = await self.resolve_channel(channel_link, account)
+                if entity.id == channel.id and await account.membership.acquire(entity, self.auto_join):
+                    return account, entity
             except Exception as e:
-                logger.error(f"Error processing user {user.id}: {str(e)}")
-                continue
-            
-        return results
+                logger.warning(f"Сессия {account.name} не получила доступ к каналу {channel_link}: {str(e)}")
+            return None
+
+        opened = await asyncio.gather(*(open_on(account) for account in self.accounts[1:]))
+        self._channel_routes[channel.id] = [(self.accounts[0], channel)] + [route for route in opened if route]
+
+    async def _release_channel(self, channel):
+        """Отпускает канал на всех аккаунтах, которые его открывали"""
+        for account, entity in self._channel_routes.pop(channel.id, [])[1:]:
+            await account.membership.release(entity)
+        if not self._channel_routes:
+            self._seen_by.clear()
+        await self.membership.release(channel)
+
+    async def resolve_channel(self, channel_link, account=None):
+        """Находит канал по ссылке, юзернейму, -100 id или ссылке-приглашению.
+
+        Сначала смотрит в кэш сущностей (он же при первом обращении загружает
+        каналы из файла сессии), к API идёт только при промахе. ``account`` —
+        дополнительный аккаунт, для которого нужна своя сущность канала.
+        """
+        session_name = account.name if account else self.session_name
+        client = account.client if account else self.client
+        rate_limiter = account.rate_limiter if account else self.rate_limiter
+        kind, value = normalize_link(channel_link)
+        key = cache_key(kind, value)
+        if self.entity_cache:
+            self.entity_cache.warm_from_session(
+                session_name, os.path.join(self.session_dir, f'{session_name}.session')
+            )
+            channel = self.entity_cache.get(session_name, key)
+            if channel is not None:
+                return channel
 
-    async def parse_channel(self, channel_link):
         try:
-            # Подключаемся к Telegram
-            await self._connect()
-            
-            # Обрабатываем ссылку на канал
-            channel_link = self._extract_channel_username(channel_link)
-            logger.info(f"Обрабатываем канал: {channel_link}")
+            with span('get_entity', channel=channel_link):
+                if kind == 'invite':
+                    channel = await self._resolve_invite(value, account.call if account else self._call)
+                else:
+                    query = PeerChannel(value) if kind == 'id' else value
+                    channel = await rate_limiter.call(client.get_entity, query)
+        except (ValueError, ChannelPrivateError, InviteHashExpiredError, InviteHashInvalidError) as e:
+            if isinstance(e, ChannelPrivateError):
+                message = f"Канал {channel_link} является приватным"
+            else:
+                message = f"Не удалось найти канал {channel_link}: {str(e)}"
+            if self.entity_cache:
+                self.entity_cache.put_error(session_name, key, message)
+            raise ValueError(message)
+        if channel is None:
+            # Не ошибка ссылки, а настройка задачи — в кэш не попадает
+            raise ValueError(f"Нет доступа к каналу {channel_link} по приглашению, а автоматическое вступление отключено")
 
-            # Получаем информацию о канале
-            try:
-                channel = await self.client.get_entity(channel_link)
-            except ValueError as e:
-                raise ValueError(f"Не удалось найти канал {channel_link}: {str(e)}")
-            except ChannelPrivateError:
-                raise ValueError(f"Канал {channel_link} является приватным")
-                
-            if not isinstance(channel, Channel):
-                raise ValueError(f"{channel_link} не является каналом")
+        if self.entity_cache and isinstance(channel, Channel):
+            self.entity_cache.put(session_name, channel, [key])
+        return channel
 
-            # Пробуем вступить в канал если нужно
-            if not await self.join_channel(channel):
-                raise ValueError("Не удалось получить доступ к каналу")
+    async def _resolve_invite(self, invite_hash, call):
+        """Канал по ссылке-приглашению; если мы не участник, вступает по ней (при auto_join, иначе None)"""
+        invite = await call(CheckChatInviteRequest(invite_hash))
+        # ChatInviteAlready / ChatInvitePeek содержат сам чат, ChatInvite — только описание
+        chat = getattr(invite, 'chat', None)
+        if chat is not None:
+            return chat
+        if not self.auto_join:
+            return None
+        with span('join', invite=invite_hash):
+            updates = await call(ImportChatInviteRequest(invite_hash))
+        return updates.chats[0]
 
+    async def iter_rows(self, channel):
+        """Конвейер участники -> обогащение: строки отдаются по мере готовности"""
+        self._report_progress(stage='parsing')
+        checkpoint = self._open_checkpoint(channel)
+        snapshot = None
+        # Блокировка контрольной точки взята: при любом выходе, включая закрытие
+        # генератора потребителем, точка должна быть закрыта
+        try:
+            done = set()
+            if checkpoint and checkpoint.exists:
+                logger.info(f"Продолжаем парсинг канала {channel.id} с контрольной точки (смещение {checkpoint.offset})")
+                for user_data in checkpoint.rows():
+                    done.add(user_data['user_id'])
+                    if self.analytics is not None:
+                        self.analytics.add(user_data)
+                    self._report_progress(enriched=self.progress['enriched'] + 1)
+                    yield user_data
+
+            users = self._iter_members(channel, offset=checkpoint.offset if checkpoint else 0, skip=done)
+            if self.snapshot_store:
+                previous = self.snapshot_store.load(channel.id)
+                self._baseline = not previous
+                snapshot = self.snapshot_store.writer(channel.id)
+                users = self._track_changes(users, previous, snapshot)
+            async for user_data in self.enrich_users(users):
+                page_offset = self._page_offsets.pop(user_data['user_id'], 0)
+                if checkpoint:
+                    checkpoint.add_row(user_data, page_offset)
+                self._report_progress(enriched=self.progress['enriched'] + 1)
+                yield user_data
+        except BaseException:
+            if snapshot:
+                snapshot.abort()
+            if checkpoint:
+                checkpoint.close()
+            raise
+        if checkpoint:
+            checkpoint.remove()
+        if snapshot:
+            # Оставшиеся в прошлом снимке пользователи вышли из канала;
+            # их имена читаются до того, как новый снимок заменит старый
+            self._left = list(self.snapshot_store.members(channel.id, previous))
+            snapshot.commit()
+
+    def _open_checkpoint(self, channel):
+        """Контрольная точка канала для текущих настроек парсинга.
+
+        В инкрементальном режиме не используется: новый снимок должен увидеть
+        всех участников, а не только оставшихся после точки возобновления.
+        """
+        if not self.use_checkpoints or self.incremental:
+            return None
+        name = f'{channel.id}_bio{int(bool(self.parse_bio))}_username{int(bool(self.parse_username))}'
+        if self.participant_filter.active:
+            name += f'_filter{self.participant_filter.key()}'
+        if self.sharded:
+            name += '_sharded'
+        if self.source == 'messages':
+            name += '_messages'
+        checkpoint = Checkpoint(os.path.join(self.checkpoint_dir, name))
+        if not checkpoint.acquire():
+            # Тот же канал с теми же настройками уже парсится: его точку не трогаем
+            logger.warning(f"Контрольная точка {name} занята другим парсингом, продолжаем без неё")
+            return None
+        return checkpoint
+
+    async def _track_changes(self, users, previous, snapshot):
+        """Сравнивает участников с прошлым снимком и пишет новый.
+
+        Встреченные пользователи удаляются из ``previous``, так что после обхода
+        в нём остаются только вышедшие. Обогащение проходят все, но bio
+        неизменившихся берётся из кэша профилей, поэтому запросы к API
+        тратятся только на новых, изменившихся и устаревших в кэше.
+        """
+        async for user in users:
+            snapshot.add(user)
+            old_hash = previous.pop(user.id, None)
+            if old_hash is None:
+                self._changes[user.id] = 'joined'
+            elif old_hash != profile_hash(user):
+                self._changes[user.id] = 'changed'
+            yield user
+
+    async def close_channel(self, channel):
+        """Отпускает канал (выход — если вступали сами и он больше не нужен) и освобождает клиента"""
+        try:
+            if channel is not None:
+                await self._release_channel(channel)
+        finally:
+            await self._release()
+
+    async def _release(self):
+        if self.profile_cache:
+            self.profile_cache.flush()
+        if self._owns_client and self.client and self.client.is_connected():
+            await self.client.disconnect()
+
+    async def parse_channel(self, channel_link):
+        channel = None
+        started = time.perf_counter()
+        try:
+            channel = await self.open_channel(channel_link)
+            filename = os.path.join(self.temp_dir, self.export_filename(channel, channel_link))
+
+            delta_filename = None
+            delta_file = None
+            delta_exporter = None
+            # Каждая стадия потребляет предыдущую по мере поступления данных;
+            # время записи копится отдельно, чтобы видеть вклад экспорта
+            export_time = 0.0
             try:
-                # Получаем список участников
-                users = []
-                async for user in self.client.iter_participants(channel):
-                    users.append(user)
-
-                all_results = []
-                batch_size = 50
-                for i in range(0, len(users), batch_size):
-                    batch = users[i:i + batch_size]
-                    results = await self.process_users_batch(batch)
-                    all_results.extend(results)
-                    await asyncio.sleep(2)  # Delay between batches
-
-                # Create DataFrame and save to Excel
-                df = pd.DataFrame(all_results)
-                channel_name = str(channel.id) if channel_link.startswith('-100') else channel_link.replace('@', '').replace('/', '_')
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-                filename = os.path.join(self.temp_dir, f'participants_{channel_name}_{timestamp}.xlsx')
-                df.to_excel(filename, index=False)
-                
-                # Выходим из канала если автоматически вступали
-                if self.auto_join:
-                    await self.leave_channel(channel)
-                
-                return {
-                    'success': True,
-                    'filename': filename,
-                    'total_users': len(all_results)
-                }
+                if self.incremental:
+                    base, extension = os.path.splitext(filename)
+                    delta_filename = f'{base}_delta{extension}'
+                    delta_file = open(delta_filename, 'wb')
+                    delta_exporter = self.exporter_class(delta_file, COLUMNS + [CHANGE_COLUMN])
+                with open(filename, 'wb') as f:
+                    exporter = self.exporter_class(f)
+                    async for user_data in self.iter_rows(channel):
+                        write_started = time.perf_counter()
+                        exporter.write_row(user_data)
+                        change = self._changes.get(user_data['user_id'])
+                        if delta_exporter and change:
+                            delta_exporter.write_row({**user_data, CHANGE_COLUMN: change})
+                        export_time += time.perf_counter() - write_started
+                    self._report_progress(stage='saving')
+                    analytics = self._audience_summary(exporter, exclude={channel.id})
+                    with span('export_close', format=self.output_format):
+                        exporter.close()
+                if delta_exporter:
+                    for user_data in self._left:
+                        delta_exporter.write_row({**user_data, 'bio': '', CHANGE_COLUMN: 'left'})
+                    delta_exporter.close()
+            finally:
+                if delta_file:
+                    delta_file.close()
+                STAGE_SECONDS.observe(export_time, stage='export')
 
-            except Exception as e:
-                # В случае ошибки тоже пытаемся выйти из канала
-                if self.auto_join:
-                    await self.leave_channel(channel)
-                raise e
+            self._report_progress(stage='done')
+            result = {
+                'success': True,
+                'filename': filename,
+                'format': self.output_format,
+                'total_users': exporter.rows,
+                'fetched_users': self.progress['fetched'],
+                'filter': self.participant_filter.to_dict() if self.participant_filter.active else None,
+                'coverage': self.coverage.get(channel.id),
+                'analytics': analytics,
+                'rate_limiter': self.rate_limiter.stats(),
+                'accounts': self.accounts_stats(),
+                'profile_cache': self.profile_cache.stats() if self.profile_cache else None
+            }
+            if self.incremental:
+                changes = list(self._changes.values())
+                result.update({
+                    'delta_filename': delta_filename,
+                    'baseline': self._baseline,
+                    'joined': changes.count('joined'),
+                    'changed': changes.count('changed'),
+                    'left': len(self._left),
+                })
+            return result
 
         except Exception as e:
+            STAGE_FAILURES.inc(stage='parse_channel')
             raise Exception(f"Ошибка при парсинге канала {channel_link}: {str(e)}")
         finally:
-            if self.client and self.client.is_connected():
-                await self.client.disconnect()
+            await self.close_channel(channel)
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='parse_channel')
             
+    async def parse_channels(self, channel_links, channel_concurrency=DEFAULT_CHANNEL_CONCURRENCY):
+        """Парсит несколько каналов на одном клиенте в один общий файл.
+
+        Каналы обходятся параллельно (не более channel_concurrency), пользователи
+        дедуплицируются по user_id: bio каждого запрашивается один раз, как только
+        он впервые встретился, а в колонке source_channels перечислены все каналы,
+        где он состоит. Ошибка одного канала не прерывает остальные.
+
+        Каналы пользователя хранятся битовой маской по порядку запроса, строки
+        до записи файла — в компактном MemberStore. Разные формы ссылки на один
+        канал (@name, t.me/name) обходятся один раз.
+        """
+        unique_links = {}
+        for channel_link in channel_links:
+            unique_links.setdefault(cache_key(*normalize_link(channel_link)), channel_link)
+        channel_links = list(unique_links.values())
+        labels = [self._extract_channel_username(channel_link) for channel_link in channel_links]
+        sources = {}
+        channel_sizes = {}
+        coverage = {}
+        failed = {}
+        opened = []
+        new_users = asyncio.Queue(maxsize=BATCH_QUEUE_SIZE)
+        semaphore = asyncio.Semaphore(max(1, channel_concurrency))
+
+        async def fetch(index, channel_link):
+            label = labels[index]
+            bit = 1 << index
+            async with semaphore:
+                try:
+                    channel = await self.open_channel(channel_link)
+                    opened.append(channel)
+                    count = 0
+                    async for user in self._iter_members(channel):
+                        count += 1
+                        mask = sources.get(user.id)
+                        if mask is None:
+                            sources[user.id] = bit
+                            await new_users.put(user)
+                        else:
+                            sources[user.id] = mask | bit
+                    channel_sizes[label] = count
+                    if channel.id in self.coverage:
+                        coverage[label] = self.coverage[channel.id]
+                except Exception as e:
+                    failed[label] = str(e)
+                    STAGE_FAILURES.inc(stage='channel')
+                    logger.error(f"Ошибка при парсинге канала {channel_link}: {str(e)}")
+
+        async def fetch_all():
+            # fetch не пробрасывает ошибок каналов, так что сюда доходит только отмена
+            await asyncio.gather(*(fetch(index, channel_link) for index, channel_link in enumerate(channel_links)))
+            await new_users.put(None)
+
+        async def users_from_queue():
+            while True:
+                user = await new_users.get()
+                if user is None:
+                    return
+                yield user
+
+        started = time.perf_counter()
+        self._abort_on_flood = False
+        try:
+            await self._connect()
+            self._report_progress(stage='parsing')
+            fetcher = asyncio.create_task(fetch_all())
+            try:
+                # Обогащение идёт параллельно с обходом каналов
+                rows = MemberStore()
+                async for user_data in self.enrich_users(users_from_queue()):
+                    rows.append(user_data)
+                    self._report_progress(enriched=len(rows))
+            finally:
+                if not fetcher.done():
+                    fetcher.cancel()
+                await asyncio.gather(fetcher, return_exceptions=True)
+
+            if not channel_sizes:
+                raise ValueError("Не удалось получить участников ни одного канала")
+
+            self._report_progress(stage='saving')
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+            filename = os.path.join(
+                self.temp_dir,
+                f'participants_batch_{len(channel_sizes)}_channels_{timestamp}.{self.exporter_class.extension}'
+            )
+            # Каналы-источники перечисляются в порядке запроса, а не завершения обхода
+            with span('export', format=self.output_format), open(filename, 'wb') as f:
+                exporter = self.exporter_class(f, COLUMNS + [SOURCE_CHANNELS_COLUMN])
+                for user_data in rows:
+                    mask = sources[user_data['user_id']]
+                    user_data[SOURCE_CHANNELS_COLUMN] = ', '.join(
+                        label for i, label in enumerate(labels) if mask >> i & 1
+                    )
+                    exporter.write_row(user_data)
+                analytics = self._audience_summary(
+                    exporter, exclude={channel.id for channel in opened}, batch=(sources, labels, channel_sizes)
+                )
+                exporter.close()
+
+            self._report_progress(stage='done')
+            return {
+                'success': True,
+                'filename': filename,
+                'format': self.output_format,
+                'total_users': exporter.rows,
+                'channels': channel_sizes,
+                'failed_channels': failed,
+                'total_memberships': sum(channel_sizes.values()),
+                'fetched_users': self.progress['fetched'],
+                'filter': self.participant_filter.to_dict() if self.participant_filter.active else None,
+                'coverage': coverage or None,
+                'analytics': analytics,
+                **self._flood_report(),
+                'rate_limiter': self.rate_limiter.stats(),
+                'accounts': self.accounts_stats(),
+                'profile_cache': self.profile_cache.stats() if self.profile_cache else None
+            }
+
+        except Exception as e:
+            STAGE_FAILURES.inc(stage='parse_channels')
+            raise Exception(f"Ошибка при пакетном парсинге: {str(e)}")
+        finally:
+            for channel in opened:
+                await self._release_channel(channel)
+            await self._release()
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='parse_channels')
+
+    async def refresh_profiles(self, user_ids):
+        """Обновляет профили известных пользователей без обхода каналов.
+
+        Имена, юзернейм, статус и флаги premium / bot / deleted приходят
+        пачками GetUsersRequest по USERS_BATCH_SIZE пользователей — один
+        запрос вместо сотни. GetFullUserRequest остаётся только для bio (при
+        parse_bio и лишь для тех, чьё bio в кэше устарело). access_hash берутся
+        из кэша профилей, поэтому без него обновление невозможно.
+        """
+        if not self.profile_cache:
+            raise ValueError("Для обновления профилей нужен кэш профилей")
+        started = time.perf_counter()
+        self._abort_on_flood = False
+        try:
+            await self._connect()
+            user_ids = list(dict.fromkeys(user_ids))
+            self._report_progress(stage='parsing', total=len(user_ids))
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+            filename = os.path.join(self.temp_dir, f'profiles_{timestamp}.{self.exporter_class.extension}')
+
+            fields = {}
+
+            async def refreshed():
+                async for user in self._iter_refreshed(user_ids):
+                    fields[user.id] = profile_fields(user)
+                    yield user
+
+            with open(filename, 'wb') as f:
+                exporter = self.exporter_class(f, COLUMNS + PROFILE_COLUMNS)
+                async for user_data in self.enrich_users(refreshed()):
+                    profile = fields.pop(user_data['user_id'])
+                    user_data.update((column, profile[column]) for column in PROFILE_COLUMNS)
+                    exporter.write_row(user_data)
+                    self._report_progress(enriched=self.progress['enriched'] + 1)
+                self._report_progress(stage='saving')
+                exporter.close()
+
+            self._report_progress(stage='done')
+            return {
+                'success': True,
+                'filename': filename,
+                'format': self.output_format,
+                'total_users': exporter.rows,
+                'requested_users': len(user_ids),
+                'unresolved_users': len(user_ids) - self.progress['fetched'],
+                **self._flood_report(),
+                'rate_limiter': self.rate_limiter.stats(),
+                'accounts': self.accounts_stats(),
+                'profile_cache': self.profile_cache.stats()
+            }
+
+        except Exception as e:
+            STAGE_FAILURES.inc(stage='refresh_profiles')
+            raise Exception(f"Ошибка при обновлении профилей: {str(e)}")
+        finally:
+            await self._release()
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='refresh_profiles')
+
+    def _flood_report(self):
+        """Сколько пользователей осталось без bio из-за FloodWait и через сколько секунд повторить"""
+        retry_after = self._bio_flood_until - time.monotonic()
+        return {'not_enriched': self.not_enriched, 'retry_after': round(retry_after) if retry_after > 0 else None}
+
+    async def _iter_refreshed(self, user_ids):
+        """Пользователи, заново полученные пачками GetUsersRequest.
+
+        access_hash действует только для сессии, которая его получила, поэтому
+        пачки собираются по сессиям. Пользователи, которых нет в кэше, которые
+        известны только сессиям вне этой задачи или которых не вернул API,
+        пропускаются.
+        """
+        refs = self.profile_cache.user_refs(user_ids)
+        accounts = {account.name: account for account in self.accounts} or {self.session_name: None}
+        by_session = defaultdict(list)
+        for user_id in user_ids:
+            session_name, access_hash = refs.get(user_id, (None, None))
+            if session_name in accounts:
+                by_session[session_name].append(InputUser(user_id, access_hash))
+
+        for session_name, input_users in by_session.items():
+            account = accounts[session_name]
+            call = account.call if account is not None else self._call
+            for start in range(0, len(input_users), USERS_BATCH_SIZE):
+                request = GetUsersRequest(input_users[start:start + USERS_BATCH_SIZE])
+                try:
+                    with span('users_batch', session=session_name):
+                        users = await call(request)
+                except ACCOUNT_ERRORS:
+                    if account is None or account.available:
+                        raise
+                    # Чужой access_hash другим аккаунтам не подходит
+                    logger.warning(f"Сессия {session_name} выбыла, профили её пользователей не обновлены")
+                    break
+                users = [user for user in users if isinstance(user, User)]
+                self._remember_accounts(account, users)
+                self._store_users(account, users)
+                USERS.inc(len(users), stage='fetched')
+                self._report_progress(fetched=self.progress['fetched'] + len(users))
+                for user in users:
+                    yield user
+
+    def _audience_summary(self, exporter, exclude=(), batch=None):
+        """Сводка аналитики аудитории (None, если аналитика выключена).
+
+        Пересечения считаются с последними снимками других каналов, кроме
+        ``exclude``. Снимки пишет только инкрементальный режим; если их нет,
+        в сводке overlap = None и причина в overlap_unavailable. ``batch`` — (маски каналов пользователей, метки каналов в
+        порядке битов, успешно обойдённые каналы) для матрицы пересечений
+        каналов пакетного запроса. Экспортёр с несколькими листами получает
+        сводку отдельным листом.
+        """
+        if self.analytics is None:
+            return None
+        from .analytics import OVERLAP_CHANNELS, overlap_by_masks, summary_rows
+
+        with span('analytics', users=len(self.analytics)):
+            snapshots = []
+            if self._overlap_store is not None:
+                snapshots = [
+                    (channel_id, self._overlap_store.user_ids(channel_id))
+                    for channel_id, _, _ in self._overlap_store.channels(OVERLAP_CHANNELS + len(exclude))
+                    if channel_id not in exclude
+                ][:OVERLAP_CHANNELS]
+            summary = self.analytics.summary(snapshots)
+            if not snapshots:
+                summary['overlap'] = None
+                summary['overlap_unavailable'] = OVERLAP_UNAVAILABLE
+            if batch is not None:
+                masks, labels, parsed = batch
+                summary['batch_overlap'] = overlap_by_masks(masks.values(), labels, parsed)
+        if exporter.multi_sheet:
+            exporter.add_sheet('analytics', ['metric', 'value'], summary_rows(summary))
+        return summary
+
+    def accounts_stats(self):
+        """Состояние и нагрузка аккаунтов задачи (None для одного аккаунта)"""
+        if len(self.accounts) < 2:
+            return None
+        return [
+            {'name': account.name, 'health': account.health(), 'requests': account.rate_limiter.requests}
+            for account in self.accounts
+        ]
+
     def cleanup(self):
         """Clean up temporary files"""
+        if self._owns_profile_cache:
+            self.profile_cache.close()
+        if self._owns_snapshot_store:
+            self.snapshot_store.close()
+        if self._owns_entity_cache:
+            self.entity_cache.close()
+        if not self._owns_temp_dir:
+            return
         try:
             import shutil
             shutil.rmtree(self.temp_dir)
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+from .client_pool import ClientPool, DEFAULT_SESSION_NAMES
+from .config import get_settings
+from .entity_cache import EntityCache
+from .job_store import JobStore, SESSIONS_DIR, HEARTBEAT_CANCEL, HEARTBEAT_LOST
+from .jobs import Job, DEFAULT_MAX_CONCURRENT_JOBS, EVENTS_INTERVAL
+from .profile_cache import ProfileCache
+from .result_cache import ResultCache, request_key
+from .snapshots import SnapshotStore
+from .telegram_parser import TelegramParser
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка файлов сессий недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Сессии воркера (через запятую); у каждого воркера должны быть свои
+WORKER_SESSIONS = [
+    name.strip() for name in os.getenv('WORKER_SESSIONS', '').split(',') if name.strip()
+] or DEFAULT_SESSION_NAMES
+# Как часто воркер проверяет очередь, когда в ней пусто (секунды)
+WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '1'))
+
+
+class JobRunner:
+    """Выполняет задачу парсинга на сессиях пула; общий код API-процесса и воркеров.
+
+    С включённым кэшем результатов (``result_cache``) свежий файл того же
+    запроса отдаётся без парсинга, а новый результат копируется в кэш.
+    """
+
+    def __init__(self, client_pool, profile_cache, entity_cache, snapshot_store, result_cache=None):
+        self.client_pool = client_pool
+        self.profile_cache = profile_cache
+        self.entity_cache = entity_cache
+        self.snapshot_store = snapshot_store
+        self.result_cache = result_cache
+
+    def create_parser(self, params, sessions, **kwargs):
+        """Парсер по параметрам запроса (ParseOptions.dict()) на выданных пулом сессиях.
+
+        Общий для задач и синхронных запросов API; ограничения параметров
+        (enrich_concurrency, accounts) уже применены в main.validate_options.
+        """
+        return TelegramParser(
+            parse_bio=params['parse_bio'],
+            parse_username=params['parse_username'],
+            enrich_concurrency=params['enrich_concurrency'],
+            profile_cache=self.profile_cache,
+            entity_cache=self.entity_cache,
+            accounts=sessions,
+            output_format=params['format'],
+            incremental=params['incremental'],
+            snapshot_store=self.snapshot_store,
+            participant_filter=params['filter'],
+            sharded=params['sharded'],
+            source=params.get('source', 'participants'),
+            history_limit=params.get('history_limit'),
+            analytics=params.get('analytics', False),
+            analytics_keywords=params.get('analytics_keywords', ()),
+            **kwargs
+        )
+
+    async def __call__(self, job):
+        key = None
+        if self.result_cache is not None and self.result_cache.enabled:
+            key = request_key(job.params)
+        if key is not None:
+            entry = self.result_cache.get(key)
+            if entry is not None:
+                return self._from_cache(job, entry)
+        async with self.client_pool.lease_many(job.params.get('accounts', 1)) as sessions:
+            parser = self.create_parser(job.params, sessions, on_progress=job.update_progress,
+                                        output_dir=job.output_dir)
+            job.cleanup = parser.cleanup
+            job.rate_limiter = parser.rate_limiter
+            if 'user_ids' in job.params:
+                return await parser.refresh_profiles(job.params['user_ids'])
+            if 'channel_links' in job.params:
+                result = await parser.parse_channels(job.params['channel_links'])
+            else:
+                result = await parser.parse_channel(job.params['channel_link'])
+        if key is not None:
+            # Кэш забирает копию: файл задачи живёт и удаляется по своим правилам
+            shutil.copyfile(result['filename'], result['filename'] + '.cache')
+            self.result_cache.put(key, result['filename'] + '.cache', os.path.basename(result['filename']),
+                                  {'total_users': result['total_users']})
+        return result
+
+    def _from_cache(self, job, entry):
+        """Результат задачи из кэша: копия файла в директории задачи"""
+        output_dir = job.output_dir
+        if output_dir is None:
+            output_dir = tempfile.mkdtemp()
+            job.cleanup = lambda: shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir, exist_ok=True)
+        filename = os.path.join(output_dir, entry.filename)
+        with entry.open() as source, open(filename, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        job.update_progress({'stage': 'done', 'total': entry.meta.get('total_users'),
+                             'enriched': entry.meta.get('total_users')})
+        return {'success': True, 'filename': filename, 'format': job.params['format'],
+                'total_users': entry.meta.get('total_users'), 'cached': True}
+
+
+class Worker:
+    """Воркер: забирает задачи из общего JobStore и выполняет их на своих сессиях.
+
+    Одновременно выполняется не более ``max_concurrent_jobs`` задач. Пока
+    задача работает, её прогресс раз в ``heartbeat_interval`` секунд пишется в
+    хранилище — это же служит признаком жизни воркера и проверкой отмены.
+    При остановке незавершённые задачи возвращаются в очередь и продолжаются
+    другим воркером с контрольной точки.
+    """
+
+    def __init__(self, store, runner, max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS,
+                 poll_interval=WORKER_POLL_INTERVAL, heartbeat_interval=EVENTS_INTERVAL, worker_id=None):
+        self.store = store
+        self.runner = runner
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self._running = {}
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    async def run(self):
+        logger.info(f"Воркер {self.worker_id} запущен, задач одновременно: {self.max_concurrent_jobs}")
+        try:
+            while not self._stopping.is_set():
+                self.store.requeue_stale()
+                while len(self._running) < self.max_concurrent_jobs:
+                    claimed = self.store.claim(self.worker_id)
+                    if claimed is None:
+                        break
+                    job_id, params = claimed
+                    task = asyncio.create_task(self._execute(job_id, params))
+                    self._running[job_id] = task
+                    task.add_done_callback(lambda _, job_id=job_id: self._finished(job_id))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            tasks = list(self._running.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"Воркер {self.worker_id} остановлен")
+
+    def _finished(self, job_id):
+        self._running.pop(job_id, None)
+        # Освободился слот: не ждём следующего опроса очереди
+        self._wakeup.set()
+
+    async def _execute(self, job_id, params):
+        job = Job(params)
+        job.id = job_id
+        job.output_dir = self.store.job_dir(job_id)
+        job.status = 'running'
+        job.started_at = time.time()
+        task = asyncio.create_task(self.runner(job))
+        cancel_requested = False
+        lost = False
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=self.heartbeat_interval)
+                state = self.store.heartbeat(job_id, self.worker_id, job.progress, job.event())
+                if state == HEARTBEAT_LOST:
+                    # Задачу вернули в очередь как зависшую: её может выполнять другой воркер
+                    # в той же директории, поэтому эта копия останавливается без записи итога
+                    logger.warning(f"Задача {job_id} больше не принадлежит воркеру {self.worker_id}, останавливаем")
+                    lost = True
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    break
+                if state == HEARTBEAT_CANCEL and not task.done():
+                    cancel_requested = True
+                    task.cancel()
+            if lost:
+                return
+            job.result = task.result()
+            job.status = 'done'
+        except asyncio.CancelledError:
+            if not cancel_requested:
+                # Остановка воркера: задача уходит другому воркеру
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                self.store.release(job_id, self.worker_id)
+                raise
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"Задача {job_id} завершилась с ошибкой: {str(e)}")
+        finally:
+            # Файлы результата остаются в общей директории, освобождаются только ресурсы парсера
+            if job.cleanup:
+                job.cleanup()
+        job.finished_at = time.time()
+        self.store.finish(job_id, self.worker_id, job.status, result=job.result, error=job.error,
+                          progress=job.progress, event=job.event())
+
+
+def lock_sessions(session_names, session_dir=SESSIONS_DIR):
+    """Захватывает файлы сессий, чтобы их не открыл другой воркер.
+
+    Возвращает имена захваченных сессий и открытые файлы блокировок
+    (их нужно держать открытыми до конца работы).
+    """
+    if fcntl is None:
+        return list(session_names), []
+    names, handles = [], []
+    for name in session_names:
+        handle = open(os.path.join(session_dir, f'{name}.lock'), 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            logger.warning(f"Сессия {name} уже используется другим воркером")
+            continue
+        names.append(name)
+        handles.append(handle)
+    return names, handles
+
+
+async def serve():
+    # Без учётных данных воркер не стартует, даже не захватив сессии
+    settings = get_settings()
+    os.makedirs(SESSIONS_DIR, exist_ok=True)
+    session_names, locks = lock_sessions(WORKER_SESSIONS)
+    if not session_names:
+        raise RuntimeError("Все сессии воркера заняты другими процессами")
+
+    store = JobStore()
+    profile_cache = ProfileCache(os.path.join(SESSIONS_DIR, 'profile_cache.sqlite'))
+    entity_cache = EntityCache(os.path.join(SESSIONS_DIR, 'entities.sqlite'))
+    snapshot_store = SnapshotStore(os.path.join(SESSIONS_DIR, 'snapshots.sqlite'))
+    # Кэш результатов общий с API-процессами (тот же каталог)
+    result_cache = ResultCache(os.path.join(SESSIONS_DIR, 'results_cache'))
+    client_pool = ClientPool(settings.api_id, settings.api_hash, SESSIONS_DIR, session_names=session_names)
+    worker = Worker(store, JobRunner(client_pool, profile_cache, entity_cache, snapshot_store, result_cache))
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, worker.stop)
+    await client_pool.start()
+    try:
+        await worker.run()
+    finally:
+        await client_pool.stop()
+        profile_cache.close()
+        entity_cache.close()
+        snapshot_store.close()
+        result_cache.close()
+        store.close()
+        for handle in locks:
+            handle.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
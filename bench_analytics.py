@@ -0,0 +1,47 @@
+import argparse
+import time
+
+from app.analytics import AudienceAnalytics, STATUS_CODES
+
+BIOS = [
+    'Крипто-трейдер, Москва',
+    'Привіт! Я дизайнер з Києва',
+    'UX designer, crypto enthusiast',
+    'مرحبا بالعالم',
+    '',
+    '🚀 to the moon',
+]
+STATUSES = ['', *STATUS_CODES]
+
+
+def make_rows(count, now):
+    for i in range(count):
+        row = {'user_id': 5000000000 + i, 'username': '', 'bio': f'{BIOS[i % len(BIOS)]} {i}'}
+        profile = {'status': STATUSES[i % len(STATUSES)], 'bot': i % 50 == 0, 'deleted': i % 97 == 0,
+                   'premium': i % 9 == 0, 'username': f'user_{i}' if i % 3 else ''}
+        yield row, profile, now - (i % 60) * 86400
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Бенчмарк аналитики аудитории')
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    arg_parser.add_argument('--keywords', nargs='*', default=['крипто', 'crypto', 'designer', 'дизайнер'])
+    args = arg_parser.parse_args()
+
+    print(f"{'строк':>9} {'накопление, с':>14} {'сводка, с':>10}")
+    for rows in args.rows:
+        now = time.time()
+        analytics = AudienceAnalytics(args.keywords)
+        started = time.perf_counter()
+        for row, profile, was_online in make_rows(rows, now):
+            analytics.add(row, profile, was_online)
+        added = time.perf_counter() - started
+        # Пересечение с «другим каналом» того же размера, половина участников общая
+        other = range(5000000000 + rows // 2, 5000000000 + rows * 3 // 2)
+        started = time.perf_counter()
+        analytics.summary([(1, other)])
+        print(f"{rows:>9} {added:>14.2f} {time.perf_counter() - started:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
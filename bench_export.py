@@ -0,0 +1,79 @@
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from app.exporters import COLUMNS, EXPORTERS
+
+# Старый путь: список словарей -> DataFrame -> to_excel
+PANDAS_BASELINE = 'pandas-xlsx'
+
+
+def make_rows(count):
+    for i in range(1, count + 1):
+        yield {
+            'user_id': 5000000000 + i,
+            'first_name': f'Имя{i}',
+            'last_name': f'Фамилия{i}',
+            'username': f'user_{i}',
+            'bio': f'Описание профиля пользователя номер {i}',
+        }
+
+
+def run_child(output_format, rows):
+    """Выполняется в отдельном процессе, чтобы пик RSS относился только к одному формату"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'out')
+        started = time.perf_counter()
+        if output_format == PANDAS_BASELINE:
+            import pandas as pd
+
+            pd.DataFrame(list(make_rows(rows)), columns=COLUMNS).to_excel(path + '.xlsx', index=False)
+            size = os.path.getsize(path + '.xlsx')
+        else:
+            with open(path, 'wb') as f:
+                exporter = EXPORTERS[output_format](f)
+                exporter.write_rows(make_rows(rows))
+                exporter.close()
+            size = os.path.getsize(path)
+        elapsed = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed:.3f} {peak_rss:.1f} {size}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Бенчмарк форматов экспорта')
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    arg_parser.add_argument('--formats', nargs='+', default=[*EXPORTERS, PANDAS_BASELINE])
+    arg_parser.add_argument('--pandas-max-rows', type=int, default=100000,
+                            help='старый путь через pandas слишком медленный на больших объёмах')
+    arg_parser.add_argument('--child', nargs=2, metavar=('FORMAT', 'ROWS'), help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]))
+        return
+
+    print(f"{'формат':<12} {'строк':>9} {'время, с':>9} {'пик RSS, МБ':>12} {'размер, МБ':>11}")
+    for rows in args.rows:
+        for output_format in args.formats:
+            if output_format == PANDAS_BASELINE and rows > args.pandas_max_rows:
+                continue
+            completed = subprocess.run(
+                [sys.executable, __file__, '--child', output_format, str(rows)],
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                error = completed.stderr.strip().splitlines()[-1]
+                print(f"{output_format:<12} {rows:>9} ошибка: {error}")
+                continue
+            elapsed, peak_rss, size = completed.stdout.split()
+            print(f"{output_format:<12} {rows:>9} {float(elapsed):>9.2f} {float(peak_rss):>12.1f} "
+                  f"{int(size) / 2**20:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
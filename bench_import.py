@@ -0,0 +1,67 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Тяжёлые пакеты, которых не должно быть при импорте API (холодный старт лямбды)
+HEAVY_PACKAGES = ('telethon', 'pandas', 'openpyxl', 'pyarrow')
+
+
+def import_times(module):
+    """Время импорта модуля в чистом процессе: {пакет: суммарное время, мкс}"""
+    env = dict(os.environ)
+    env.setdefault('API_ID', '1')
+    env.setdefault('API_HASH', 'bench')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Время импорта API при холодном старте')
+    arg_parser.add_argument('--module', default='app.main')
+    arg_parser.add_argument('--runs', type=int, default=3)
+    arg_parser.add_argument('--top', type=int, default=10)
+    arg_parser.add_argument('--budget-ms', type=float, default=None,
+                            help='завершиться с ошибкой, если импорт дольше')
+    args = arg_parser.parse_args()
+
+    # Лучший из нескольких запусков: первый прогревает файловый кэш ОС
+    runs = [import_times(args.module) for _ in range(max(1, args.runs))]
+    times = min(runs, key=lambda run: run.get(args.module, 0))
+    total_ms = times.get(args.module, 0) / 1000
+
+    print(f"import {args.module}: {total_ms:.1f} мс")
+    print(f"{'модуль':<40} {'мс':>8}")
+    top_level = {}
+    for name, cumulative in times.items():
+        package = name.split('.')[0]
+        if name == package:
+            top_level[package] = cumulative
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<40} {cumulative / 1000:>8.1f}")
+
+    failed = False
+    heavy = sorted({name.split('.')[0] for name in times} & set(HEAVY_PACKAGES))
+    if heavy:
+        print(f"загружены тяжёлые пакеты: {', '.join(heavy)}")
+        failed = True
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"превышен бюджет: {total_ms:.1f} > {args.budget_ms:.1f} мс")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
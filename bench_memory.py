@@ -0,0 +1,47 @@
+import argparse
+import gc
+import time
+import tracemalloc
+
+from app.member_store import MemberStore
+from bench_export import make_rows
+
+
+def measure(build, rows):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(make_rows(rows))
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, current, peak
+
+
+def build_dicts(rows):
+    # Прежний путь: список словарей до самой записи файла
+    return [dict(row) for row in rows]
+
+
+def build_store(rows):
+    store = MemberStore()
+    store.extend(rows)
+    return store
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Память на хранение обогащённых строк')
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    args = arg_parser.parse_args()
+
+    print(f"{'хранилище':<12} {'строк':>9} {'время, с':>9} {'занято, МБ':>11} {'пик, МБ':>9} {'байт/строку':>12}")
+    for rows in args.rows:
+        for name, build in (('list[dict]', build_dicts), ('MemberStore', build_store)):
+            elapsed, current, peak = measure(build, rows)
+            print(f"{name:<12} {rows:>9} {elapsed:>9.2f} {current / 2**20:>11.1f} {peak / 2**20:>9.1f} "
+                  f"{current / rows:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
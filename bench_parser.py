@@ -0,0 +1,154 @@
+import asyncio
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from array import array
+from collections import defaultdict
+
+os.environ.setdefault('API_ID', '1')
+os.environ.setdefault('API_HASH', 'bench')
+
+from tests.fake_client import FakeTelegramClient
+from app.telegram_parser import TelegramParser
+from app.rate_limiter import AdaptiveRateLimiter
+
+
+class TimedRateLimiter(AdaptiveRateLimiter):
+    """Ограничитель, который замеряет полное время каждого вызова API, включая ожидание в очереди"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = defaultdict(lambda: array('d'))
+
+    async def call(self, func, *args, **kwargs):
+        name = type(args[0]).__name__ if args else func.__name__
+        started = time.perf_counter()
+        try:
+            return await super().call(func, *args, **kwargs)
+        finally:
+            self.latencies[name].append(time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def make_parser(concurrency, client, **kwargs):
+    # Лимит скорости снят, чтобы измерять только сам конвейер
+    unlimited = TimedRateLimiter(rate=1e6, max_rate=1e6, burst=1e6)
+    return TelegramParser(auto_join=False, enrich_concurrency=concurrency, rate_limiter=unlimited,
+                          use_profile_cache=False, use_checkpoints=False, use_entity_cache=False, client=client, **kwargs)
+
+
+async def run(users, latency, concurrency):
+    client = FakeTelegramClient(latency=latency)
+    parser = make_parser(concurrency, client, parse_bio=True)
+    try:
+        started = time.perf_counter()
+        results = await parser.process_users_batch(users)
+        elapsed = time.perf_counter() - started
+    finally:
+        parser.cleanup()
+    assert [r['user_id'] for r in results] == [u.id for u in users]
+    return elapsed
+
+
+async def run_channel(members, args):
+    """Полный parse_channel на синтетическом канале: страницы участников, обогащение и запись файла"""
+    client = FakeTelegramClient(latency=args.latency, page_latency=args.page_latency, jitter=args.jitter,
+                                flood_every=args.flood_every, flood_seconds=args.flood_seconds)
+    client.add_channel('bench', members)
+    parser = make_parser(args.concurrency, client, parse_bio=not args.no_bio, output_format=args.format)
+    try:
+        started = time.perf_counter()
+        result = await parser.parse_channel('@bench')
+        elapsed = time.perf_counter() - started
+    finally:
+        parser.cleanup()
+    assert result['total_users'] == members
+    latencies = parser.rate_limiter.latencies
+    return {
+        'elapsed': elapsed,
+        'users_per_sec': members / elapsed,
+        'calls': {name: {'count': len(values), 'p50': percentile(values, 0.5), 'p99': percentile(values, 0.99)}
+                  for name, values in latencies.items()},
+        'flood_waits': result['rate_limiter']['flood_waits'],
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def bench_enrich(args):
+    users = [FakeTelegramClient().user(i) for i in range(1, args.users + 1)]
+    print(f"Пользователей: {args.users}, задержка ответа: {args.latency * 1000:.0f} мс")
+    baseline = None
+    for concurrency in args.concurrency:
+        elapsed = asyncio.run(run(users, args.latency, concurrency))
+        baseline = baseline or elapsed
+        print(f"concurrency={concurrency:<3} {elapsed:7.2f} c  "
+              f"{args.users / elapsed:8.1f} польз./с  ускорение x{baseline / elapsed:.1f}")
+
+
+def bench_channel(args):
+    print(f"задержка bio {args.latency * 1000:.0f} мс, страницы {args.page_latency * 1000:.0f} мс, "
+          f"concurrency={args.concurrency}, формат {args.format}")
+    print(f"{'участников':>10} {'время, с':>9} {'польз./с':>9} {'bio p50/p99, мс':>16} "
+          f"{'стр. p50/p99, мс':>17} {'FloodWait':>9} {'пик RSS, МБ':>12}")
+    for members in args.members:
+        # Каждый размер в отдельном процессе, чтобы пик RSS не накапливался
+        completed = subprocess.run(
+            [sys.executable, __file__, 'channel', '--child', str(members), *sys.argv[2:]],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()[-1]
+            print(f"{members:>10} ошибка: {error}")
+            continue
+        stats = json.loads(completed.stdout.splitlines()[-1])
+        bio = stats['calls'].get('GetFullUserRequest', {'p50': 0, 'p99': 0})
+        pages = stats['calls'].get('GetParticipantsRequest', {'p50': 0, 'p99': 0})
+        print(f"{members:>10} {stats['elapsed']:>9.2f} {stats['users_per_sec']:>9.0f} "
+              f"{bio['p50'] * 1000:>7.1f}/{bio['p99'] * 1000:<8.1f} "
+              f"{pages['p50'] * 1000:>8.1f}/{pages['p99'] * 1000:<8.1f} "
+              f"{stats['flood_waits']:>9} {stats['peak_rss']:>12.1f}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Бенчмарк парсера на офлайн-клиенте')
+    commands = arg_parser.add_subparsers(dest='command')
+
+    enrich = commands.add_parser('enrich', help='ускорение обогащения bio от параллельности')
+    enrich.add_argument('--users', type=int, default=500)
+    enrich.add_argument('--latency', type=float, default=0.02)
+    enrich.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+
+    channel = commands.add_parser('channel', help='весь parse_channel на каналах разного размера')
+    channel.add_argument('--members', type=int, nargs='+', default=[1000, 10000, 100000],
+                         help='размеры каналов, например 1000 10000 100000 1000000')
+    channel.add_argument('--latency', type=float, default=0.005, help='задержка GetFullUserRequest, с')
+    channel.add_argument('--page-latency', type=float, default=0.05, help='задержка страницы участников, с')
+    channel.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, с')
+    channel.add_argument('--concurrency', type=int, default=32)
+    channel.add_argument('--format', default='csv')
+    channel.add_argument('--no-bio', action='store_true', help='только обход участников, без bio')
+    channel.add_argument('--flood-every', type=int, default=0, help='FloodWait на каждый N-й запрос')
+    channel.add_argument('--flood-seconds', type=int, default=1)
+    channel.add_argument('--child', type=int, help=argparse.SUPPRESS)
+
+    args = arg_parser.parse_args()
+    if args.command == 'enrich':
+        bench_enrich(args)
+    elif args.command == 'channel' and args.child:
+        print(json.dumps(asyncio.run(run_channel(args.child, args))))
+    elif args.command == 'channel':
+        bench_channel(args)
+    else:
+        arg_parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+
+# Кэши, снимки и очередь задач, которые создают тесты, не должны попадать
+# в sessions/ репозитория: весь запуск тестов работает во временном каталоге.
+# Настройки читаются при импорте app, поэтому окружение задаётся до него
+SESSIONS_DIR = tempfile.mkdtemp(prefix='test-sessions-')
+os.environ['SESSIONS_DIR'] = SESSIONS_DIR
+os.environ.setdefault('API_ID', '1')
+os.environ.setdefault('API_HASH', 'test')
+
+import pytest
+
+from app.rate_limiter import AdaptiveRateLimiter
+from app.telegram_parser import TelegramParser
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(SESSIONS_DIR, ignore_errors=True)
+
+
+class FakeClock:
+    """Виртуальные часы для clock= и sleep=: время меняется только вручную или через sleep"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.now += delay
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def fake_parser():
+    """Фабрика парсеров для офлайн-тестов: без кэшей, контрольных точек и задержек.
+
+    ``fake_parser(client, **kwargs)`` — парсер поверх FakeTelegramClient;
+    аргументы ``kwargs`` заменяют умолчания. Переданные кэши
+    (``profile_cache``, ``entity_cache``) используются, свои не создаются.
+    Временные файлы созданных парсеров удаляются после теста.
+    """
+    parsers = []
+
+    def make(client=None, **kwargs):
+        options = dict(auto_join=False, use_profile_cache='profile_cache' in kwargs,
+                       use_entity_cache='entity_cache' in kwargs, use_checkpoints=False, output_format='csv',
+                       rate_limiter=AdaptiveRateLimiter(rate=1e6, max_rate=1e6))
+        options.update(kwargs)
+        parser = TelegramParser(client=client, **options)
+        parsers.append(parser)
+        return parser
+
+    yield make
+    for parser in parsers:
+        parser.cleanup()
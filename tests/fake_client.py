@@ -0,0 +1,328 @@
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+from telethon.errors import (
+    FloodWaitError, InviteHashInvalidError, ChannelPrivateError, UserDeactivatedBanError, UserIdInvalidError
+)
+from telethon.tl.functions.channels import (
+    GetParticipantsRequest, JoinChannelRequest, LeaveChannelRequest, GetFullChannelRequest
+)
+from telethon.tl.functions.messages import (
+    CheckChatInviteRequest, ImportChatInviteRequest, GetHistoryRequest, GetMessageReactionsListRequest
+)
+from telethon.tl.functions.users import GetFullUserRequest, GetUsersRequest
+from telethon.tl.types import (
+    User, UserEmpty, Channel, ChatPhotoEmpty, ChannelParticipant, ChannelParticipantsAdmins, ChannelParticipantsBots,
+    ChatInviteAlready, PeerChannel, PeerUser, Message, MessageFwdHeader, MessageReactions, MessagePeerReaction,
+    ReactionEmoji, ReactionCount
+)
+from telethon.tl.types.channels import ChannelParticipants
+
+
+class FakeChannel:
+    """Канал в памяти: ``members`` — range или список user_id (range не занимает память)"""
+
+    def __init__(self, channel_id, username, members, admins=(), invite_hash=None, requires_join=False,
+                 broadcast=False):
+        self.id = channel_id
+        self.username = username
+        self.members = members
+        self.admins = list(admins)
+        self.invite_hash = invite_hash
+        self.requires_join = requires_join
+        self.messages = {}
+        self.linked = None
+        self.entity = Channel(id=channel_id, title=username, photo=ChatPhotoEmpty(), date=None,
+                              megagroup=not broadcast, broadcast=broadcast, access_hash=channel_id,
+                              username=username)
+
+
+class FakeTelegramClient:
+    """Офлайн-замена TelegramClient для тестов и бенчмарков.
+
+    Реализует ту часть клиента, которой пользуется TelegramParser:
+    ``connect``/``disconnect``/``is_connected``/``is_user_authorized``,
+    ``get_entity`` (по юзернейму или PeerChannel) и вызов запросов
+    ``GetParticipantsRequest`` (постранично), ``GetFullUserRequest``, ``GetUsersRequest``,
+    ``JoinChannelRequest``, ``LeaveChannelRequest``, ``CheckChatInviteRequest``,
+    ``ImportChatInviteRequest``.
+    Фильтры участников (поиск по началу слов имени, админы, боты) применяются
+    «на сервере»; ``listing_limit`` обрезает выдачу, как Telegram на ~10 тысячах.
+    Канал с ``requires_join`` отдаёт участников только после вступления, а
+    ``get_entity`` отмечает членство в поле ``left``, как настоящий API.
+    История сообщений (``add_messages``) отдаётся через ``GetHistoryRequest``,
+    группа обсуждения (``link_discussion``) — через ``GetFullChannelRequest``,
+    поставившие реакции — через ``GetMessageReactionsListRequest``.
+    ``account`` имитирует отдельный аккаунт: access_hash синтетических
+    пользователей у разных аккаунтов разный, и GetFullUserRequest с чужим
+    access_hash отклоняется, как в Telegram (GetUsersRequest возвращает
+    для него UserEmpty); по юзернейму запрос проходит.
+    Задержки ответа настраиваются, FloodWait можно подмешивать периодически
+    (``flood_every``) или после заданного числа запросов (``inject_flood``).
+    Время обслуживания каждого запроса записывается в ``latencies``, наибольшее
+    число одновременно выполнявшихся запросов каждого типа — в ``peak_in_flight``.
+    """
+
+    def __init__(self, latency=0.0, page_latency=None, jitter=0.0, flood_every=0, flood_seconds=1,
+                 bio=None, seed=0, listing_limit=None, account=0):
+        self.latency = latency
+        self.page_latency = latency if page_latency is None else page_latency
+        self.jitter = jitter
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.bio = bio or (lambda user: f'bio {user.id}')
+        self.listing_limit = listing_limit
+        self.account = account
+        self.banned_after = None
+        self.channels = {}
+        self.joined = set()
+        self.calls = Counter()
+        self.latencies = defaultdict(list)
+        self.in_flight = Counter()
+        self.peak_in_flight = Counter()
+        self.bio_requests = []
+        self.connected = False
+        self._users = {}
+        self._floods = {}
+        self._searches = {}
+        self._random = random.Random(seed)
+
+    def add_channel(self, username, members, channel_id=None, admins=(), invite_hash=None, requires_join=False,
+                    broadcast=False):
+        """Добавляет канал; ``members`` — число участников, список user_id или объектов User"""
+        if isinstance(members, int):
+            members = range(1, members + 1)
+        elif members and isinstance(members[0], User):
+            for user in members:
+                self._users[user.id] = user
+            members = [user.id for user in members]
+        channel = FakeChannel(channel_id or len(self.channels) + 1, username, members, admins, invite_hash,
+                              requires_join, broadcast)
+        self.channels[username.lower()] = channel
+        return channel
+
+    def add_messages(self, username, messages):
+        """Добавляет сообщения: словари с ``id`` и необязательными ``author``, ``forward_from``
+        (user_id) и ``reactors`` (список user_id)"""
+        channel = self.channels[username.lower()]
+        for message in messages:
+            channel.messages[message['id']] = message
+
+    def link_discussion(self, username, group_username):
+        """Делает канал ``group_username`` группой обсуждения канала ``username``"""
+        self.channels[username.lower()].linked = self.channels[group_username.lower()]
+
+    def inject_flood(self, request_type, after, seconds):
+        """После ``after`` успешных запросов типа ``request_type`` все следующие получают FloodWait"""
+        self._floods[request_type] = (after, seconds)
+
+    def inject_ban(self, after):
+        """После ``after`` запросов аккаунт «блокируется»: все запросы получают UserDeactivatedBanError"""
+        self.banned_after = after
+
+    def user(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            user = User(id=user_id, first_name=f'user{user_id}', username=f'user{user_id}',
+                        access_hash=user_id + self.account * 10 ** 12)
+        return user
+
+    def _full_user(self, target):
+        if isinstance(target, str):
+            username = target.lstrip('@').lower()
+            user = next((user for user in self._users.values() if (user.username or '').lower() == username), None)
+            if user is None and username.startswith('user') and username[4:].isdigit():
+                user = self.user(int(username[4:]))
+            if user is None:
+                raise ValueError('No user has "%s" as username' % target)
+            return user
+        user_id = target.id if isinstance(target, User) else target.user_id
+        user = self.user(user_id)
+        if target.access_hash != user.access_hash:
+            raise UserIdInvalidError(request=None)
+        return user
+
+    def _user_or_empty(self, input_user):
+        try:
+            return self._full_user(input_user)
+        except UserIdInvalidError:
+            return UserEmpty(id=input_user.user_id)
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_entity(self, link):
+        self.calls['get_entity'] += 1
+        if isinstance(link, PeerChannel):
+            channel = self._channel(SimpleNamespace(id=link.channel_id))
+        else:
+            username = str(link).lstrip('@').lower()
+            if username not in self.channels:
+                raise ValueError('No user has "%s" as username' % link)
+            channel = self.channels[username]
+        channel.entity.left = channel.id not in self.joined
+        return channel.entity
+
+    def _invite(self, invite_hash):
+        for channel in self.channels.values():
+            if channel.invite_hash == invite_hash:
+                return channel
+        raise InviteHashInvalidError(request=None)
+
+    def _channel(self, entity):
+        for channel in self.channels.values():
+            if channel.id == entity.id:
+                return channel
+        raise ValueError(f'Unknown channel {entity.id}')
+
+    async def _sleep(self, latency):
+        if self.jitter:
+            latency += self._random.uniform(0, self.jitter)
+        await asyncio.sleep(latency)
+
+    def _check_flood(self, request):
+        self.calls['total'] += 1
+        if self.banned_after is not None and self.calls['total'] > self.banned_after:
+            raise UserDeactivatedBanError(request=request)
+        if self.flood_every and self.calls['total'] % self.flood_every == 0:
+            raise FloodWaitError(request=request, capture=self.flood_seconds)
+        flood = self._floods.get(type(request))
+        if flood and self.calls[type(request).__name__] >= flood[0]:
+            raise FloodWaitError(request=request, capture=flood[1])
+
+    async def __call__(self, request):
+        started = time.perf_counter()
+        name = type(request).__name__
+        self._check_flood(request)
+        self.in_flight[name] += 1
+        self.peak_in_flight[name] = max(self.peak_in_flight[name], self.in_flight[name])
+        try:
+            if isinstance(request, GetParticipantsRequest):
+                await self._sleep(self.page_latency)
+                return self._participants(request)
+            await self._sleep(self.latency)
+            if isinstance(request, GetFullUserRequest):
+                user = self._full_user(request.id)
+                self.bio_requests.append(user.id)
+                return SimpleNamespace(full_user=SimpleNamespace(about=self.bio(user)), users=[user])
+            if isinstance(request, GetHistoryRequest):
+                return self._history(request)
+            if isinstance(request, GetFullChannelRequest):
+                channel = self._channel(request.channel)
+                chats = [channel.entity] + ([channel.linked.entity] if channel.linked else [])
+                return SimpleNamespace(
+                    full_chat=SimpleNamespace(linked_chat_id=channel.linked.id if channel.linked else None),
+                    chats=chats, users=[]
+                )
+            if isinstance(request, GetMessageReactionsListRequest):
+                return self._reactions(request)
+            if isinstance(request, GetUsersRequest):
+                return [self._user_or_empty(input_user) for input_user in request.id]
+            if isinstance(request, JoinChannelRequest):
+                self.joined.add(request.channel.id)
+            elif isinstance(request, LeaveChannelRequest):
+                self.joined.discard(request.channel.id)
+            elif isinstance(request, CheckChatInviteRequest):
+                channel = self._invite(request.hash)
+                if channel.id in self.joined:
+                    return ChatInviteAlready(chat=channel.entity)
+                return SimpleNamespace(title=channel.username)
+            elif isinstance(request, ImportChatInviteRequest):
+                channel = self._invite(request.hash)
+                self.joined.add(channel.id)
+                return SimpleNamespace(chats=[channel.entity])
+            return None
+        finally:
+            self.in_flight[name] -= 1
+            self.calls[name] += 1
+            self.latencies[name].append(time.perf_counter() - started)
+
+    def _members(self, channel, participants_filter):
+        # В каналах-трансляциях список участников доступен только админам
+        if isinstance(participants_filter, ChannelParticipantsAdmins) or channel.entity.broadcast:
+            return channel.admins
+        if isinstance(participants_filter, ChannelParticipantsBots):
+            return [user_id for user_id in channel.members if self.user(user_id).bot]
+        query = (getattr(participants_filter, 'q', '') or '').lower()
+        if not query:
+            return channel.members
+        # Результат поиска запоминается, чтобы не сканировать канал на каждой странице
+        key = (channel.id, query)
+        if key not in self._searches:
+            self._searches[key] = [
+                user_id for user_id in channel.members
+                if any(word.startswith(query) for word in self._search_text(user_id).split())
+            ]
+        return self._searches[key]
+
+    def _search_text(self, user_id):
+        user = self.user(user_id)
+        return ' '.join((user.first_name or '', user.last_name or '', user.username or '')).lower()
+
+    def _message(self, channel, spec):
+        reactors = spec.get('reactors') or ()
+        return Message(
+            id=spec['id'], peer_id=PeerChannel(channel.id), date=None, message='',
+            from_id=PeerUser(spec['author']) if spec.get('author') else None,
+            fwd_from=MessageFwdHeader(date=None, from_id=PeerUser(spec['forward_from']))
+            if spec.get('forward_from') else None,
+            reactions=MessageReactions(results=[ReactionCount(reaction=ReactionEmoji('👍'), count=len(reactors))],
+                                       can_see_list=True) if reactors else None,
+        )
+
+    def _history(self, request):
+        channel = self._channel(request.peer)
+        ids = sorted((
+            message_id for message_id in channel.messages
+            if message_id > request.min_id and (not request.offset_id or message_id < request.offset_id)
+        ), reverse=True)[:request.limit]
+        messages = [self._message(channel, channel.messages[message_id]) for message_id in ids]
+        user_ids = {
+            user_id for message_id in ids for user_id in
+            (channel.messages[message_id].get('author'), channel.messages[message_id].get('forward_from'))
+            if user_id
+        }
+        return SimpleNamespace(messages=messages, users=[self.user(user_id) for user_id in sorted(user_ids)],
+                               chats=[channel.entity], count=len(channel.messages))
+
+    def _reactions(self, request):
+        channel = self._channel(request.peer)
+        reactors = channel.messages[request.id].get('reactors') or []
+        start = int(request.offset or 0)
+        page = reactors[start:start + request.limit]
+        end = start + len(page)
+        return SimpleNamespace(
+            count=len(reactors),
+            reactions=[MessagePeerReaction(peer_id=PeerUser(user_id), date=None, reaction=ReactionEmoji('👍'))
+                       for user_id in page],
+            users=[self.user(user_id) for user_id in page], chats=[],
+            next_offset=str(end) if end < len(reactors) else None,
+        )
+
+    def _participants(self, request):
+        channel = self._channel(request.channel)
+        if channel.requires_join and channel.id not in self.joined:
+            raise ChannelPrivateError(request=request)
+        members = self._members(channel, request.filter)
+        end = request.offset + request.limit
+        if self.listing_limit is not None:
+            end = min(end, self.listing_limit)
+        ids = members[request.offset:end]
+        return ChannelParticipants(
+            count=len(members),
+            participants=[ChannelParticipant(user_id=user_id, date=None) for user_id in ids],
+            chats=[],
+            users=[self.user(user_id) for user_id in ids],
+        )
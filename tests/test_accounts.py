@@ -0,0 +1,114 @@
+import asyncio
+import csv
+import random
+
+from telethon.tl.functions.users import GetFullUserRequest
+from telethon.tl.types import User
+from app.client_pool import ClientPool
+from tests.fake_client import FakeTelegramClient
+from app.rate_limiter import AdaptiveRateLimiter
+
+
+def make_clients(names, members=600):
+    clients = {}
+    for account, name in enumerate(names):
+        client = FakeTelegramClient(account=account)
+        client.add_channel('big', members(account) if callable(members) else members, channel_id=77)
+        clients[name] = client
+    return clients
+
+
+def named_users(account, count=500):
+    # Разные имена нужны, чтобы шарды дробились; access_hash у каждого аккаунта свой
+    names = random.Random(1)
+    return [User(id=i, first_name=''.join(names.choice('abcdefgh') for _ in range(4)),
+                 access_hash=i + account * 10 ** 12) for i in range(1, count + 1)]
+
+
+def make_pool(clients):
+    return ClientPool(1, 'test', '/tmp', session_names=list(clients), health_check_interval=0,
+                      client_factory=lambda name: clients[name],
+                      rate_limiter_factory=lambda: AdaptiveRateLimiter(rate=1e6, max_rate=1e6))
+
+
+def parse(fake_parser, pool, accounts, saturation=None, **kwargs):
+    async def run():
+        await pool.start()
+        try:
+            async with pool.lease_many(accounts) as sessions:
+                # Ограничитель у каждого аккаунта свой — из пула
+                parser = fake_parser(parse_bio=True, accounts=sessions, rate_limiter=None, **kwargs)
+                if saturation:
+                    parser.shard_saturation = saturation
+                result = await parser.parse_channel('@big')
+                with open(result['filename'], encoding='utf-8-sig') as f:
+                    rows = list(csv.DictReader(f))
+            return result, rows, {session.name: session.health() for session in pool.sessions}
+        finally:
+            await pool.stop()
+
+    return asyncio.run(run())
+
+
+def test_pages_and_bio_are_spread_across_accounts(fake_parser):
+    clients = make_clients(['a', 'b', 'c'])
+    result, rows, health = parse(fake_parser, make_pool(clients), 3)
+
+    assert len(rows) == 600
+    assert all(row['bio'] == f"bio {row['user_id']}" for row in rows)
+    # Каждый аккаунт получил свою долю страниц и bio, чужие access_hash не использовались
+    for client in clients.values():
+        assert client.calls['GetParticipantsRequest'] >= 1
+        assert len(client.bio_requests) >= 150
+    assert sum(len(client.bio_requests) for client in clients.values()) == 600
+    assert [account['name'] for account in result['accounts']] == ['a', 'b', 'c']
+
+
+def test_sharded_enumeration_uses_all_accounts(fake_parser):
+    clients = make_clients(['a', 'b'], members=named_users)
+    for client in clients.values():
+        client.listing_limit = 100
+    result, rows, health = parse(fake_parser, make_pool(clients), 2, saturation=100, sharded=True)
+
+    assert len(rows) == 500
+    assert all(row['bio'] == f"bio {row['user_id']}" for row in rows)
+    assert all(client.calls['GetParticipantsRequest'] > 1 for client in clients.values())
+
+
+def test_work_moves_off_account_with_long_flood_wait(fake_parser):
+    clients = make_clients(['a', 'b'])
+    clients['b'].inject_flood(GetFullUserRequest, after=20, seconds=3600)
+    result, rows, health = parse(fake_parser, make_pool(clients), 2)
+
+    assert len(rows) == 600
+    # Пользователи, увиденные выбывшим аккаунтом, найдены другим по юзернейму
+    assert all(row['bio'] for row in rows)
+    assert health['b'] == 'flood_wait'
+    # Запросы, уже отправленные до FloodWait, успевают завершиться
+    assert 20 <= len(clients['b'].bio_requests) < 300
+
+
+def test_banned_account_is_excluded(fake_parser):
+    clients = make_clients(['a', 'b'])
+    clients['b'].inject_ban(after=3)
+    result, rows, health = parse(fake_parser, make_pool(clients), 2)
+
+    assert len(rows) == 600
+    assert all(row['bio'] for row in rows)
+    assert health['b'] == 'banned'
+
+
+def test_lease_many_skips_unavailable_sessions():
+    clients = make_clients(['a', 'b', 'c'])
+    pool = make_pool(clients)
+
+    async def run():
+        await pool.start()
+        pool.sessions[1].banned = True
+        async with pool.lease_many(3) as sessions:
+            names = [session.name for session in sessions]
+        await pool.stop()
+        return names
+
+    assert sorted(asyncio.run(run())) == ['a', 'c']
+
@@ -0,0 +1,155 @@
+import asyncio
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from openpyxl import load_workbook
+from telethon.tl.types import User, UserStatusOffline, UserStatusOnline, UserStatusRecently
+
+from app.analytics import AudienceAnalytics, snapshot_overlap
+from tests.fake_client import FakeTelegramClient
+from app.snapshots import SnapshotStore
+
+NOW = 1700000000.0
+BIOS = {
+    0: 'Крипто-трейдер, Москва',
+    1: 'Привіт! Я дизайнер з Києва',
+    2: 'UX Designer, crypto enthusiast',
+    3: 'مرحبا بالعالم',
+    4: '你好，世界',
+    5: '🚀🚀🚀',
+    6: '',
+}
+
+
+def profile(status='', bot=False, deleted=False, premium=False, username='name'):
+    return {'status': status, 'bot': bot, 'deleted': deleted, 'premium': premium, 'username': username}
+
+
+def test_summary_of_columns():
+    analytics = AudienceAnalytics(['Крипто', 'crypto', ' designer '], clock=lambda: NOW)
+    for user_id, bio in BIOS.items():
+        analytics.add({'user_id': user_id, 'bio': bio}, profile(bot=user_id == 5, premium=user_id < 2))
+    analytics.add({'user_id': 10, 'bio': ''}, profile('online', deleted=True, username=''))
+    analytics.add({'user_id': 11, 'bio': ''}, profile('offline'), NOW - 3600)
+    analytics.add({'user_id': 12, 'bio': ''}, profile('offline'), NOW - 10 * 86400)
+    analytics.add({'user_id': 13, 'bio': ''}, profile('recently'))
+    # Строка с контрольной точки: профиль неизвестен
+    analytics.add({'user_id': 14, 'username': '', 'bio': 'крипто'})
+
+    summary = analytics.summary()
+    assert summary['users'] == 12 and summary['profiles'] == 11
+    assert summary['ratios'] == {'bot': round(1 / 11, 4), 'deleted': round(1 / 11, 4),
+                                 'premium': round(2 / 11, 4), 'no_username': round(2 / 12, 4)}
+    assert summary['activity'] == {'online': 1, 'day': 1, 'week': 0, 'month': 1, 'older': 0,
+                                   'recently': 1, 'last_week': 0, 'last_month': 0, 'hidden': 8}
+    bio = summary['bio']
+    assert bio['with_bio'] == 7
+    assert bio['languages'] == {'ru': 2, 'uk': 1, 'latin': 1, 'arabic': 1, 'cjk': 1, 'other': 1}
+    # Ключевые слова ищутся без учёта регистра и не захватывают соседние bio
+    assert bio['keywords'] == {'крипто': 2, 'crypto': 1, 'designer': 1}
+    assert bio['any_keyword'] == 3
+
+
+def test_overlap_with_snapshots(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    for channel_id, members in ((1, range(0, 100)), (2, range(50, 300))):
+        writer = store.writer(channel_id)
+        for user_id in members:
+            writer.add(User(id=user_id, first_name='x'))
+        writer.commit()
+
+    analytics = AudienceAnalytics(with_bio=False)
+    for user_id in range(80, 120):
+        analytics.add({'user_id': user_id}, profile())
+    summary = analytics.summary([(channel_id, store.user_ids(channel_id)) for channel_id in (1, 2)])
+    assert 'bio' not in summary
+    assert summary['overlap'] == {'1': {'members': 100, 'shared': 20, 'share': 0.5},
+                                  '2': {'members': 250, 'shared': 40, 'share': 1.0}}
+    assert snapshot_overlap(store) == {'1': {'1': 100, '2': 50}, '2': {'1': 50, '2': 250}}
+    store.close()
+
+
+def test_parse_channel_reports_analytics(tmp_path, fake_parser):
+    now = datetime.now(timezone.utc)
+    users = [
+        User(id=1, first_name='a', username='a', bot=True, access_hash=1),
+        User(id=2, first_name='b', deleted=True, access_hash=2, status=UserStatusRecently()),
+        User(id=3, first_name='c', username='c', access_hash=3, status=UserStatusOnline(expires=now)),
+        User(id=4, first_name='d', username='d', access_hash=4,
+             status=UserStatusOffline(was_online=now - timedelta(days=3))),
+    ]
+    client = FakeTelegramClient(bio=lambda user: 'Крипто и дизайн' if user.id % 2 else 'hello world')
+    client.add_channel('old', [3, 4, 5], channel_id=20)
+    client.add_channel('news', users, channel_id=10)
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    parser = fake_parser(client, incremental=True, snapshot_store=store)
+    asyncio.run(parser.parse_channel('@old'))
+
+    parser = fake_parser(client, parse_bio=True, analytics=True, analytics_keywords=['крипто'],
+                         snapshot_store=store, output_format='xlsx')
+    summary, sheet = asyncio.run(_parse_and_read(parser, '@news'))
+    assert summary['ratios']['bot'] == 0.25 and summary['ratios']['deleted'] == 0.25
+    assert summary['activity']['online'] == 1 and summary['activity']['week'] == 1
+    assert summary['bio']['languages']['ru'] == 2 and summary['bio']['keywords'] == {'крипто': 2}
+    assert summary['overlap'] == {'20': {'members': 3, 'shared': 2, 'share': 0.5}}
+    assert sheet['overlap.20.shared'] == 2 and sheet['ratios.bot'] == 0.25
+    # Без analytics снимок канала не читается и сводки нет
+    parser = fake_parser(client, snapshot_store=store)
+    assert asyncio.run(parser.parse_channel('@news'))['analytics'] is None
+    store.close()
+
+
+async def _parse_and_read(parser, channel_link):
+    result = await parser.parse_channel(channel_link)
+    workbook = load_workbook(result['filename'], read_only=True)
+    rows = list(workbook['analytics'].iter_rows(min_row=2, values_only=True))
+    workbook.close()
+    return result['analytics'], dict(rows)
+
+
+def test_batch_overlap_matrix(fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('a', list(range(1, 101)))
+    client.add_channel('b', list(range(51, 201)))
+    client.add_channel('c', list(range(181, 221)))
+    parser = fake_parser(client, analytics=True)
+    result = asyncio.run(parser.parse_channels(['@a', '@b', '@c', '@missing']))
+    summary = result['analytics']
+    assert summary['users'] == 220
+    # Снимков других каналов нет: пересечения со снимками не пустые, а явно недоступны
+    assert summary['overlap'] is None and 'incremental' in summary['overlap_unavailable']
+    assert summary['batch_overlap'] == {
+        '@a': {'@a': 100, '@b': 50, '@c': 0},
+        '@b': {'@a': 50, '@b': 150, '@c': 20},
+        '@c': {'@a': 0, '@b': 20, '@c': 40},
+    }
+
+
+def test_too_many_keywords_rejected():
+    with pytest.raises(ValueError):
+        AudienceAnalytics([f'word{i}' for i in range(51)])
+
+
+def test_sync_analytics_only_for_xlsx():
+    from fastapi.testclient import TestClient
+    from app import main
+
+    client = TestClient(main.app)
+    for path, body in (('/api/parse', {'channel_link': '@test'}),
+                       ('/api/parse/batch', {'channel_links': ['@a', '@b']})):
+        response = client.post(path, json={**body, 'format': 'csv', 'analytics': True})
+        assert response.status_code == 400, path
+
+
+def test_batch_overlap_with_repeated_channel(fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('a', list(range(1, 101)))
+    client.add_channel('b', list(range(51, 201)))
+    parser = fake_parser(client, analytics=True)
+    result = asyncio.run(parser.parse_channels(['@a', 'https://t.me/A', '@b']))
+    assert result['channels'] == {'@a': 100, '@b': 150}
+    assert result['analytics']['batch_overlap'] == {
+        '@a': {'@a': 100, '@b': 50},
+        '@b': {'@a': 50, '@b': 150},
+    }
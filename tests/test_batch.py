@@ -0,0 +1,49 @@
+import asyncio
+import csv
+
+from telethon.tl.functions.users import GetFullUserRequest
+
+from tests.fake_client import FakeTelegramClient
+from app.rate_limiter import AdaptiveRateLimiter
+
+
+def read_rows(path):
+    with open(path, encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def test_batch_deduplicates_users_across_channels(fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('first', range(1, 301))
+    client.add_channel('second', range(201, 401))
+    parser = fake_parser(client, parse_bio=True)
+    result = asyncio.run(parser.parse_channels(['@first', 'https://t.me/second', '@missing']))
+    rows = read_rows(result['filename'])
+
+    assert result['total_users'] == 400
+    assert result['channels'] == {'@first': 300, '@second': 200}
+    assert list(result['failed_channels']) == ['@missing']
+    assert sorted(client.bio_requests) == list(range(1, 401))
+    by_id = {int(row['user_id']): row for row in rows}
+    assert by_id[250]['source_channels'] == '@first, @second'
+    assert by_id[1]['source_channels'] == '@first'
+    assert by_id[400]['bio'] == 'bio 400'
+
+
+def test_long_flood_wait_leaves_rest_of_batch_without_bio(fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('first', range(1, 151))
+    client.add_channel('second', range(101, 301))
+    client.inject_flood(GetFullUserRequest, after=50, seconds=86400)
+    parser = fake_parser(client, parse_bio=True, enrich_concurrency=1,
+                         rate_limiter=AdaptiveRateLimiter(rate=1e6, max_rate=1e6, max_flood_wait=60))
+    result = asyncio.run(parser.parse_channels(['@first', '@second']))
+    rows = read_rows(result['filename'])
+
+    assert result['total_users'] == 300
+    assert result['channels'] == {'@first': 150, '@second': 200}
+    assert sum(1 for row in rows if row['bio']) == 50
+    assert result['not_enriched'] == 250
+    assert 86000 < result['retry_after'] <= 86400
+    # После FloodWait bio больше не запрашивались
+    assert client.calls['GetFullUserRequest'] == 50
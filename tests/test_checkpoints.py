@@ -0,0 +1,135 @@
+import asyncio
+import csv
+import os
+
+import pytest
+
+from telethon.tl.functions.users import GetFullUserRequest
+from app.checkpoints import Checkpoint
+from tests.fake_client import FakeTelegramClient
+from app.rate_limiter import AdaptiveRateLimiter
+from app import telegram_parser
+
+
+def make_client(fail_after=None):
+    client = FakeTelegramClient()
+    client.add_channel('big', 1000)
+    if fail_after is not None:
+        client.inject_flood(GetFullUserRequest, after=fail_after, seconds=86400)
+    return client
+
+
+def make_parser(fake_parser, tmp_path, client):
+    parser = fake_parser(client, parse_bio=True, use_checkpoints=True, enrich_concurrency=4,
+                         rate_limiter=AdaptiveRateLimiter(rate=1e6, max_rate=1e6, max_flood_wait=60))
+    parser.checkpoint_dir = str(tmp_path / 'checkpoints')
+    return parser
+
+
+def test_interrupted_parse_resumes_from_checkpoint(tmp_path, fake_parser):
+    parser = make_parser(fake_parser, tmp_path, make_client(fail_after=450))
+    with pytest.raises(Exception, match='wait of 86400 seconds'):
+        asyncio.run(parser.parse_channel('@big'))
+    assert os.listdir(tmp_path / 'checkpoints')
+
+    healthy = make_client()
+    parser = make_parser(fake_parser, tmp_path, healthy)
+    result = asyncio.run(parser.parse_channel('@big'))
+    with open(result['filename'], encoding='utf-8-sig') as f:
+        ids = [int(row['user_id']) for row in csv.DictReader(f)]
+
+    assert sorted(ids) == list(range(1, 1001))
+    assert len(healthy.bio_requests) < 1000 - 400
+    # Остаются только файлы блокировок
+    assert all(name.endswith('.lock') for name in os.listdir(tmp_path / 'checkpoints'))
+
+
+def test_checkpoint_skips_truncated_row(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'channel'), interval=1)
+    checkpoint.add_row({'user_id': 1}, 0)
+    checkpoint.add_row({'user_id': 2}, 200)
+    checkpoint.close()
+    with open(checkpoint.rows_path, 'a', encoding='utf-8') as f:
+        f.write('{"user_id": 3')
+
+    restored = Checkpoint(str(tmp_path / 'channel'))
+    assert [row['user_id'] for row in restored.rows()] == [1, 2]
+    assert restored.offset == 200
+
+
+def test_checkpoint_is_exclusive_and_dedups_rows(tmp_path):
+    first = Checkpoint(str(tmp_path / 'channel'), interval=1)
+    assert first.acquire()
+    first.add_row({'user_id': 1}, 0)
+    # Страница перечитана после сбоя: строка записана повторно
+    first.add_row({'user_id': 1}, 0)
+    first.add_row({'user_id': 2}, 200)
+
+    second = Checkpoint(str(tmp_path / 'channel'))
+    assert not second.acquire()
+    first.close()
+
+    assert second.acquire()
+    assert [row['user_id'] for row in second.rows()] == [1, 2]
+    second.remove()
+    assert Checkpoint(str(tmp_path / 'channel')).acquire()
+
+
+def test_stale_checkpoint_starts_over(tmp_path, clock):
+    checkpoint = Checkpoint(str(tmp_path / 'channel'), interval=1, clock=clock)
+    checkpoint.acquire()
+    checkpoint.add_row({'user_id': 1}, 200)
+    checkpoint.close()
+
+    clock.now += 3600
+    fresh = Checkpoint(str(tmp_path / 'channel'), clock=clock, max_age=3600)
+    assert fresh.acquire() and fresh.offset == 200
+    fresh.release()
+
+    clock.now += 1
+    stale = Checkpoint(str(tmp_path / 'channel'), clock=clock, max_age=3600)
+    assert stale.acquire()
+    assert not stale.exists and stale.offset == 0
+    stale.release()
+
+
+def test_concurrent_parses_do_not_share_checkpoint(tmp_path, fake_parser):
+    client = FakeTelegramClient(latency=0.001)
+    client.add_channel('big', 300)
+
+    async def run():
+        parsers = [make_parser(fake_parser, tmp_path, client) for _ in range(2)]
+        results = await asyncio.gather(*(parser.parse_channel('@big') for parser in parsers))
+        for result in results:
+            with open(result['filename'], encoding='utf-8-sig') as f:
+                assert sorted(int(row['user_id']) for row in csv.DictReader(f)) == list(range(1, 301))
+
+    asyncio.run(run())
+
+
+def test_checkpoint_released_when_consumer_stops_during_replay(tmp_path, monkeypatch, fake_parser):
+    closed = []
+
+    class RecordingCheckpoint(Checkpoint):
+        def close(self):
+            closed.append(self.directory)
+            super().close()
+
+    parser = make_parser(fake_parser, tmp_path, make_client(fail_after=450))
+    with pytest.raises(Exception, match='wait of 86400 seconds'):
+        asyncio.run(parser.parse_channel('@big'))
+    monkeypatch.setattr(telegram_parser, 'Checkpoint', RecordingCheckpoint)
+
+    async def run():
+        parser = make_parser(fake_parser, tmp_path, make_client())
+        channel = await parser.resolve_channel('@big')
+        rows = parser.iter_rows(channel)
+        await rows.__anext__()
+        await rows.aclose()
+        assert closed
+        # Следующий парсинг канала получает контрольную точку, а не работает без неё
+        checkpoint = parser._open_checkpoint(channel)
+        assert checkpoint is not None and checkpoint.exists
+        checkpoint.close()
+
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+import asyncio
+
+from app.client_pool import ClientPool
+
+
+class FakeClient:
+    def __init__(self, authorized=True):
+        self.authorized = authorized
+        self.connected = False
+        self.connects = 0
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        self.connects += 1
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def is_user_authorized(self):
+        return self.authorized
+
+
+def make_pool(clients, **kwargs):
+    return ClientPool(1, 'test', '/tmp', session_names=list(clients), health_check_interval=0,
+                      client_factory=lambda name: clients[name], **kwargs)
+
+
+def test_unauthorized_sessions_are_skipped():
+    clients = {'good': FakeClient(), 'bad': FakeClient(authorized=False)}
+    pool = make_pool(clients)
+
+    async def run():
+        await pool.start()
+        async with pool.lease() as session:
+            name = session.name
+        await pool.stop()
+        return name
+
+    assert asyncio.run(run()) == 'good'
+
+
+def test_leases_go_to_least_loaded_session():
+    clients = {'a': FakeClient(), 'b': FakeClient()}
+    pool = make_pool(clients, jobs_per_session=1)
+
+    async def run():
+        await pool.start()
+        async with pool.lease() as first:
+            async with pool.lease() as second:
+                names = {first.name, second.name}
+        await pool.stop()
+        return names
+
+    assert asyncio.run(run()) == {'a', 'b'}
+
+
+def test_dropped_connection_is_restored_on_lease():
+    clients = {'a': FakeClient()}
+    pool = make_pool(clients)
+
+    async def run():
+        await pool.start()
+        clients['a'].connected = False
+        async with pool.lease() as session:
+            connected = session.client.is_connected()
+            reconnects = session.reconnects
+        await pool.stop()
+        return connected, reconnects
+
+    assert asyncio.run(run()) == (True, 1)
+    assert clients['a'].connects == 2
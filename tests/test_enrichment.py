@@ -0,0 +1,77 @@
+import asyncio
+
+from tests.fake_client import FakeTelegramClient
+
+
+def enrich(fake_parser, client, user_ids, enrich_concurrency):
+    parser = fake_parser(client, parse_bio=True, enrich_concurrency=enrich_concurrency)
+
+    async def run():
+        await parser._connect()
+        return list(await parser.process_users_batch([client.user(user_id) for user_id in user_ids]))
+
+    return asyncio.run(run())
+
+
+def test_in_flight_requests_capped_by_enrich_concurrency(fake_parser):
+    client = FakeTelegramClient(latency=0.001, jitter=0.004)
+    rows = enrich(fake_parser, client, range(1, 201), enrich_concurrency=5)
+    assert len(rows) == 200
+    assert client.peak_in_flight['GetFullUserRequest'] == 5
+
+
+def test_output_keeps_input_order_with_varying_latency(fake_parser):
+    client = FakeTelegramClient(latency=0.0, jitter=0.01, seed=7)
+    user_ids = list(range(300, 0, -3))
+    rows = enrich(fake_parser, client, user_ids, enrich_concurrency=8)
+    assert [row['user_id'] for row in rows] == user_ids
+    assert all(row['bio'] == f"bio {row['user_id']}" for row in rows)
+
+
+def test_failed_user_gets_empty_bio_without_cancelling_batch(fake_parser):
+    def bio(user):
+        if user.id % 10 == 0:
+            raise ConnectionError('сбой')
+        return f'bio {user.id}'
+
+    client = FakeTelegramClient(latency=0.001, jitter=0.002, bio=bio)
+    rows = enrich(fake_parser, client, range(1, 101), enrich_concurrency=4)
+    assert [row['user_id'] for row in rows] == list(range(1, 101))
+    assert {row['user_id'] for row in rows if not row['bio']} == set(range(10, 101, 10))
+    assert client.calls['GetFullUserRequest'] == 100
+
+
+def test_rows_stream_while_participants_are_paged(fake_parser):
+    client = FakeTelegramClient(latency=0.001, page_latency=0.005)
+    client.add_channel('big', 2000)
+    parser = fake_parser(client, parse_bio=True, enrich_concurrency=4)
+    pulled = 0
+    iter_members = parser._iter_members
+
+    async def counted(*args, **kwargs):
+        nonlocal pulled
+        async for user in iter_members(*args, **kwargs):
+            pulled += 1
+            yield user
+
+    parser._iter_members = counted
+
+    async def run():
+        channel = await parser.open_channel('@big')
+        pages_before_first_row, rows, buffered = None, 0, 0
+        try:
+            async for _ in parser.iter_rows(channel):
+                if pages_before_first_row is None:
+                    pages_before_first_row = client.calls['GetParticipantsRequest']
+                rows += 1
+                buffered = max(buffered, pulled - rows)
+        finally:
+            await parser.close_channel(channel)
+        return pages_before_first_row, rows, buffered
+
+    pages_before_first_row, rows, buffered = asyncio.run(run())
+    assert rows == 2000
+    # Первая строка готова после проверки доступа и первой страницы, а не после всех 11 страниц
+    assert pages_before_first_row == 2
+    # В обогащении не больше окна из 2 * enrich_concurrency участников
+    assert buffered <= 2 * 4
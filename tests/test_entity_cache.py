@@ -0,0 +1,127 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.entity_cache import EntityCache, normalize_link
+from tests.fake_client import FakeTelegramClient
+
+
+def test_normalize_link():
+    assert normalize_link('@Durov') == ('username', 'durov')
+    assert normalize_link('https://t.me/Durov') == ('username', 'durov')
+    assert normalize_link('tg://resolve?domain=durov') == ('username', 'durov')
+    assert normalize_link('durov') == ('username', 'durov')
+    assert normalize_link('-1001234567') == ('id', 1234567)
+    assert normalize_link('https://t.me/+AbC-123') == ('invite', 'AbC-123')
+    assert normalize_link('t.me/joinchat/AbC') == ('invite', 'AbC')
+
+
+def test_repeated_parse_skips_resolve(tmp_path, fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('news', 20)
+    cache = EntityCache(str(tmp_path / 'entities.sqlite'))
+    try:
+        for link in ('@news', 'https://t.me/NEWS', '-1001'):
+            result = asyncio.run(fake_parser(client, entity_cache=cache).parse_channel(link))
+            assert result['total_users'] == 20
+    finally:
+        cache.close()
+
+    # Первая ссылка разрешается через API, остальные (другой регистр, id) — из кэша
+    assert client.calls['get_entity'] == 1
+    assert cache.stats()['hits'] == 2
+
+
+def test_failures_are_cached_for_negative_ttl(tmp_path, fake_parser, clock):
+    client = FakeTelegramClient()
+    cache = EntityCache(str(tmp_path / 'entities.sqlite'), negative_ttl=60, clock=clock)
+    parser = fake_parser(client, entity_cache=cache)
+    try:
+        for _ in range(2):
+            with pytest.raises(ValueError, match='Не удалось найти'):
+                asyncio.run(parser.resolve_channel('@missing'))
+        assert client.calls['get_entity'] == 1
+
+        clock.now += 61
+        client.add_channel('missing', 5)
+        channel = asyncio.run(parser.resolve_channel('@missing'))
+        assert channel.username == 'missing'
+        assert client.calls['get_entity'] == 2
+    finally:
+        cache.close()
+
+
+def test_warm_from_telethon_session(tmp_path):
+    session_file = tmp_path / 'acc.session'
+    conn = sqlite3.connect(str(session_file))
+    conn.execute('CREATE TABLE entities (id integer primary key, hash integer not null, username text, '
+                 'phone integer, name text, date integer)')
+    conn.executemany('INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?)', [
+        (-1000000000042, 777, 'Warm', None, 'Warm channel', 2000000000),
+        (5, 555, 'someuser', None, 'Some User', 2000000000),
+    ])
+    conn.commit()
+    conn.close()
+
+    cache = EntityCache(str(tmp_path / 'entities.sqlite'), clock=lambda: 2000000100)
+    try:
+        assert cache.warm_from_session('acc', str(session_file)) == 1
+        channel = cache.get('acc', 'username:warm')
+        assert (channel.id, channel.access_hash) == (42, 777)
+        assert cache.get('acc', 'id:42').title == 'Warm channel'
+        # access_hash принадлежит аккаунту: другая сессия его не видит
+        assert cache.get('other', 'username:warm') is None
+    finally:
+        cache.close()
+
+
+def test_invite_link_joins_when_allowed(tmp_path, fake_parser):
+    client = FakeTelegramClient()
+    channel = client.add_channel('secret', 10, invite_hash='XyZ')
+    cache = EntityCache(str(tmp_path / 'entities.sqlite'))
+    try:
+        parser = fake_parser(client, entity_cache=cache)
+        with pytest.raises(ValueError, match='автоматическое вступление'):
+            asyncio.run(parser.resolve_channel('https://t.me/+XyZ'))
+
+        parser = fake_parser(client, entity_cache=cache, auto_join=True)
+        resolved = asyncio.run(parser.resolve_channel('https://t.me/+XyZ'))
+    finally:
+        cache.close()
+    assert resolved.id == channel.id
+    assert channel.id in client.joined
+    assert client.calls['ImportChatInviteRequest'] == 1
+
+
+def test_channel_flags_survive_cache(tmp_path, fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('news', 20, broadcast=True)
+    client.joined.add(1)
+    cache = EntityCache(str(tmp_path / 'entities.sqlite'))
+    parser = fake_parser(client, entity_cache=cache)
+    try:
+        for _ in range(2):
+            channel = asyncio.run(parser.resolve_channel('@news'))
+            assert (channel.broadcast, channel.megagroup, channel.left) == (True, False, False)
+    finally:
+        cache.close()
+    assert client.calls['get_entity'] == 1
+
+
+def test_warmed_channel_flags_are_unknown(tmp_path):
+    session_file = tmp_path / 'acc.session'
+    conn = sqlite3.connect(str(session_file))
+    conn.execute('CREATE TABLE entities (id integer primary key, hash integer not null, username text, '
+                 'phone integer, name text, date integer)')
+    conn.execute('INSERT INTO entities VALUES (-1000000000042, 777, NULL, NULL, "Warm", 2000000000)')
+    conn.commit()
+    conn.close()
+
+    cache = EntityCache(str(tmp_path / 'entities.sqlite'), clock=lambda: 2000000100)
+    try:
+        cache.warm_from_session('acc', str(session_file))
+        channel = cache.get('acc', 'id:42')
+        assert (channel.megagroup, channel.broadcast, channel.left) == (None, None, None)
+    finally:
+        cache.close()
@@ -0,0 +1,76 @@
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+
+from app.exporters import COLUMNS, CsvExporter, NdjsonExporter, XlsxExporter, get_exporter_class, stream_rows
+
+ROWS = [
+    {'user_id': i, 'first_name': f'Имя {i}', 'last_name': '', 'username': f'user{i}', 'bio': 'line,with "quotes"'}
+    for i in range(1, 2001)
+]
+
+
+async def _aiterate(items):
+    for item in items:
+        yield item
+
+
+def export_to_bytes(exporter_class, rows):
+    buffer = io.BytesIO()
+    exporter = exporter_class(buffer)
+    exporter.write_rows(rows)
+    exporter.close()
+    return buffer.getvalue()
+
+
+def test_csv_round_trip():
+    data = export_to_bytes(CsvExporter, ROWS)
+    reader = csv.DictReader(io.StringIO(data.decode('utf-8-sig')))
+    assert reader.fieldnames == COLUMNS
+    parsed = list(reader)
+    assert len(parsed) == len(ROWS)
+    assert parsed[0]['bio'] == ROWS[0]['bio']
+    assert parsed[0]['first_name'] == 'Имя 1'
+
+
+def test_ndjson_round_trip():
+    data = export_to_bytes(NdjsonExporter, ROWS)
+    parsed = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+    assert parsed == ROWS
+
+
+@pytest.mark.parametrize('exporter_class', [CsvExporter, NdjsonExporter])
+def test_streamed_chunks_match_file_output(exporter_class):
+    async def collect():
+        return [chunk async for chunk in stream_rows(exporter_class, _aiterate(ROWS), chunk_size=4096)]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 1
+    assert b''.join(chunks) == export_to_bytes(exporter_class, ROWS)
+
+
+def test_xlsx_is_readable():
+    from openpyxl import load_workbook
+
+    data = export_to_bytes(XlsxExporter, ROWS[:10])
+    sheet = load_workbook(io.BytesIO(data), read_only=True).active
+    values = list(sheet.values)
+    assert list(values[0]) == COLUMNS
+    assert len(values) == 11
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        get_exporter_class('docx')
+
+
+def test_parquet_unavailable_without_pyarrow(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    monkeypatch.setattr(main, 'find_spec', lambda name: None)
+    response = TestClient(main.app).post('/api/jobs', json={'channel_link': '@test', 'format': 'parquet'})
+    assert response.status_code == 501
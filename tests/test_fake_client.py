@@ -0,0 +1,23 @@
+import asyncio
+import csv
+
+from tests.fake_client import FakeTelegramClient
+
+
+def test_parser_runs_end_to_end_on_fake_transport(fake_parser):
+    client = FakeTelegramClient(flood_every=100, flood_seconds=0)
+    client.add_channel('synthetic', 1000)
+    parser = fake_parser(parse_bio=True, parse_username=True, auto_join=True, client_factory=lambda *args: client)
+    result = asyncio.run(parser.parse_channel('https://t.me/synthetic'))
+    with open(result['filename'], encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))
+
+    assert [int(row['user_id']) for row in rows] == list(range(1, 1001))
+    assert rows[-1]['bio'] == 'bio 1000'
+    assert rows[-1]['username'] == 'user1000'
+    assert result['rate_limiter']['flood_waits'] > 0
+    assert client.calls['GetParticipantsRequest'] == 1 + 5 + 1
+    assert len(client.latencies['GetFullUserRequest']) == 1000
+    # Клиент создан фабрикой парсера, поэтому парсер сам вышел из канала и отключился
+    assert not client.joined
+    assert not client.connected
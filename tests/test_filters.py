@@ -0,0 +1,52 @@
+import asyncio
+import csv
+
+import pytest
+
+from telethon.tl.types import User
+from tests.fake_client import FakeTelegramClient
+from app.filters import ParticipantFilter
+
+
+def parse(fake_parser, client, participant_filter):
+    parser = fake_parser(client, parse_bio=True, participant_filter=participant_filter)
+    result = asyncio.run(parser.parse_channel('@crowd'))
+    with open(result['filename'], encoding='utf-8-sig') as f:
+        return result, [int(row['user_id']) for row in csv.DictReader(f)]
+
+
+def test_search_is_pushed_down_to_the_server(fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('crowd', 5000)
+    result, ids = parse(fake_parser, client, {'search': 'user12'})
+
+    expected = [i for i in range(1, 5001) if f'user{i}'.startswith('user12')]
+    assert ids == expected
+    assert result['fetched_users'] == len(expected)
+    # Страницы только с найденными участниками, bio только для них
+    assert client.calls['GetParticipantsRequest'] == 1 + 1 + 1
+    assert sorted(client.bio_requests) == expected
+
+
+def test_client_side_predicates_run_before_enrichment(fake_parser):
+    users = [User(id=i, first_name=f'user{i}', username=f'user{i}' if i % 2 else None,
+                  bot=(i % 10 == 0), access_hash=i) for i in range(1, 101)]
+    client = FakeTelegramClient()
+    client.add_channel('crowd', users, admins=[1, 2, 3])
+
+    result, ids = parse(fake_parser, client, {'has_username': True, 'exclude_bots': True, 'keywords': ['USER1', 'user2']})
+    assert ids == [i for i in range(1, 101) if i % 2 and (str(i).startswith('1') or str(i).startswith('2'))]
+    assert result['fetched_users'] == 100
+    assert sorted(client.bio_requests) == ids
+
+    result, ids = parse(fake_parser, client, {'type': 'admins'})
+    assert ids == [1, 2, 3]
+    assert result['filter']['type'] == 'admins'
+
+
+def test_filter_validation(fake_parser):
+    with pytest.raises(ValueError, match='Неизвестный тип'):
+        ParticipantFilter.from_dict({'type': 'moderators'})
+    assert not ParticipantFilter.from_dict(None).active
+    with pytest.raises(ValueError, match='Инкрементальный'):
+        fake_parser(incremental=True, participant_filter={'search': 'a'})
@@ -0,0 +1,116 @@
+import asyncio
+import csv
+
+import pytest
+from telethon.tl.functions.messages import GetHistoryRequest
+
+from tests.fake_client import FakeTelegramClient
+from app.history import HistoryScan, id_slices
+
+
+def make_client():
+    client = FakeTelegramClient()
+    client.add_channel('news', 1000, channel_id=10, admins=[1, 2], broadcast=True)
+    client.add_channel('news_chat', [], channel_id=11)
+    client.link_discussion('news', 'news_chat')
+    # Посты канала: каждый десятый переслан от пользователя, у каждого 25-го есть реакции
+    client.add_messages('news', [
+        {'id': i, 'forward_from': 1000 + i // 10 % 50 if i % 10 == 0 else None,
+         'reactors': [2000 + (i + j) % 300 for j in range(150)] if i % 25 == 0 else None}
+        for i in range(1, 1001)
+    ])
+    # Комментарии в группе обсуждения; авторы повторяются
+    client.add_messages('news_chat', [{'id': i, 'author': 3000 + i % 400} for i in range(1, 3001)])
+    return client
+
+
+def parse(fake_parser, client, **kwargs):
+    result = asyncio.run(fake_parser(client, **kwargs).parse_channel('@news'))
+    with open(result['filename'], encoding='utf-8-sig') as f:
+        return result, list(csv.DictReader(f))
+
+
+def test_id_slices_cover_range_without_overlap():
+    slices = list(id_slices(0, 10, 4))
+    assert slices == [(6, 11), (2, 7), (0, 3)]
+    covered = [i for low, high in slices for i in range(low + 1, high)]
+    assert sorted(covered) == list(range(1, 11))
+    assert list(id_slices(5, 5, 4)) == []
+
+
+def test_broadcast_audience_from_history(fake_parser):
+    client = make_client()
+    _, rows = parse(fake_parser, client)
+    # Список участников канала-трансляции отдаёт только админов
+    assert sorted(int(row['user_id']) for row in rows) == [1, 2]
+
+    client = make_client()
+    result, rows = parse(fake_parser, client, source='messages', parse_bio=True, history_concurrency=8)
+    ids = [int(row['user_id']) for row in rows]
+    assert len(ids) == len(set(ids))
+    assert set(ids) == set(range(1000, 1050)) | set(range(2000, 2300)) | set(range(3000, 3400))
+    assert all(row['bio'] == f"bio {row['user_id']}" for row in rows)
+    assert client.calls['GetParticipantsRequest'] <= 2
+
+    report = result['coverage']
+    assert report['discussion_group'] == 11
+    assert report['messages'] == 4000
+    assert report['sources'] == {'forwards': 50, 'reactions': 300, 'comments': 400}
+    # Каждый срез читается своими страницами, без лишних запросов на пустые хвосты
+    assert report['requests'] == client.calls['GetHistoryRequest'] - 2
+
+
+def test_history_limit_scans_only_recent_messages(fake_parser):
+    client = make_client()
+    result, rows = parse(fake_parser, client, source='messages', history_limit=100)
+    assert result['coverage']['messages'] == 200
+    assert {int(row['user_id']) for row in rows} >= {3000 + i % 400 for i in range(2901, 3001)}
+    assert max(int(row['user_id']) for row in rows) < 3400
+
+
+def test_scan_runs_slices_concurrently():
+    active, peak = 0, 0
+
+    async def fetch_page(peer, offset_id, min_id, limit):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        ids = list(range(offset_id - 1, max(min_id, offset_id - 1 - limit), -1))
+        return ids, []
+
+    async def run():
+        scan = HistoryScan(fetch_page, [('chat', 1000, 0)], slice_size=100, concurrency=5)
+        async for _ in scan.users():
+            pass
+        return scan.report()
+
+    report = asyncio.run(run())
+    assert report['slices'] == 10 and report['messages'] == 1000
+    assert peak == 5
+
+
+def test_messages_source_rejects_incompatible_options(fake_parser):
+    with pytest.raises(ValueError):
+        fake_parser(source='messages', sharded=True)
+    with pytest.raises(ValueError):
+        fake_parser(source='messages', incremental=True)
+    with pytest.raises(ValueError):
+        fake_parser(source='history')
+
+
+def test_discussion_group_released_when_history_probe_fails(fake_parser):
+    client = make_client()
+    client.inject_flood(GetHistoryRequest, after=0, seconds=100000)
+    parser = fake_parser(client, source='messages')
+    with pytest.raises(Exception):
+        asyncio.run(parser.parse_channel('@news'))
+    assert parser.membership.stats()['in_use'] == 0
+
+
+def test_reactions_fetched_concurrently(fake_parser):
+    client = make_client()
+    client.latency = 0.002
+    parse(fake_parser, client, source='messages', history_concurrency=4)
+    assert 1 < client.peak_in_flight['GetMessageReactionsListRequest'] <= 4
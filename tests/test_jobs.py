@@ -0,0 +1,207 @@
+import asyncio
+import os
+import time
+
+from fastapi.testclient import TestClient
+from app import main
+from app.jobs import JobManager, QueueFullError
+
+
+class FakeParser:
+    """Имитирует TelegramParser: отчитывается о прогрессе и пишет файл результата"""
+
+    def __init__(self, tmp_path, users=3, delay=0.01, fail=False):
+        self.tmp_path = tmp_path
+        self.users = users
+        self.delay = delay
+        self.fail = fail
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, job):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            for enriched in range(1, self.users + 1):
+                await asyncio.sleep(self.delay)
+                job.update_progress({'stage': 'parsing', 'total': self.users,
+                                     'fetched': self.users, 'enriched': enriched})
+            if self.fail:
+                raise ValueError('канал не найден')
+            filename = self.tmp_path / f'{job.id}.xlsx'
+            filename.write_bytes(b'result')
+            return {'success': True, 'filename': str(filename), 'format': 'xlsx', 'total_users': self.users}
+        finally:
+            self.running -= 1
+
+
+async def wait_finished(jobs):
+    while not all(job.finished for job in jobs):
+        await asyncio.sleep(0.005)
+
+
+def test_jobs_run_with_bounded_concurrency(tmp_path):
+    parser = FakeParser(tmp_path)
+
+    async def run():
+        manager = JobManager(parser, max_concurrent_jobs=2)
+        jobs = [manager.submit({'channel_link': f'@c{i}'}) for i in range(5)]
+        await wait_finished(jobs)
+        return jobs
+
+    jobs = asyncio.run(run())
+    assert [job.status for job in jobs] == ['done'] * 5
+    assert parser.max_running == 2
+    assert jobs[0].to_dict()['progress']['enriched'] == 3
+
+
+def test_failed_and_cancelled_jobs(tmp_path):
+    async def run():
+        manager = JobManager(FakeParser(tmp_path, fail=True))
+        failed = manager.submit({})
+        slow = JobManager(FakeParser(tmp_path, delay=10))
+        cancelled = slow.submit({})
+        await asyncio.sleep(0.01)
+        assert slow.cancel(cancelled.id)
+        await wait_finished([failed, cancelled])
+        return failed, cancelled
+
+    failed, cancelled = asyncio.run(run())
+    assert failed.status == 'failed'
+    assert failed.error == 'канал не найден'
+    assert cancelled.status == 'cancelled'
+
+
+def test_queue_is_bounded(tmp_path):
+    async def run():
+        manager = JobManager(FakeParser(tmp_path, delay=10), max_concurrent_jobs=1, max_queued_jobs=1)
+        manager.submit({})
+        await asyncio.sleep(0)
+        manager.submit({})
+        try:
+            manager.submit({})
+        except QueueFullError:
+            return True
+        finally:
+            await manager.shutdown()
+        return False
+
+    assert asyncio.run(run())
+
+
+def test_finished_jobs_expire_without_new_submissions(tmp_path):
+    async def run():
+        manager = JobManager(FakeParser(tmp_path), result_ttl=0, expire_interval=0.01)
+        manager.start()
+        job = manager.submit({'channel_link': '@test'})
+        await wait_finished([job])
+        filename = job.result['filename']
+        job.cleanup = lambda: os.remove(filename)
+        await asyncio.sleep(0.05)
+        expired = manager.get(job.id) is None and not os.path.exists(filename)
+        await manager.shutdown()
+        return expired, manager._expire_task
+
+    expired, task = asyncio.run(run())
+    assert expired
+    assert task is None
+
+
+def test_job_api_submit_poll_download(tmp_path, monkeypatch):
+    async def no_pool():
+        pass
+
+    monkeypatch.setattr(main.get_services().client_pool, 'start', no_pool)
+    monkeypatch.setattr(main.job_manager, 'runner', FakeParser(tmp_path))
+
+    with TestClient(main.app) as client:
+        response = client.post('/api/jobs', json={'channel_link': '@test'})
+        assert response.status_code == 202
+        job_id = response.json()['job_id']
+
+        for _ in range(200):
+            status = client.get(f'/api/jobs/{job_id}').json()
+            if status['status'] == 'done':
+                break
+            time.sleep(0.01)
+        assert status['status'] == 'done'
+        assert status['total_users'] == 3
+
+        result = client.get(f'/api/jobs/{job_id}/result')
+        assert result.status_code == 200
+        assert result.content == b'result'
+        assert client.get('/api/jobs/unknown').status_code == 404
+
+
+def test_watch_streams_progress_until_finished(tmp_path):
+    async def run():
+        manager = JobManager(FakeParser(tmp_path, users=20))
+        job = manager.submit({})
+        return [event async for event in job.watch(interval=0.02, heartbeat=1)]
+
+    events = asyncio.run(run())
+    assert events[-1]['status'] == 'done'
+    assert events[-1]['enriched'] == 20
+    enriched = [event['enriched'] for event in events]
+    assert enriched == sorted(enriched)
+    # События прорежены: их меньше, чем обновлений прогресса
+    assert len(events) < 20
+
+
+def test_job_events_endpoint(tmp_path, monkeypatch):
+    async def no_pool():
+        pass
+
+    monkeypatch.setattr(main.get_services().client_pool, 'start', no_pool)
+    monkeypatch.setattr(main.job_manager, 'runner', FakeParser(tmp_path))
+
+    with TestClient(main.app) as client:
+        job_id = client.post('/api/jobs', json={'channel_link': '@test'}).json()['job_id']
+        response = client.get(f'/api/jobs/{job_id}/events')
+
+    assert response.headers['content-type'].startswith('text/event-stream')
+    blocks = [block for block in response.text.split('\n\n') if block]
+    assert blocks[-1].startswith('event: done\ndata: ')
+    assert '"enriched": 3' in blocks[-1]
+
+
+def test_incremental_only_for_single_channel_jobs():
+    # Без startup: запрос отклоняется проверкой параметров, до пула клиентов
+    client = TestClient(main.app)
+    for path, body in (('/api/parse', {'channel_link': '@test'}),
+                       ('/api/parse/batch', {'channel_links': ['@a', '@b']}),
+                       ('/api/jobs/batch', {'channel_links': ['@a', '@b']})):
+        response = client.post(path, json={**body, 'incremental': True})
+        assert response.status_code == 400, path
+    response = client.post('/api/jobs', json={'channel_link': '@test', 'incremental': True, 'sharded': True})
+    assert response.status_code == 400
+
+
+def test_request_resources_are_clamped():
+    request = main.ParseRequest(channel_link='@test', enrich_concurrency=1000, accounts=100)
+    main.validate_options(request, sync=True)
+    assert request.enrich_concurrency == main.MAX_JOB_ENRICH_CONCURRENCY
+    assert request.accounts == main.MAX_JOB_ACCOUNTS
+    client = TestClient(main.app)
+    assert client.post('/api/jobs', json={'channel_link': '@test', 'enrich_concurrency': 0}).status_code == 400
+
+
+def test_identical_submissions_share_one_job(tmp_path):
+    parser = FakeParser(tmp_path, delay=0.02)
+
+    async def run():
+        manager = JobManager(parser)
+        first = manager.submit({'channel_link': '@test'}, key='k')
+        second = manager.submit({'channel_link': 'https://t.me/test'}, key='k')
+        other = manager.submit({'channel_link': '@other'}, key='other')
+        await wait_finished([first, other])
+        # После завершения тот же запрос снова запускает парсинг
+        again = manager.submit({'channel_link': '@test'}, key='k')
+        await wait_finished([again])
+        return first, second, other, again, manager.coalesced
+
+    first, second, other, again, coalesced = asyncio.run(run())
+    assert second is first
+    assert other is not first
+    assert again is not first and again.status == 'done'
+    assert coalesced == 1
@@ -0,0 +1,33 @@
+import io
+import json
+
+from app.exporters import NdjsonExporter
+from app.member_store import MemberStore
+
+
+def test_store_round_trips_rows():
+    store = MemberStore()
+    rows = [
+        {'user_id': 5000000001, 'first_name': 'Анна', 'last_name': '', 'username': 'anna', 'bio': 'Привет 👋'},
+        {'user_id': 2, 'first_name': 'Bob', 'last_name': None, 'username': '', 'bio': ''},
+    ]
+    store.extend(rows)
+
+    assert len(store) == 2
+    assert store[0] == rows[0]
+    assert store[-1] == {'user_id': 2, 'first_name': 'Bob', 'last_name': '', 'username': '', 'bio': ''}
+    assert store.value(0, 'bio') == 'Привет 👋'
+    assert list(store.user_ids()) == [5000000001, 2]
+
+
+def test_exporter_reads_store_directly():
+    store = MemberStore()
+    store.extend({'user_id': i, 'first_name': f'user{i}'} for i in range(1, 4))
+    buffer = io.BytesIO()
+    exporter = NdjsonExporter(buffer)
+    exporter.write_rows(store)
+    exporter.close()
+
+    records = [json.loads(line) for line in buffer.getvalue().decode('utf-8').splitlines()]
+    assert [record['first_name'] for record in records] == ['user1', 'user2', 'user3']
+    assert exporter.rows == 3
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from telethon.errors import ChatAdminRequiredError
+from telethon.tl.functions.channels import GetParticipantsRequest
+
+from tests.fake_client import FakeTelegramClient
+from app.membership import MembershipManager
+
+
+async def parse(fake_parser, client, membership, link):
+    return await fake_parser(client, auto_join=True, membership=membership).parse_channel(link)
+
+
+def test_concurrent_jobs_share_one_join_and_leave_later(fake_parser):
+    client = FakeTelegramClient(page_latency=0.01)
+    channel = client.add_channel('closed', 500, requires_join=True)
+
+    async def scenario():
+        membership = MembershipManager(client, leave_delay=0.05)
+        results = await asyncio.gather(*(parse(fake_parser, client, membership, '@closed') for _ in range(3)))
+        # Все задачи закончились, но выход отложен
+        assert channel.id in client.joined
+        assert membership.stats()['pending_leaves'] == 1
+        # Задача в пределах задержки отменяет выход и не вступает заново
+        await parse(fake_parser, client, membership, '@closed')
+        await asyncio.sleep(0.1)
+        return membership, results
+
+    membership, results = asyncio.run(scenario())
+    assert all(result['total_users'] == 500 for result in results)
+    assert client.calls['JoinChannelRequest'] == 1
+    assert client.calls['LeaveChannelRequest'] == 1
+    assert channel.id not in client.joined
+    assert membership.stats()['shared'] >= 2
+
+
+def test_existing_membership_is_never_left(fake_parser):
+    client = FakeTelegramClient()
+    channel = client.add_channel('mine', 50, requires_join=True)
+    client.joined.add(channel.id)
+
+    async def scenario():
+        membership = MembershipManager(client, leave_delay=0)
+        for _ in range(2):
+            await parse(fake_parser, client, membership, '@mine')
+        return membership
+
+    membership = asyncio.run(scenario())
+    # Поле left у сущности заменяет проверочный запрос
+    assert membership.probes == 0
+    assert client.calls['JoinChannelRequest'] == 0
+    assert client.calls['LeaveChannelRequest'] == 0
+    assert channel.id in client.joined
+
+
+def test_public_channel_probed_once_without_join(fake_parser):
+    client = FakeTelegramClient()
+    client.add_channel('open', 30)
+
+    async def scenario():
+        membership = MembershipManager(client, leave_delay=0)
+        for _ in range(3):
+            await parse(fake_parser, client, membership, '@open')
+        return membership
+
+    membership = asyncio.run(scenario())
+    assert membership.probes == 1
+    assert client.calls['JoinChannelRequest'] == 0
+    assert client.calls['LeaveChannelRequest'] == 0
+
+
+def test_close_flushes_pending_leaves(fake_parser):
+    client = FakeTelegramClient()
+    channels = [client.add_channel(f'c{i}', 10, requires_join=True) for i in range(3)]
+
+    async def scenario():
+        membership = MembershipManager(client, leave_delay=3600)
+        for channel in channels:
+            await parse(fake_parser, client, membership, f'@{channel.username}')
+        assert len(client.joined) == 3
+        await membership.close()
+
+    asyncio.run(scenario())
+    assert client.joined == set()
+    assert client.calls['LeaveChannelRequest'] == 3
+
+
+def test_admin_required_probe_means_access():
+    client = FakeTelegramClient()
+    channel = client.add_channel('news', 10, broadcast=True)
+
+    async def call(request):
+        if isinstance(request, GetParticipantsRequest):
+            raise ChatAdminRequiredError(request=request)
+        return await client(request)
+
+    async def scenario():
+        membership = MembershipManager(call, leave_delay=0)
+        assert await membership.acquire(channel.entity)
+        await membership.release(channel.entity)
+        return membership.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats['probes'] == 1 and stats['joins'] == 0 and stats['leaves'] == 0
+    assert client.calls['JoinChannelRequest'] == 0
+
+
+def test_kicked_account_rechecks_access_and_joins_again(fake_parser):
+    client = FakeTelegramClient()
+    channel = client.add_channel('closed', 20, requires_join=True)
+
+    async def scenario():
+        membership = MembershipManager(client, leave_delay=3600)
+        await parse(fake_parser, client, membership, '@closed')
+        # Аккаунт исключили, пока вступление было запомнено
+        client.joined.discard(channel.id)
+        with pytest.raises(Exception, match='ChannelPrivate|private'):
+            await parse(fake_parser, client, membership, '@closed')
+        assert membership.stats()['member_of'] == 0 and membership.stats()['pending_leaves'] == 0
+        return await parse(fake_parser, client, membership, '@closed')
+
+    result = asyncio.run(scenario())
+    assert result['total_users'] == 20
+    assert client.calls['JoinChannelRequest'] == 2
+    assert client.calls['LeaveChannelRequest'] == 0
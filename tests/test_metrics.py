@@ -0,0 +1,53 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from app import main
+from tests.fake_client import FakeTelegramClient
+from app.metrics import Registry, API_CALLS, FLOOD_WAITS, STAGE_SECONDS, USERS
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    calls = registry.counter('calls_total', 'Запросы', ('method',))
+    latency = registry.histogram('latency_seconds', 'Задержка', buckets=(0.1, 1))
+    calls.inc(method='GetFullUserRequest')
+    calls.inc(2, method='GetFullUserRequest')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+    assert '# TYPE calls_total counter' in text
+    assert 'calls_total{method="GetFullUserRequest"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'latency_seconds_count 3' in text
+
+
+def test_parse_records_stages_and_api_calls(monkeypatch, fake_parser):
+    client = FakeTelegramClient(flood_every=50, flood_seconds=0)
+    client.add_channel('metered', 300)
+    parser = fake_parser(client, parse_bio=True)
+    bio_calls = API_CALLS.value(method='GetFullUserRequest', outcome='ok')
+    flood_waits = FLOOD_WAITS.value(method='GetFullUserRequest')
+    enriched = USERS.value(stage='enriched')
+    pages = STAGE_SECONDS.value(stage='participants_page')['count']
+    asyncio.run(parser.parse_channel('@metered'))
+
+    assert API_CALLS.value(method='GetFullUserRequest', outcome='ok') - bio_calls == 300
+    assert FLOOD_WAITS.value(method='GetFullUserRequest') > flood_waits
+    assert USERS.value(stage='enriched') - enriched == 300
+    assert STAGE_SECONDS.value(stage='participants_page')['count'] - pages == 3
+    assert STAGE_SECONDS.value(stage='export')['count'] > 0
+
+    async def no_pool():
+        pass
+
+    monkeypatch.setattr(main.get_services().client_pool, 'start', no_pool)
+    with TestClient(main.app) as http:
+        response = http.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'parser_stage_seconds_bucket{stage="bio",le="0.005"}' in response.text
+    assert 'parser_jobs{status="running"} 0' in response.text
@@ -0,0 +1,74 @@
+import asyncio
+from types import SimpleNamespace
+
+from telethon.tl.types import User
+from app.profile_cache import ProfileCache
+
+
+class BioClient:
+    """Заглушка клиента, считающая запросы GetFullUserRequest"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        return SimpleNamespace(full_user=SimpleNamespace(about=f'bio {request.id.id}'))
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'), ttl=60, clock=clock)
+    cache.put(1, bio='hello', username='user1')
+
+    assert cache.get(1)['bio'] == 'hello'
+    clock.now += 61
+    assert cache.get(1) is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['expired'] == 1
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'), max_entries=2, clock=clock)
+    cache.put(1, bio='one')
+    clock.now += 1
+    cache.put(2, bio='two')
+    clock.now += 1
+    cache.get(1)
+    clock.now += 1
+    cache.put(3, bio='three')
+
+    assert cache.get(2) is None
+    assert cache.get(1)['bio'] == 'one'
+    assert cache.get(3)['bio'] == 'three'
+    assert cache.evictions == 1
+    cache.close()
+
+
+def test_cache_persists_between_instances(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = ProfileCache(path)
+    cache.put(1, bio='persisted')
+    cache.close()
+
+    cache = ProfileCache(path)
+    assert cache.get(1)['bio'] == 'persisted'
+    cache.close()
+
+
+def test_get_user_bio_calls_api_only_on_miss(tmp_path, fake_parser):
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'))
+    parser = fake_parser(BioClient(), parse_bio=True, profile_cache=cache)
+    user = User(id=7, access_hash=7)
+
+    async def run():
+        return [await parser.get_user_bio(user) for _ in range(3)]
+
+    try:
+        bios = asyncio.run(run())
+    finally:
+        cache.close()
+
+    assert bios == ['bio 7'] * 3
+    assert parser.client.calls == 1
@@ -0,0 +1,100 @@
+import asyncio
+import csv
+
+from telethon.tl.functions.users import GetFullUserRequest
+from telethon.tl.types import User, UserStatusOnline, UserStatusRecently
+from tests.fake_client import FakeTelegramClient
+from app.profile_cache import ProfileCache
+
+
+def read_rows(path):
+    with open(path, encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def refresh(fake_parser, client, cache, user_ids, **kwargs):
+    result = asyncio.run(fake_parser(client, profile_cache=cache, **kwargs).refresh_profiles(user_ids))
+    return result, read_rows(result['filename'])
+
+
+def test_refresh_uses_batched_get_users(tmp_path, fake_parser):
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'))
+    client = FakeTelegramClient()
+    client.add_channel('big', 450)
+    parser = fake_parser(client, profile_cache=cache)
+    asyncio.run(parser.parse_channel('@big'))
+
+    # Профили изменились после обхода: обновление видит новые имена и флаги
+    client._users.update({
+        1: User(id=1, first_name='renamed', username='new1', access_hash=1, premium=True,
+                status=UserStatusOnline(expires=None)),
+        2: User(id=2, first_name='gone', access_hash=2, deleted=True, status=UserStatusRecently()),
+    })
+    client.calls.clear()
+    result, rows = refresh(fake_parser, client, cache, list(range(1, 451)) + [1], parse_username=True)
+
+    assert client.calls['GetUsersRequest'] == 3
+    assert client.calls['GetFullUserRequest'] == 0
+    assert result['requested_users'] == 450 and result['unresolved_users'] == 0
+    assert [int(row['user_id']) for row in rows] == list(range(1, 451))
+    assert rows[0]['first_name'] == 'renamed' and rows[0]['username'] == 'new1'
+    assert rows[0]['status'] == 'online' and rows[0]['premium'] == 'True'
+    assert rows[1]['deleted'] == 'True' and rows[1]['status'] == 'recently'
+    assert rows[2]['premium'] == 'False' and rows[2]['status'] == ''
+    cache.close()
+
+
+def test_full_user_only_for_stale_bio(tmp_path, fake_parser, clock):
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'), ttl=60, clock=clock)
+    client = FakeTelegramClient()
+    client.add_channel('big', 10)
+    parser = fake_parser(client, profile_cache=cache, parse_bio=True)
+    asyncio.run(parser.parse_channel('@big'))
+    assert len(client.bio_requests) == 10
+
+    clock.now += 61
+    cache.put(3, bio='fresh bio')
+    client.bio_requests.clear()
+    result, rows = refresh(fake_parser, client, cache, range(1, 11), parse_bio=True)
+
+    assert sorted(client.bio_requests) == [1, 2, 4, 5, 6, 7, 8, 9, 10]
+    assert client.calls['GetUsersRequest'] == 1
+    assert rows[2]['bio'] == 'fresh bio' and rows[0]['bio'] == 'bio 1'
+    cache.close()
+
+
+def test_unknown_and_foreign_users_are_unresolved(tmp_path, fake_parser):
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'))
+    client = FakeTelegramClient()
+    client.add_channel('big', 5)
+    parser = fake_parser(client, profile_cache=cache)
+    asyncio.run(parser.parse_channel('@big'))
+    # Пользователь, увиденный другой сессией: её access_hash этой сессии не подходит
+    cache.put_users('other_session', [{'user_id': 100, 'access_hash': 100}])
+    # access_hash устарел: API возвращает UserEmpty
+    cache.put_users('user_session', [{'user_id': 5, 'access_hash': 12345}])
+
+    result, rows = refresh(fake_parser, client, cache, [1, 2, 3, 4, 5, 100, 999])
+
+    assert [int(row['user_id']) for row in rows] == [1, 2, 3, 4]
+    assert result['unresolved_users'] == 3
+    cache.close()
+
+
+def test_refresh_survives_long_flood_wait(tmp_path, fake_parser):
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'), ttl=0)
+    client = FakeTelegramClient()
+    client.add_channel('big', 100)
+    parser = fake_parser(client, profile_cache=cache)
+    asyncio.run(parser.parse_channel('@big'))
+
+    client.inject_flood(GetFullUserRequest, after=10, seconds=3600)
+    parser = fake_parser(client, profile_cache=cache, parse_bio=True, enrich_concurrency=1)
+    parser.rate_limiter.max_flood_wait = 60
+
+    result = asyncio.run(parser.refresh_profiles(list(range(1, 101))))
+    rows = read_rows(result['filename'])
+    assert result['total_users'] == 100
+    assert sum(1 for row in rows if row['bio']) == 10
+    assert result['not_enriched'] == 90 and result['retry_after'] > 3000
+    cache.close()
@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import User
+from app.rate_limiter import AdaptiveRateLimiter
+
+
+class FloodingClient:
+    """Заглушка клиента: первые ``floods`` запросов завершаются FloodWaitError"""
+
+    def __init__(self, floods, seconds):
+        self.floods = floods
+        self.seconds = seconds
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        if self.calls <= self.floods:
+            raise FloodWaitError(request=request, capture=self.seconds)
+        return SimpleNamespace(full_user=SimpleNamespace(about='bio'))
+
+
+def make_limiter(clock, **kwargs):
+    return AdaptiveRateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket_paces_requests(clock):
+    limiter = make_limiter(clock, rate=2, max_rate=2, burst=1)
+
+    async def run():
+        for _ in range(5):
+            await limiter.acquire()
+
+    asyncio.run(run())
+    assert clock.now == 2.0
+    assert limiter.requests == 5
+    assert limiter.waits == 4
+
+
+def test_flood_wait_is_honored_and_slows_down(clock):
+    limiter = make_limiter(clock, rate=10)
+    client = FloodingClient(floods=1, seconds=30)
+
+    result = asyncio.run(limiter.call(client, 'request'))
+
+    assert result.full_user.about == 'bio'
+    assert client.calls == 2
+    assert clock.now >= 30
+    assert limiter.flood_waits == 1
+    assert limiter.rate < 10
+
+
+def test_long_flood_wait_is_raised(clock):
+    limiter = make_limiter(clock, max_flood_wait=60)
+    client = FloodingClient(floods=1, seconds=3600)
+
+    try:
+        asyncio.run(limiter.call(client, 'request'))
+    except FloodWaitError as e:
+        assert e.seconds == 3600
+    else:
+        raise AssertionError('FloodWaitError was not raised')
+    assert clock.now == 0
+    assert limiter.flood_waits == 1
+    # Остальные запросы ждут не дольше max_flood_wait
+    assert limiter.blocked_for() == 60
+
+
+def test_rate_grows_while_healthy(clock):
+    limiter = make_limiter(clock, rate=1, max_rate=4)
+    client = FloodingClient(floods=0, seconds=0)
+
+    async def run():
+        for _ in range(50):
+            await limiter.call(client, 'request')
+
+    asyncio.run(run())
+    assert limiter.rate == 4
+    assert limiter.flood_waits == 0
+
+
+def test_parser_bio_survives_flood_wait(fake_parser, clock):
+    parser = fake_parser(FloodingClient(floods=2, seconds=5), parse_bio=True, rate_limiter=make_limiter(clock))
+    bio = asyncio.run(parser.get_user_bio(User(id=1, access_hash=1)))
+
+    assert bio == 'bio'
+    assert parser.rate_limiter.stats()['flood_waits'] == 2
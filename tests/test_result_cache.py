@@ -0,0 +1,172 @@
+import asyncio
+import os
+
+import pytest
+
+from app.entity_cache import normalize_link, cache_key
+from app.client_pool import ClientPool
+from tests.fake_client import FakeTelegramClient
+from app.jobs import Job
+from app.rate_limiter import AdaptiveRateLimiter
+from app.result_cache import ResultCache, SingleFlight, result_key, request_key
+from app.worker import JobRunner
+
+
+def write_file(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def test_key_ignores_link_form_and_non_content_options():
+    options = {'parse_bio': True, 'parse_username': False, 'format': 'csv', 'filter': None, 'sharded': False}
+    keys = {
+        result_key([cache_key(*normalize_link(link))], {**options, 'enrich_concurrency': concurrency})
+        for link, concurrency in (('@Durov', 8), ('https://t.me/durov', 16), ('durov', 1))
+    }
+    assert len(keys) == 1
+    assert result_key([cache_key(*normalize_link('@durov'))], {**options, 'parse_bio': False}) not in keys
+
+
+def test_put_get_and_ttl(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / 'cache'), ttl=60, clock=clock)
+    source = write_file(str(tmp_path), 'durov.csv', 10)
+
+    entry = cache.put('k1', source, 'durov.csv', {'total_users': 3})
+    assert not os.path.exists(source)
+    assert entry.path.endswith('k1.csv')
+
+    hit = cache.get('k1')
+    assert hit.filename == 'durov.csv' and hit.meta == {'total_users': 3}
+    with hit.open() as f:
+        assert f.read() == b'x' * 10
+
+    clock.now += 61
+    assert cache.get('k1') is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    cache.close()
+
+
+def test_eviction_by_size_keeps_recently_used(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / 'cache'), ttl=600, max_bytes=250, clock=clock)
+    for name in ('a', 'b'):
+        clock.now += 1
+        cache.put(name, write_file(str(tmp_path), name, 100), f'{name}.csv')
+    clock.now += 1
+    cache.get('a')
+
+    clock.now += 1
+    cache.put('c', write_file(str(tmp_path), 'c', 100), 'c.csv')
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['bytes'] == 200
+    assert not os.path.exists(os.path.join(str(tmp_path / 'cache'), 'b.csv'))
+
+    # Файл больше всего кэша остаётся, вытесняется остальное
+    cache.put('big', write_file(str(tmp_path), 'big', 300), 'big.csv')
+    assert cache.stats()['entries'] == 1 and cache.get('big') is not None
+    cache.close()
+
+
+def test_open_file_survives_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), ttl=600, max_bytes=150)
+    cache.put('a', write_file(str(tmp_path), 'a', 100), 'a.csv')
+    f = cache.get('a').open()
+    cache.put('b', write_file(str(tmp_path), 'b', 100), 'b.csv')
+    assert cache.get('a') is None
+    assert f.read() == b'x' * 100
+    f.close()
+    cache.close()
+
+
+def test_single_flight_coalesces_identical_calls():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def run():
+        results = await asyncio.gather(*(flights.run('k', work) for _ in range(5)))
+        assert 'k' not in flights
+        # Следующий вызов после завершения выполняется заново
+        await flights.run('k', work)
+        return results
+
+    assert asyncio.run(run()) == ['result'] * 5
+    assert len(calls) == 2
+    assert flights.coalesced == 4
+
+
+def test_single_flight_shares_errors_and_survives_cancelled_waiter():
+    flights = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError('канал не найден')
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return 'ok'
+
+    async def run():
+        results = await asyncio.gather(flights.run('bad', failing), flights.run('bad', failing),
+                                       return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+        first = asyncio.create_task(flights.run('k', slow))
+        second = asyncio.create_task(flights.run('k', slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == 'ok'
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(run())
+
+
+def test_request_key_skips_results_that_depend_on_state():
+    options = {'parse_bio': False, 'parse_username': False, 'format': 'csv', 'filter': None,
+               'sharded': False, 'incremental': False}
+    assert request_key({**options, 'channel_link': '@Durov'}) == request_key({**options, 'channel_link': 't.me/durov'})
+    assert request_key({**options, 'channel_link': '@durov', 'incremental': True}) is None
+    assert request_key({**options, 'user_ids': [1, 2]}) is None
+
+
+def test_job_runner_serves_repeated_job_from_cache(tmp_path):
+    client = FakeTelegramClient()
+    client.add_channel('test', 20)
+    pool = ClientPool(1, 'test', str(tmp_path), session_names=['main'], health_check_interval=0,
+                      client_factory=lambda name: client,
+                      rate_limiter_factory=lambda: AdaptiveRateLimiter(rate=1e6, max_rate=1e6))
+    cache = ResultCache(str(tmp_path / 'cache'), ttl=60)
+    runner = JobRunner(pool, None, None, None, cache)
+    params = {'parse_bio': False, 'parse_username': False, 'enrich_concurrency': 1, 'format': 'csv',
+              'incremental': False, 'filter': None, 'sharded': False}
+
+    calls = []
+
+    async def run():
+        await pool.start()
+        try:
+            results = []
+            for link in ('@test', 'https://t.me/test'):
+                job = Job({**params, 'channel_link': link})
+                job.output_dir = str(tmp_path / job.id)
+                results.append(await runner(job))
+                calls.append(client.calls['total'])
+            return results
+        finally:
+            await pool.stop()
+
+    parsed, cached = asyncio.run(run())
+    assert 'cached' not in parsed and cached['cached']
+    assert cached['total_users'] == parsed['total_users'] == 20
+    with open(parsed['filename'], 'rb') as a, open(cached['filename'], 'rb') as b:
+        assert a.read() == b.read()
+    # Второй запрос к Telegram не обращался
+    assert calls[0] > 0 and calls[1] == calls[0]
+    assert cache.stats()['hits'] == 1
@@ -0,0 +1,51 @@
+import asyncio
+import csv
+import random
+
+from telethon.tl.types import User
+from tests.fake_client import FakeTelegramClient
+from app.sharding import CompactIdSet
+
+
+def make_users(count, unsearchable=0):
+    names = random.Random(1)
+    users = [User(id=i, first_name=''.join(names.choice('abcdefghijklmnopqrstuvwxyzабвгд') for _ in range(4)),
+                  access_hash=i) for i in range(1, count + 1)]
+    # Имена без букв алфавита шардов поиском по префиксам не находятся
+    users += [User(id=count + i, first_name='😀', access_hash=i) for i in range(1, unsearchable + 1)]
+    return users
+
+
+def parse(fake_parser, client, sharded):
+    parser = fake_parser(client, sharded=sharded, shard_concurrency=4)
+    parser.shard_saturation = 300
+    result = asyncio.run(parser.parse_channel('@huge'))
+    with open(result['filename'], encoding='utf-8-sig') as f:
+        return result, [int(row['user_id']) for row in csv.DictReader(f)]
+
+
+def test_sharded_enumeration_gets_past_listing_limit(fake_parser):
+    client = FakeTelegramClient(listing_limit=300)
+    client.add_channel('huge', make_users(3000, unsearchable=5))
+
+    result, ids = parse(fake_parser, client, sharded=False)
+    assert len(ids) == 300
+
+    result, ids = parse(fake_parser, client, sharded=True)
+    assert sorted(ids) == list(range(1, 3001))
+    coverage = result['coverage']
+    assert coverage['channel_total'] == 3005
+    assert coverage['unique_users'] == 3000
+    assert coverage['coverage'] == round(3000 / 3005, 4)
+    assert coverage['split_shards'] == 1
+    assert not coverage['truncated_shards']
+
+
+def test_compact_id_set():
+    ids = CompactIdSet(buffer_size=4)
+    assert all(ids.add(i) for i in [5, 3, 9, 1, 7, 2])
+    assert not ids.add(3)
+    assert not ids.add(7)
+    assert len(ids) == 6
+    assert 9 in ids and 4 not in ids
+    assert list(ids._sorted) == [1, 3, 5, 9]
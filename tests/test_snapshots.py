@@ -0,0 +1,117 @@
+import asyncio
+import csv
+
+import pytest
+
+from telethon.tl.types import User
+from tests.fake_client import FakeTelegramClient
+from app.profile_cache import ProfileCache
+from app.snapshots import SnapshotStore
+from app import telegram_parser
+
+
+def make_users(ids, renamed=()):
+    return [User(id=i, first_name=f'new{i}' if i in renamed else f'user{i}', access_hash=i) for i in ids]
+
+
+def run_incremental(fake_parser, tmp_path, users):
+    client = FakeTelegramClient(bio=lambda user: f'bio {user.first_name}')
+    client.add_channel('daily', users)
+    cache = ProfileCache(str(tmp_path / 'cache.sqlite'))
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    parser = fake_parser(client, parse_bio=True, profile_cache=cache, incremental=True, snapshot_store=store)
+    try:
+        result = asyncio.run(parser.parse_channel('@daily'))
+        with open(result['delta_filename'], encoding='utf-8-sig') as f:
+            delta = {int(row['user_id']): row for row in csv.DictReader(f)}
+    finally:
+        cache.close()
+        store.close()
+    return client, result, delta
+
+
+def test_rerun_enriches_only_churn(tmp_path, fake_parser):
+    client, result, delta = run_incremental(fake_parser, tmp_path, make_users(range(1, 301)))
+    assert result['baseline']
+    assert result['joined'] == 300
+    assert len(client.bio_requests) == 300
+    assert len(delta) == 300
+
+    client, result, delta = run_incremental(fake_parser, tmp_path, make_users(range(51, 351), renamed={100}))
+    assert not result['baseline']
+    assert result['total_users'] == 300
+    assert (result['joined'], result['changed'], result['left']) == (50, 1, 50)
+    assert len(client.bio_requests) == 51
+    assert delta[100]['change'] == 'changed'
+    assert delta[100]['bio'] == 'bio new100'
+    assert delta[1]['change'] == 'left'
+    assert delta[1]['first_name'] == 'user1'
+    assert delta[350]['change'] == 'joined'
+    assert len(delta) == 101
+
+
+def test_aborted_run_keeps_previous_snapshot(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    writer = store.writer(1)
+    for user in make_users(range(1, 11)):
+        writer.add(user)
+    writer.commit()
+
+    writer = store.writer(1)
+    writer.add(make_users([99])[0])
+    writer.abort()
+
+    assert sorted(store.load(1)) == list(range(1, 11))
+    store.close()
+
+
+def test_concurrent_writers_get_separate_generations(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    other = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    first, second = store.writer(1), other.writer(1)
+    assert first.generation != second.generation
+    for user in make_users(range(1, 6)):
+        first.add(user)
+    for user in make_users(range(100, 103)):
+        second.add(user)
+
+    # Более новое поколение опубликовано раньше: отставший запуск отбрасывается
+    assert second.commit()
+    assert not first.commit()
+    assert sorted(store.load(1)) == [100, 101, 102]
+
+    third = store.writer(1)
+    assert third.generation > second.generation
+    for user in make_users([7]):
+        third.add(user)
+    assert third.commit()
+    assert sorted(other.load(1)) == [7]
+    store.close()
+    other.close()
+
+
+def test_delta_file_is_closed_when_exporter_fails(tmp_path, monkeypatch, fake_parser):
+    opened = []
+    exporter_class = telegram_parser.get_exporter_class('csv')
+
+    class FailingDeltaExporter(exporter_class):
+        def __init__(self, file, columns=None):
+            if columns is not None:
+                opened.append(file)
+                raise ValueError('экспорт недоступен')
+            super().__init__(file)
+
+    monkeypatch.setattr(telegram_parser, 'get_exporter_class', lambda output_format: FailingDeltaExporter)
+    with pytest.raises(Exception, match='экспорт недоступен'):
+        run_incremental(fake_parser, tmp_path, make_users(range(1, 11)))
+    assert opened and opened[0].closed
+
+
+def test_incremental_rejects_sharded_enumeration(tmp_path, fake_parser):
+    # Шард, обрезанный на насыщении, записал бы недосчитанных участников вышедшими
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    try:
+        with pytest.raises(ValueError, match='шардированным'):
+            fake_parser(incremental=True, sharded=True, snapshot_store=store)
+    finally:
+        store.close()
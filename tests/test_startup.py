@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, **env):
+    environ = {key: value for key, value in os.environ.items() if key not in ('API_ID', 'API_HASH')}
+    environ.update(env)
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=environ, cwd=ROOT)
+
+
+def test_main_import_does_not_load_telegram_stack(tmp_path):
+    completed = run_python(
+        'import sys, app.main\n'
+        'print(sorted({m.split(".")[0] for m in sys.modules} & {"telethon", "pandas", "openpyxl"}))',
+        API_ID='1', API_HASH='test', SESSIONS_DIR=str(tmp_path)
+    )
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.strip() == '[]'
+
+
+def test_credentials_checked_on_first_use_not_on_import(tmp_path):
+    completed = run_python(
+        'import app.main\n'
+        'from app.config import get_settings\n'
+        'try:\n'
+        '    get_settings()\n'
+        'except ValueError as e:\n'
+        '    print("error:", e)',
+        SESSIONS_DIR=str(tmp_path)
+    )
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.startswith('error:')
+
+
+def test_services_files_follow_sessions_dir(tmp_path):
+    completed = run_python('import app.services', API_ID='1', API_HASH='test', SESSIONS_DIR=str(tmp_path))
+    assert completed.returncode == 0, completed.stderr
+    assert {'profile_cache.sqlite', 'snapshots.sqlite', 'entities.sqlite', 'results_cache'} <= set(os.listdir(tmp_path))
@@ -0,0 +1,170 @@
+import asyncio
+import os
+
+import pytest
+
+from app.job_store import JobStore, StoreJobManager
+from app.jobs import QueueFullError
+from app.worker import Worker
+
+
+class FakeRunner:
+    """Имитирует JobRunner: отчитывается о прогрессе и пишет файл в директорию задачи"""
+
+    def __init__(self, users=5, delay=0.01):
+        self.users = users
+        self.delay = delay
+        self.started = []
+
+    async def __call__(self, job):
+        self.started.append(job.id)
+        for enriched in range(1, self.users + 1):
+            await asyncio.sleep(self.delay)
+            job.update_progress({'stage': 'parsing', 'total': self.users, 'enriched': enriched})
+        os.makedirs(job.output_dir, exist_ok=True)
+        filename = os.path.join(job.output_dir, 'result.csv')
+        with open(filename, 'wb') as f:
+            f.write(b'result')
+        return {'success': True, 'filename': filename, 'format': 'csv', 'total_users': self.users}
+
+
+def make_store(tmp_path, **kwargs):
+    return JobStore(str(tmp_path / 'jobs.sqlite'), str(tmp_path / 'results'), **kwargs)
+
+
+def test_each_job_is_claimed_once_across_processes(tmp_path):
+    api = make_store(tmp_path)
+    workers = [make_store(tmp_path) for _ in range(2)]
+    ids = {api.enqueue({'n': i}) for i in range(5)}
+
+    claimed = []
+    while True:
+        batch = [store.claim(f'w{i}') for i, store in enumerate(workers)]
+        batch = [item for item in batch if item]
+        if not batch:
+            break
+        claimed += [job_id for job_id, _ in batch]
+    assert sorted(claimed) == sorted(ids)
+    assert api.counts()['running'] == 5
+
+
+def test_queue_limit_and_cancel_before_start(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.enqueue({}, max_queued=1)
+    with pytest.raises(QueueFullError):
+        store.enqueue({}, max_queued=1)
+    assert store.request_cancel(job_id)
+    assert store.get(job_id)['status'] == 'cancelled'
+    assert store.claim('w') is None
+
+
+def test_api_expires_finished_jobs_periodically(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.enqueue({}, max_queued=1)
+    store.request_cancel(job_id)
+
+    async def run():
+        api = StoreJobManager(store, result_ttl=-1, expire_interval=0.01)
+        api.start()
+        await asyncio.sleep(0.05)
+        expired = api.get(job_id) is None
+        await api.shutdown()
+        return expired
+
+    assert asyncio.run(run())
+
+
+def test_stale_jobs_return_to_queue(tmp_path):
+    now = [1000.0]
+    store = make_store(tmp_path, stale_timeout=30, clock=lambda: now[0])
+    job_id = store.enqueue({})
+    store.claim('dead-worker')
+    now[0] += 31
+    assert store.requeue_stale() == 1
+    assert store.claim('alive')[0] == job_id
+
+
+def test_worker_runs_jobs_from_store(tmp_path):
+    api = StoreJobManager(make_store(tmp_path))
+    runner = FakeRunner()
+
+    async def run():
+        worker = Worker(make_store(tmp_path), runner, max_concurrent_jobs=2, poll_interval=0.01,
+                        heartbeat_interval=0.01)
+        serving = asyncio.create_task(worker.run())
+        jobs = [api.submit({'channel_link': f'@c{i}'}) for i in range(3)]
+        events = [event async for event in jobs[0].watch(interval=0.01, heartbeat=1)]
+        while not all(api.get(job.id).finished for job in jobs):
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await serving
+        return jobs, events
+
+    jobs, events = asyncio.run(run())
+    for job in jobs:
+        job = api.get(job.id)
+        assert job.status == 'done'
+        assert job.to_dict()['total_users'] == 5
+        with open(job.result['filename'], 'rb') as f:
+            assert f.read() == b'result'
+    assert events[-1]['status'] == 'done'
+    assert events[-1]['enriched'] == 5
+
+
+def test_cancel_and_shutdown_of_running_jobs(tmp_path):
+    api = StoreJobManager(make_store(tmp_path))
+
+    async def run():
+        worker = Worker(make_store(tmp_path), FakeRunner(users=1000), max_concurrent_jobs=2,
+                        poll_interval=0.01, heartbeat_interval=0.01)
+        serving = asyncio.create_task(worker.run())
+        cancelled, interrupted = api.submit({}), api.submit({})
+        while api.get(interrupted.id).status != 'running':
+            await asyncio.sleep(0.01)
+        assert api.cancel(cancelled.id)
+        while not api.get(cancelled.id).finished:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await serving
+        return cancelled, interrupted
+
+    cancelled, interrupted = asyncio.run(run())
+    assert api.get(cancelled.id).status == 'cancelled'
+    # Остановленный воркер возвращает незаконченную задачу в очередь
+    assert api.get(interrupted.id).status == 'queued'
+
+
+def test_worker_stops_job_taken_over_by_another(tmp_path):
+    store = make_store(tmp_path)
+    runner = FakeRunner(users=1000)
+
+    async def run():
+        worker = Worker(make_store(tmp_path), runner, poll_interval=0.01, heartbeat_interval=0.01,
+                        worker_id='slow')
+        serving = asyncio.create_task(worker.run())
+        job_id = store.enqueue({})
+        while store.get(job_id)['status'] != 'running':
+            await asyncio.sleep(0.01)
+        # Воркер счёлся зависшим: задачу вернули в очередь и её забрал другой
+        store.release(job_id, 'slow')
+        assert store.claim('fast')[0] == job_id
+        while worker._running:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await serving
+        return job_id
+
+    job_id = asyncio.run(run())
+    row = store.get(job_id)
+    assert row['status'] == 'running' and row['worker'] == 'fast'
+    assert not store.finish(job_id, 'slow', 'done')
+
+
+def test_identical_jobs_are_enqueued_once(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.enqueue({'channel_link': '@test'}, key='k')
+    assert store.enqueue({'channel_link': 'https://t.me/test'}, key='k') == job_id
+    assert store.enqueue({'channel_link': '@other'}, key='other') != job_id
+    # Отменённая задача не поглощает новые: запрос снова ставится в очередь
+    assert store.request_cancel(job_id)
+    assert store.enqueue({'channel_link': '@test'}, key='k') != job_id